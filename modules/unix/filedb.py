@@ -1,14 +1,24 @@
 import uos
+import uerrno
 import utime
 import ujson
 import urandom
-from ucollections import namedtuple
+from ucollections import namedtuple, OrderedDict
 
 
 class DB:
 
+    # One file per record: <name>/<table>/<pkey>
+
     def __init__(self, name):
         self.name = name
+        # in-memory table cache: table name -> OrderedDict(pkey -> row)
+        self._cache = {}
+        # secondary keys: table name -> {field: {value: row}}
+        self._keys = {}
+        # change counters: table name -> saves, epoch counts full reloads
+        self._versions = {}
+        self._epoch = 0
 
     def connect(self):
         pass
@@ -16,11 +26,328 @@ class DB:
     def close(self):
         pass
 
+    def fname(self, table, pkey):
+        return "%s/%s/%s" % (self.name, table, pkey)
+
+    def mktable(self, table, fail_silently=False):
+        for d in (self.name, "%s/%s" % (self.name, table)):
+            try:
+                uos.mkdir(d)
+            except OSError as e:
+                if fail_silently:
+                    pass
+                else:
+                    raise
+
+    def tables(self):
+        return [dirent[0] for dirent in uos.ilistdir(self.name) if dirent[0][0] != "." and dirent[1] == 16384]
+
+    def load(self, table):
+        rows = OrderedDict()
+        for dirent in uos.ilistdir("%s/%s" % (self.name, table)):
+            fname = dirent[0]
+            if fname[0] == "." or dirent[1] == 16384:
+                continue
+            with open(self.fname(table, fname)) as f:
+                rows[fname] = ujson.loads(f.read())
+        return rows
+
+    def store(self, table, pkey, row):
+        with open(self.fname(table, pkey), "w") as f:
+            f.write(ujson.dumps(row))
+
+    def remove(self, table, pkey):
+        uos.remove(self.fname(table, pkey))
+
+    def rows(self, table):
+        # return table cache, load it from flash once
+        try:
+            return self._cache[table]
+        except KeyError:
+            pass
+        rows = self.load(table)
+        self._cache[table] = rows
+        return rows
+
+    def keys(self, table):
+        try:
+            return self._keys[table]
+        except KeyError:
+            keys = self._keys[table] = {}
+            return keys
+
+    def version(self, table):
+        # changes whenever the table is saved or reloaded
+        return self._epoch + self._versions.get(table, 0)
+
+    def touch(self, table):
+        self._versions[table] = self._versions.get(table, 0) + 1
+
+    def invalidate(self, table=None):
+        # drop one table cache, or all of them
+        if table is None:
+            self._cache = {}
+            self._keys = {}
+            self._epoch += 1
+        else:
+            self._cache.pop(table, None)
+            self._keys.pop(table, None)
+            self.touch(table)
+
+
+class PackedDB(DB):
+
+    # One append-only file per table: <name>/<table>.tbl
+    # Every line is "<pkey>\t<json>\n", a line with empty json deletes
+    # the record, the last line for a pkey wins. <name>/<table>.idx holds
+    # the size of the .tbl file it covers and its dead line count, followed
+    # by "<pkey>\t<offset>" lines of the live records, so loading skips
+    # superseded records.
+
+    # rewrite table file when it has this many dead lines...
+    COMPACT_MIN = 16
+    # ...and they outnumber the live ones
+    COMPACT_RATIO = 1
+
+    def __init__(self, name):
+        super().__init__(name)
+        # table name -> OrderedDict(pkey -> offset of latest record)
+        self._index = {}
+        # table name -> number of superseded/deleted lines in table file
+        self._dead = {}
+
+    def path(self, table, ext="tbl"):
+        return "%s/%s.%s" % (self.name, table, ext)
+
+    def fname(self, table, pkey):
+        return "%s#%s" % (self.path(table), pkey)
+
+    def mktable(self, table, fail_silently=False):
+        try:
+            uos.mkdir(self.name)
+        except OSError as e:
+            if not fail_silently:
+                raise
+        # old one-file-per-record layout present? migrate it
+        self.migrate(table)
+
+    def tables(self):
+        return [dirent[0][:-4] for dirent in uos.ilistdir(self.name) if dirent[0][-4:] == ".tbl"]
+
+    def migrate(self, table):
+        # move <name>/<table>/<pkey> files into the table file
+        try:
+            files = [dirent[0] for dirent in uos.ilistdir("%s/%s" % (self.name, table)) if dirent[0][0] != "." and dirent[1] != 16384]
+        except OSError:
+            return False
+        for fname in files:
+            with open(DB.fname(self, table, fname)) as f:
+                self.store(table, fname, ujson.loads(f.read()))
+        for fname in files:
+            uos.remove(DB.fname(self, table, fname))
+        uos.rmdir("%s/%s" % (self.name, table))
+        self.invalidate(table)
+        self.compact(table)
+        return True
+
+    def _readidx(self, table):
+        try:
+            with open(self.path(table, "idx")) as f:
+                size, dead = [int(x) for x in f.readline().split()]
+                index = OrderedDict()
+                for l in f:
+                    pkey, off = l.rstrip("\n").split("\t")
+                    index[pkey] = int(off)
+        except (OSError, ValueError):
+            return None, None, 0
+        return size, index, dead
+
+    def _writeidx(self, table, size):
+        with open(self.path(table, "idx"), "w") as f:
+            f.write("%d %d\n" % (size, self._dead[table]))
+            for pkey, off in self._index[table].items():
+                f.write("%s\t%d\n" % (pkey, off))
+
+    def _replay(self, f, rows, index):
+        # apply table file lines from current position
+        # return dead lines and whether the last line was torn
+        dead = 0
+        while True:
+            off = f.tell()
+            l = f.readline()
+            if not l:
+                return dead, False
+            if l[-1:] != b"\n":
+                # torn write at end of file, ignore it
+                return dead + 1, True
+            try:
+                pkey, data = l[:-1].decode().split("\t", 1)
+                if data:
+                    data = ujson.loads(data)
+            except ValueError:
+                # line glued to an earlier torn write
+                dead += 1
+                continue
+            if pkey in rows:
+                dead += 1
+            if data:
+                rows[pkey] = data
+                index[pkey] = off
+            else:
+                dead += 1
+                if pkey in rows:
+                    del rows[pkey]
+                    del index[pkey]
+
+    def load(self, table):
+        path = self.path(table)
+        rows = OrderedDict()
+        index = OrderedDict()
+        try:
+            size = uos.stat(path)[6]
+        except OSError:
+            try:
+                # compaction interrupted after removing the old file
+                uos.rename(self.path(table, "tmp"), path)
+                size = uos.stat(path)[6]
+            except OSError:
+                self._index[table] = index
+                self._dead[table] = 0
+                return rows
+        covered, idx, dead = self._readidx(table)
+        with open(path, "rb") as f:
+            if idx is not None and covered <= size:
+                # live records through the index, skip superseded ones
+                for pkey, off in idx.items():
+                    f.seek(off)
+                    l = f.readline()
+                    if l[:len(pkey) + 1] != (pkey + "\t").encode():
+                        # stale index, fall back to a full replay
+                        rows = OrderedDict()
+                        index = OrderedDict()
+                        covered = dead = 0
+                        break
+                    rows[pkey] = ujson.loads(l[len(pkey) + 1:-1])
+                    index[pkey] = off
+            else:
+                covered = dead = 0
+            f.seek(covered)
+            tail, torn = self._replay(f, rows, index)
+        self._index[table] = index
+        self._dead[table] = dead + tail
+        if torn:
+            # terminate the torn line, next append starts on a fresh line
+            self._append(table, b"\n")
+            size += 1
+        if covered != size:
+            self._writeidx(table, size)
+        self.maintain(table)
+        return rows
+
+    def _append(self, table, line):
+        with open(self.path(table), "ab") as f:
+            off = f.tell()
+            f.write(line)
+        return off
+
+    def store(self, table, pkey, row):
+        if table not in self._index:
+            self.rows(table)
+        off = self._append(table, ("%s\t%s\n" % (pkey, ujson.dumps(row))).encode())
+        index = self._index[table]
+        if pkey in index:
+            self._dead[table] += 1
+        index[pkey] = off
+        self.maintain(table)
+
+    def remove(self, table, pkey):
+        if table not in self._index:
+            self.rows(table)
+        index = self._index[table]
+        if pkey not in index:
+            raise OSError(uerrno.ENOENT)
+        self._append(table, ("%s\t\n" % pkey).encode())
+        del index[pkey]
+        # old record and the delete line itself
+        self._dead[table] += 2
+        self.maintain(table)
+
+    def maintain(self, table):
+        # periodic compaction, only when enough dead lines piled up
+        dead = self._dead.get(table, 0)
+        if dead >= self.COMPACT_MIN and dead >= self.COMPACT_RATIO * len(self._index.get(table, ())):
+            self.compact(table)
+
+    def compact(self, table):
+        # copy the latest line of every live record into a new table file
+        if table not in self._index:
+            self.rows(table)
+        path = self.path(table)
+        tmp = self.path(table, "tmp")
+        index = OrderedDict()
+        try:
+            uos.remove(self.path(table, "idx"))
+        except OSError:
+            pass
+        try:
+            fin = open(path, "rb")
+        except OSError:
+            fin = None
+        with open(tmp, "wb") as fout:
+            for pkey, off in self._index[table].items():
+                fin.seek(off)
+                index[pkey] = fout.tell()
+                fout.write(fin.readline())
+            size = fout.tell()
+        if fin:
+            fin.close()
+            uos.remove(path)
+        uos.rename(tmp, path)
+        self._index[table] = index
+        self._dead[table] = 0
+        self._writeidx(table, size)
+
+    def invalidate(self, table=None):
+        super().invalidate(table)
+        if table is None:
+            self._index = {}
+            self._dead = {}
+        else:
+            self._index.pop(table, None)
+            self._dead.pop(table, None)
+
+
+def coercer(default):
+    # form values are strings: convert to the type of the schema default,
+    # None for fields that stay strings
+    if callable(default) or isinstance(default, str):
+        return None
+    if isinstance(default, bool):
+        return lambda value: value not in ("", "0", "off", "false")
+    if isinstance(default, int):
+        kind = int
+    elif isinstance(default, float):
+        kind = float
+    else:
+        return None
+    def coerce(value):
+        try:
+            return kind(value)
+        except ValueError:
+            pass
+        try:
+            return kind(float(value))
+        except ValueError:
+            # empty or invalid input, fall back to the default
+            return default
+    return coerce
+
+
 class Model:
 
     @classmethod
     def fname(cls, pkey):
-        return "%s/%s/%s" % (cls.__db__.name, cls.__table__, pkey)
+        return cls.__db__.fname(cls.__table__, pkey)
 
     @classmethod
     def mapkeys(cls, obj):
@@ -34,14 +361,76 @@ class Model:
     def create_table(cls, fail_silently=False):
         cls.__fields__ = list(cls.__schema__.keys())
         cls.Row = namedtuple(cls.__table__, cls.__fields__)
-        for d in (cls.__db__.name, "%s/%s" % (cls.__db__.name, cls.__table__)):
-            try:
-                uos.mkdir(d)
-            except OSError as e:
-                if fail_silently:
-                    pass
-                else:
-                    raise
+        cls.__db__.mktable(cls.__table__, fail_silently)
+
+    @classmethod
+    def rows(cls):
+        # table cache: pkey -> row dict
+        return cls.__db__.rows(cls.__table__)
+
+    @classmethod
+    def row(cls, pkey):
+        # cached record, same error as a missing record file
+        try:
+            return cls.rows()[pkey]
+        except KeyError:
+            raise OSError(uerrno.ENOENT)
+
+    @classmethod
+    def index(cls, field):
+        # secondary key: field value -> first row with that value
+        keys = cls.__db__.keys(cls.__table__)
+        try:
+            return keys[field]
+        except KeyError:
+            pass
+        index = {}
+        for row in cls.rows().values():
+            value = row.get(field)
+            if value not in index:
+                index[value] = row
+        keys[field] = index
+        return index
+
+    @classmethod
+    def lookup(cls, field, value):
+        # O(1) row lookup by secondary key, None if not found
+        return cls.index(field).get(value)
+
+    @classmethod
+    def coercers(cls):
+        # field -> converter, derived from __schema__ once per table
+        conv = getattr(cls, "_coercers", None)
+        if conv is None:
+            conv = {}
+            for k, v in cls.__schema__.items():
+                c = coercer(v)
+                if c:
+                    conv[k] = c
+            cls._coercers = conv
+        return conv
+
+    @classmethod
+    def from_form(cls, row, form):
+        # new record: row with the submitted fields it has, typed like the
+        # schema; row may be a cached record, update() commits the copy
+        row = dict(row)
+        conv = cls.coercers()
+        for k, v in form.items():
+            if k in row:
+                c = conv.get(k)
+                row[k] = c(v) if c and isinstance(v, str) else v
+        return row
+
+    @classmethod
+    def version(cls):
+        # table change counter, lets callers rebuild derived data on save
+        return cls.__db__.version(cls.__table__)
+
+    @classmethod
+    def invalidate(cls):
+        # drop table cache, next access reloads from flash
+        cls.__db__.invalidate(cls.__table__)
 
     @classmethod
     def create(cls, **fields):
@@ -55,60 +444,66 @@ class Model:
                 fields[k] = default
 
         pkey = fields[pkey_field]
-        with open(cls.fname(pkey), "w") as f:
-            f.write(ujson.dumps(fields))
-        # if cached: delete cached record
-        if hasattr(cls,'_{}'.format(cls.__table__)): 
-            name = '_{}'.format(cls.__table__)
-            delattr(cls,name)
-            print("cache deleted: {}".format(name))
-            # clean up var
-            import gc
-            gc.collect()
+        cls.__db__.store(cls.__table__, pkey, fields)
+        # write-back: add record to table cache and built keys
+        cls.rows()[pkey] = fields
+        for field, index in cls.__db__.keys(cls.__table__).items():
+            if fields.get(field) not in index:
+                index[fields.get(field)] = fields
+        cls.__db__.touch(cls.__table__)
         return pkey
 
     @classmethod
     def get_id(cls, pkey):
-        with open(cls.fname(pkey)) as f:
-            return [cls.json2row(ujson.loads(f.read()))]
+        return [cls.json2row(cls.row(pkey))]
 
     @classmethod
     def update(cls, where, **fields):
         pkey_field = cls.__fields__[0]
         assert len(where) == 1 and pkey_field in where
-        with open(cls.fname(where[pkey_field])) as f:
-            data = ujson.loads(f.read())
+        row = cls.row(where[pkey_field])
+        # only schema fields are persisted, callers may decorate cached rows
+        data = {}
+        for k in cls.__schema__:
+            if k in row:
+                data[k] = row[k]
         data.update(fields)
-        with open(cls.fname(where[pkey_field]), "w") as f:
-            f.write(ujson.dumps(data))
-        # if cached: delete cached record
-        if hasattr(cls,'_{}'.format(cls.__table__)): 
-            name = '_{}'.format(cls.__table__)
-            delattr(cls,name)
-            print("cache deleted: {}".format(name))
-            # clean up var
-            import gc
-            gc.collect()
+        cls.__db__.store(cls.__table__, where[pkey_field], data)
+        # write-back: update cached record in place, all references see it
+        row.update(fields)
+        keys = cls.__db__.keys(cls.__table__)
+        for field in list(keys):
+            if field in fields:
+                # key value changed, rebuild on next lookup
+                del keys[field]
+        cls.__db__.touch(cls.__table__)
+
+    @classmethod
+    def delete(cls, pkey):
+        # delete the table record
+        try:
+            cls.__db__.remove(cls.__table__, pkey)
+        except OSError:
+            return False
+        # write-back: remove record from table cache
+        rows = cls.rows()
+        if pkey in rows:
+            del rows[pkey]
+        # rebuild keys on next lookup
+        cls.__db__.keys(cls.__table__).clear()
+        cls.__db__.touch(cls.__table__)
+        return True
 
     @classmethod
     def scan(cls):
-        for dirent in uos.ilistdir("%s/%s" % (cls.__db__.name, cls.__table__)):
-            fname = dirent[0]
-            if fname[0] == "." or dirent[1] == 16384:
-                continue
-            with open(cls.fname(fname)) as f:
-                yield cls.json2row(ujson.loads(f.read()))
+        for row in cls.rows().values():
+            yield cls.json2row(row)
 
     @classmethod
     def get(cls):
-        #print(cls.__table__)
         # Return dict!
-        for dirent in uos.ilistdir("%s/%s" % (cls.__db__.name, cls.__table__)):
-            fname = dirent[0]
-            if fname[0] == "." or dirent[1] == 16384:
-                continue
-            with open(cls.fname(fname)) as f:
-                yield ujson.loads(f.read())
+        for row in cls.rows().values():
+            yield row
                 
 if hasattr(utime, "localtime"):
     def now():
@@ -5,13 +5,15 @@ import sys
 import gc
 import micropython
 import utime
+import uos
 import uio
 import ure as re
 import uerrno
+import ubinascii
 import uasyncio as asyncio
 import pkg_resources
 
-from .utils import parse_qs
+from .utils import parse_qs, unquote_bytes
 
 
 def get_mime_type(fname):
@@ -21,10 +23,26 @@ def get_mime_type(fname):
         return "text/html"
     if fname.endswith(".css"):
         return "text/css"
+    if fname.endswith(".js"):
+        return "application/javascript"
     if fname.endswith(".png") or fname.endswith(".jpg"):
         return "image"
     return "text/plain"
 
+DAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+# Seconds the clock runs ahead of GMT, for ports without utime.gmtime()
+# whose rtc is set to local time; set by the application
+UTC_OFFSET = 0
+
+def http_date(secs):
+    try:
+        t = utime.gmtime(secs)
+    except AttributeError:
+        t = utime.localtime(secs - UTC_OFFSET)
+    return "%s, %02d %s %04d %02d:%02d:%02d GMT" % (DAYS[t[6]], t[2], MONTHS[t[1] - 1], t[0], t[3], t[4], t[5])
+
 def sendstream(writer, f):
     buf = bytearray(64)
     while True:
@@ -39,12 +57,46 @@ def jsonify(writer, dict):
     yield from start_response(writer, "application/json")
     yield from writer.awrite(ujson.dumps(dict))
 
-def start_response(writer, content_type="text/html", status="200", headers=None):
-    yield from writer.awrite("HTTP/1.0 %s NA\r\n" % status)
+def jsonstream(writer, obj):
+    # Encode incrementally to the writer, no full document in RAM
+    import ujson
+    if isinstance(obj, dict):
+        yield from writer.awrite("{")
+        first = True
+        # snapshot, the dict may change while the writer yields
+        for k, v in list(obj.items()):
+            if not first:
+                yield from writer.awrite(",")
+            first = False
+            yield from writer.awrite(ujson.dumps(str(k)))
+            yield from writer.awrite(":")
+            yield from jsonstream(writer, v)
+        yield from writer.awrite("}")
+    elif isinstance(obj, (list, tuple)):
+        yield from writer.awrite("[")
+        first = True
+        for v in obj:
+            if not first:
+                yield from writer.awrite(",")
+            first = False
+            yield from jsonstream(writer, v)
+        yield from writer.awrite("]")
+    else:
+        yield from writer.awrite(ujson.dumps(obj))
+
+def start_response(writer, content_type="text/html", status="200", headers=None, chunked=False):
+    # Chunked transfer needs a BufferedWriter to frame the body
+    chunked = chunked and hasattr(writer, "start_chunked")
+    if chunked:
+        yield from writer.awrite("HTTP/1.1 %s NA\r\nTransfer-Encoding: chunked\r\n" % status)
+    else:
+        yield from writer.awrite("HTTP/1.0 %s NA\r\n" % status)
     yield from writer.awrite("Content-Type: ")
     yield from writer.awrite(content_type)
     if not headers:
         yield from writer.awrite("\r\n\r\n")
+        if chunked:
+            yield from writer.start_chunked()
         return
     yield from writer.awrite("\r\n")
     if isinstance(headers, bytes) or isinstance(headers, str):
@@ -56,23 +108,318 @@ def start_response(writer, content_type="text/html", status="200", headers=None)
             yield from writer.awrite(v)
             yield from writer.awrite("\r\n")
     yield from writer.awrite("\r\n")
+    if chunked:
+        yield from writer.start_chunked()
 
 def http_error(writer, status):
     yield from start_response(writer, status=status)
     yield from writer.awrite(status)
 
 
+class Deadlines:
+    # Socket deadlines of all connections, one entry per connection task,
+    # served by a single sweep timer. uasyncio timers can't be cancelled,
+    # so a wait_for() per socket operation would leave a timer in the
+    # fixed size event queue until it fires.
+
+    SWEEP_MS = 250
+
+    def __init__(self):
+        self.tasks = {}
+        self.sweeping = False
+
+    def arm(self, timeout):
+        # (re)set the deadline of the current task, returns the task
+        loop = asyncio.get_event_loop()
+        task = loop.cur_task
+        self.tasks[task] = utime.ticks_add(utime.ticks_ms(), int(timeout * 1000))
+        if not self.sweeping:
+            self.sweeping = True
+            loop.call_later_ms(self.SWEEP_MS, self.sweep)
+        return task
+
+    def disarm(self, task):
+        self.tasks.pop(task, None)
+
+    def sweep(self):
+        loop = asyncio.get_event_loop()
+        now = utime.ticks_ms()
+        expired = [task for task, t in self.tasks.items() if utime.ticks_diff(now, t) >= 0]
+        for task in expired:
+            del self.tasks[task]
+            # same as wait_for(): reschedule a task parked on I/O
+            if task.pend_throw(asyncio.TimeoutError()) is False:
+                loop.call_soon(task)
+        if self.tasks:
+            loop.call_later_ms(self.SWEEP_MS, self.sweep)
+        else:
+            self.sweeping = False
+
+
+class BufferedWriter:
+    # Collects the many small writes of a response (headers, template
+    # fragments) in a reusable buffer and sends it in MTU-sized writes.
+    # After start_chunked() every flush goes out as one HTTP/1.1 chunk,
+    # framed in place: 8 bytes head room for the size line, 2 at the end.
+
+    HEAD = 8
+
+    def __init__(self, writer, buf, deadlines=None, timeout=None):
+        self.writer = writer
+        # deadline per socket write, not for the whole response
+        self.deadlines = deadlines
+        self.timeout = timeout
+        self.s = writer.s
+        self.buf = buf
+        self.mv = memoryview(buf)
+        self.size = len(buf) - self.HEAD - 2
+        self.len = 0
+        self.chunked = False
+
+    def get_extra_info(self, name, default=None):
+        return self.writer.get_extra_info(name, default)
+
+    def awrite(self, data, off=0, sz=-1):
+        if isinstance(data, str):
+            data = data.encode()
+        if sz == -1:
+            sz = len(data) - off
+        if self.len + sz > self.size:
+            yield from self.flush()
+            if sz > self.size:
+                # too big to buffer, send as is
+                if self.chunked:
+                    yield from self._awrite("%x\r\n" % sz)
+                    yield from self._awrite(data, off, sz)
+                    yield from self._awrite("\r\n")
+                else:
+                    yield from self._awrite(data, off, sz)
+                return
+        pos = self.HEAD + self.len
+        self.mv[pos:pos + sz] = memoryview(data)[off:off + sz]
+        self.len += sz
+
+    def _awrite(self, data, off=0, sz=-1):
+        if not self.timeout:
+            yield from self.writer.awrite(data, off, sz)
+            return
+        task = self.deadlines.arm(self.timeout)
+        try:
+            yield from self.writer.awrite(data, off, sz)
+        finally:
+            self.deadlines.disarm(task)
+
+    def awriteiter(self, iterable):
+        for buf in iterable:
+            yield from self.awrite(buf)
+
+    def flush(self):
+        n = self.len
+        if not n:
+            return
+        self.len = 0
+        if self.chunked:
+            head = ("%x\r\n" % n).encode()
+            off = self.HEAD - len(head)
+            self.mv[off:self.HEAD] = head
+            self.mv[self.HEAD + n:self.HEAD + n + 2] = b"\r\n"
+            yield from self._awrite(self.buf, off, len(head) + n + 2)
+        else:
+            yield from self._awrite(self.buf, self.HEAD, n)
+
+    def start_chunked(self):
+        # headers go out as they are, the body from here on is chunked
+        yield from self.flush()
+        self.chunked = True
+
+    def finish(self):
+        yield from self.flush()
+        if self.chunked:
+            self.chunked = False
+            yield from self._awrite("0\r\n\r\n")
+
+    def aclose(self):
+        yield from self.finish()
+        yield from self.writer.aclose()
+
+
 class HTTPRequest:
 
+    # Body is read in chunks of this size by read_form()
+    FORM_CHUNK = 512
+    # Deadline per body read, set by WebApp
+    deadlines = None
+    read_timeout = None
+
     def __init__(self):
         pass
 
     def read_form_data(self):
         size = int(self.headers[b"Content-Length"])
-        data = yield from self.reader.read(size)
+        data = yield from self._read(size)
         form = parse_qs(data.decode())
         self.form = form
 
+    def read_form(self, sink=None):
+        """Incrementally parse an urlencoded or multipart/form-data body.
+        Fields are handled one at a time as they arrive: sink(name, filename)
+        may return an object with write() (and optionally close()) that then
+        receives the value in chunks, e.g. a file on flash. Other fields are
+        collected as self.form = {name: str}, first value wins. File parts
+        nobody takes are skipped. Returns self.form, {} if nothing was posted."""
+        self.form = {}
+        ctype = self.headers.get(b"Content-Type", b"")
+        size = int(self.headers.get(b"Content-Length", 0))
+        if ctype.startswith(b"multipart/form-data"):
+            boundary = ctype.split(b"boundary=", 1)[1].split(b";")[0].strip(b'" ')
+            yield from self._read_multipart(b"\r\n--" + boundary, size, sink)
+        else:
+            yield from self._read_urlencoded(size, sink)
+        return self.form
+
+    def _read(self, size):
+        if not self.read_timeout:
+            return (yield from self.reader.read(size))
+        task = self.deadlines.arm(self.read_timeout)
+        try:
+            return (yield from self.reader.read(size))
+        finally:
+            self.deadlines.disarm(task)
+
+    def _read_chunk(self, size):
+        data = yield from self._read(min(self.FORM_CHUNK, size))
+        return data or b""
+
+    def _field(self, name, out, value):
+        if out is not None:
+            if hasattr(out, "close"):
+                out.close()
+        elif name not in self.form:
+            self.form[name] = value.decode()
+
+    def _read_urlencoded(self, size, sink):
+        key = None
+        out = None
+        value = b""
+        pending = b""
+        while True:
+            if size > 0:
+                data = yield from self._read_chunk(size)
+                size = size - len(data) if data else 0
+                pending += data
+            last = size <= 0
+            while True:
+                if key is None:
+                    i = pending.find(b"=")
+                    j = pending.find(b"&")
+                    if j >= 0 and (i < 0 or j < i):
+                        # key without value
+                        if j:
+                            self._field(unquote_bytes(pending[:j]).decode(), None, b"")
+                        pending = pending[j + 1:]
+                        continue
+                    if i < 0:
+                        if last and pending:
+                            self._field(unquote_bytes(pending).decode(), None, b"")
+                            pending = b""
+                        break
+                    key = unquote_bytes(pending[:i]).decode()
+                    pending = pending[i + 1:]
+                    out = sink(key, None) if sink else None
+                    value = b""
+                j = pending.find(b"&")
+                if j >= 0:
+                    part, pending = pending[:j], pending[j + 1:]
+                elif last:
+                    part, pending = pending, b""
+                else:
+                    # hold back an escape split over two chunks
+                    k = pending.rfind(b"%", max(0, len(pending) - 2))
+                    if k < 0:
+                        k = len(pending)
+                    part, pending = pending[:k], pending[k:]
+                part = unquote_bytes(part)
+                if out is not None:
+                    out.write(part)
+                else:
+                    value += part
+                if j < 0 and not last:
+                    break
+                self._field(key, out, value)
+                key = None
+                out = None
+            if last:
+                return
+
+    def _read_multipart(self, boundary, size, sink):
+        # The body starts with "--boundary", CRLF in front makes the
+        # first delimiter look like all others.
+        pending = b"\r\n"
+        state = 0       # 0: preamble, 1: part headers, 2: part body
+        out = None
+        value = b""
+        skip = False
+        keep = len(boundary) + 1
+        while True:
+            if size > 0:
+                data = yield from self._read_chunk(size)
+                size = size - len(data) if data else 0
+                pending += data
+            last = size <= 0
+            while True:
+                if state == 0:
+                    i = pending.find(boundary)
+                    if i < 0:
+                        pending = pending[-keep:]
+                        break
+                    pending = pending[i + len(boundary):]
+                    state = 1
+                if state == 1:
+                    if pending[:2] == b"--":
+                        return
+                    i = pending.find(b"\r\n\r\n")
+                    if i < 0:
+                        break
+                    name = filename = None
+                    for line in pending[2:i].split(b"\r\n"):
+                        if line.lower().startswith(b"content-disposition:"):
+                            for item in line.split(b";")[1:]:
+                                k, _, v = item.strip().partition(b"=")
+                                v = v.strip(b'"').decode()
+                                if k == b"name":
+                                    name = v
+                                elif k == b"filename":
+                                    filename = v
+                    pending = pending[i + 4:]
+                    out = sink(name, filename) if sink else None
+                    # files nobody takes don't go to RAM
+                    skip = out is None and filename is not None
+                    value = b""
+                    state = 2
+                if state == 2:
+                    i = pending.find(boundary)
+                    if i < 0:
+                        # all but a possibly split delimiter
+                        if len(pending) <= keep:
+                            break
+                        part, pending = pending[:-keep], pending[-keep:]
+                    else:
+                        part, pending = pending[:i], pending[i + len(boundary):]
+                    if out is not None:
+                        out.write(part)
+                    elif not skip:
+                        value += part
+                    if i < 0:
+                        break
+                    if not skip:
+                        self._field(name, out, value)
+                    out = None
+                    state = 1
+            if last:
+                if out is not None:
+                    self._field(name, out, value)
+                return
+
     def parse_qs(self):
         form = parse_qs(self.qs)
         self.form = form
@@ -80,6 +427,9 @@ class HTTPRequest:
 
 class WebApp:
 
+    # One TCP segment worth of response per socket write
+    BUFFER_SIZE = 1460
+
     def __init__(self, pkg, routes=None, serve_static=True):
         if routes:
             self.url_map = routes
@@ -93,8 +443,27 @@ class WebApp:
             self.url_map.append((re.compile("^/(static/.+)"), self.handle_static))
         self.mounts = []
         self.inited = False
+        # Dispatch tables, built from url_map by compile()
+        self.compiled = False
         # Instantiated lazily
         self.template_loader = None
+        # Reusable response buffers, one per request in flight
+        self.buffers = []
+        # Static file validators, looked up once per file
+        self.static_meta = {}
+        # Admission control, see _serve()
+        self.max_connections = 4
+        self.max_queued = 8
+        self.read_timeout = 5
+        self.write_timeout = 30
+        self.deadlines = Deadlines()
+        self.min_free = 8192
+        self.active = 0
+        self.waiting = []
+        # Long-lived streaming responses (route option stream=True)
+        self.max_streams = 2
+        self.streams = 0
+        self.stats = {"accepted": 0, "peak": 0, "queued": 0, "rejected": 0, "lowmem": 0, "timeouts": 0}
         self.headers_mode = "parse"
 
     def parse_headers(self, reader):
@@ -107,17 +476,82 @@ class WebApp:
             headers[k] = v.strip()
         return headers
 
+    def skip_headers(self, reader):
+        while True:
+            l = yield from reader.readline()
+            if l == b"\r\n":
+                break
+
+    def _reject(self, writer):
+        # fast path, no request parsing, no template
+        try:
+            yield from writer.awrite("HTTP/1.0 503 NA\r\nRetry-After: 5\r\nContent-Type: text/plain\r\n\r\n503\r\n")
+            yield from writer.aclose()
+        except OSError:
+            pass
+
+    def _serve(self, reader, writer):
+        # Admission control in front of _handle: at most max_connections
+        # requests in flight, up to max_queued more wait for a slot in
+        # accept order, anything beyond that or arriving while the heap
+        # is below min_free gets an immediate 503.
+        stats = self.stats
+        stats["accepted"] += 1
+        if gc.mem_free() < self.min_free:
+            # loaded templates are dropped, load() brings them back
+            if self.template_loader is not None:
+                self.template_loader.release()
+            gc.collect()
+            if gc.mem_free() < self.min_free:
+                stats["lowmem"] += 1
+                yield from self._reject(writer)
+                return
+        if self.active < self.max_connections:
+            self.active += 1
+        elif len(self.waiting) < self.max_queued:
+            stats["queued"] += 1
+            self.waiting.append(asyncio.get_event_loop().cur_task)
+            # parked until a finishing request hands over its slot
+            yield False
+        else:
+            stats["rejected"] += 1
+            yield from self._reject(writer)
+            return
+        if self.active > stats["peak"]:
+            stats["peak"] = self.active
+        released = False
+        try:
+            released = yield from self._handle(reader, writer)
+        finally:
+            if not released:
+                self._release()
+
+    def _release(self):
+        # hand the slot to the first queued connection, if any
+        if self.waiting:
+            asyncio.get_event_loop().call_soon(self.waiting.pop(0))
+        else:
+            self.active -= 1
+
     def _handle(self, reader, writer):
         if self.debug > 1:
             micropython.mem_info()
 
+        buf = self.buffers.pop() if self.buffers else bytearray(self.BUFFER_SIZE)
+        writer = BufferedWriter(writer, buf, self.deadlines, self.write_timeout)
         close = True
+        req = None
+        released = False
+        # one deadline for the request line and all headers
+        task = self.deadlines.arm(self.read_timeout)
         try:
             request_line = yield from reader.readline()
             if request_line == b"":
+                self.deadlines.disarm(task)
                 if self.debug >= 0:
                     self.log.error("%s: EOF on request start" % reader)
                 yield from writer.aclose()
+                self.buffers.append(buf)
                 return
             req = HTTPRequest()
             # TODO: bytes vs str
@@ -157,32 +591,38 @@ class WebApp:
             if not app.inited:
                 app.init()
 
-            # RESTful request?
-            components = path.strip('/').split('/')
-            #print(components)
-            if len(components) >= 3: 
-                #reassemble path
-                path = '/'+'/'.join(components[:3])
-                qs = components[3:]
-                restful = True
-            else:   
-                restful = False
-            
-            # Find handler to serve this request in app's url_map
+            if not app.compiled:
+                app.compile()
+
+            # Find handler to serve this request: exact match, RESTful
+            # prefix match (remaining components are the args), patterns
             found = False
-            for e in app.url_map:
-                pattern = e[0]
-                handler = e[1]
-                extra = {}
-                methods = []
-                if len(e) > 2:
-                    extra = e[2]
-                    methods = extra['methods']
-                    
-                if path == pattern and method in methods:
-                   found = True
-                   break
-                elif not isinstance(pattern, str):
+            extra = {}
+            components = path.strip('/').split('/')
+            if len(components) >= 3:
+                # RESTful request, walk the prefix tree
+                e = None
+                node = app.rest_tree
+                for i, c in enumerate(components):
+                    node = node[0].get(c)
+                    if node is None:
+                        break
+                    if method in node[1]:
+                        e = node[1][method]
+                        depth = i + 1
+                if e:
+                    path = '/' + '/'.join(components[:depth])
+                    qs = components[depth:]
+                else:
+                    path = '/' + '/'.join(components[:3])
+                    qs = components[3:]
+            else:
+                e = app.route_table.get((method, path))
+            if e:
+                handler, extra = e
+                found = True
+            else:
+                for pattern, handler, extra in app.patterns:
                     # Anything which is non-string assumed to be a ducktype
                     # pattern matcher, whose .match() method is called. (Note:
                     # Django uses .search() instead, but .match() is more
@@ -200,33 +640,62 @@ class WebApp:
                 headers_mode = extra.get("headers", self.headers_mode)
 
             if headers_mode == "skip":
-                while True:
-                    l = yield from reader.readline()
-                    if l == b"\r\n":
-                        break
+                yield from self.skip_headers(reader)
             elif headers_mode == "parse":
                 req.headers = yield from self.parse_headers(reader)
             else:
                 assert headers_mode == "leave"
+            self.deadlines.disarm(task)
 
             if found:
                 req.method = method
                 req.path = path
                 req.qs = qs
                 req.reader = reader
-                close = yield from handler(req, writer)
+                req.deadlines = self.deadlines
+                req.read_timeout = self.read_timeout
+                if extra.get("stream"):
+                    # Long-lived response (events): no write timeout, and
+                    # the connection slot is given back while streaming
+                    if self.streams < self.max_streams:
+                        self.streams += 1
+                        writer.timeout = None
+                        released = True
+                        self._release()
+                        try:
+                            close = yield from handler(req, writer)
+                        finally:
+                            self.streams -= 1
+                    else:
+                        self.stats["rejected"] += 1
+                        yield from start_response(writer, status="503")
+                        yield from writer.awrite("503\r\n")
+                else:
+                    # timeouts apply to each socket read and write, a
+                    # handler doing slow work itself is not cut off
+                    close = yield from handler(req, writer)
             else:
                 yield from start_response(writer, status="404")
                 yield from writer.awrite("404\r\n")
             #print(req, "After response write")
+            yield from writer.finish()
         except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                self.stats["timeouts"] += 1
             if self.debug >= 0:
                 self.log.exc(e, "%.3f %s %s %r" % (utime.time(), req, writer, e))
+        # failed before the headers were read: no late timeout
+        self.deadlines.disarm(task)
 
         if close is not False:
-            yield from writer.aclose()
+            try:
+                yield from writer.writer.aclose()
+            except OSError:
+                pass
+        self.buffers.append(buf)
         if __debug__ and self.debug > 1:
             self.log.debug("%.3f %s Finished processing request", utime.time(), req)
+        return released
 
     def mount(self, url, app):
         "Mount a sub-app at the url of current app."
@@ -242,6 +711,7 @@ class WebApp:
     def route(self, url, **kwargs):
         def _route(f):
             self.url_map.append((url, f, kwargs))
+            self.compiled = False
             return f
         return _route
 
@@ -249,6 +719,38 @@ class WebApp:
         # Note: this method skips Flask's "endpoint" argument,
         # because it's alleged bloat.
         self.url_map.append((url, func, kwargs))
+        self.compiled = False
+
+    def compile(self):
+        "Build the dispatch tables from url_map."
+        # Exact routes: (method, path) -> (handler, extra). Routes of
+        # 3+ components also go in a prefix tree of [children, methods]
+        # nodes, so /api/v1.0/device/3 finds /api/v1.0/device with
+        # args ["3"] in one walk. Patterns are tried in url_map order.
+        self.route_table = {}
+        self.rest_tree = [{}, {}]
+        self.patterns = []
+        for e in self.url_map:
+            pattern = e[0]
+            handler = e[1]
+            extra = e[2] if len(e) > 2 else {}
+            if not isinstance(pattern, str):
+                self.patterns.append((pattern, handler, extra))
+                continue
+            methods = extra.get("methods", ("GET",))
+            components = pattern.strip('/').split('/')
+            node = None
+            if len(components) >= 3:
+                node = self.rest_tree
+                for c in components:
+                    node = node[0].setdefault(c, [{}, {}])
+            for m in methods:
+                # first registration wins, like the linear scan did
+                if (m, pattern) not in self.route_table:
+                    self.route_table[(m, pattern)] = (handler, extra)
+                if node is not None and m not in node[1]:
+                    node[1][m] = (handler, extra)
+        self.compiled = True
 
     def _load_template(self, tmpl_name):
         if self.template_loader is None:
@@ -266,32 +768,102 @@ class WebApp:
         tmpl = self._load_template(tmpl_name)
         return ''.join(tmpl(*args))
 
-    def sendfile(self, writer, fname, content_type=None, headers=None):
+    def _static_meta(self, fname):
+        # (etag, last-modified, has .gz) of a file in the package, Nones
+        # when it doesn't exist. Taken from where resource_stream() reads:
+        # the frozen R dict (no mtime, etag from the content) or the
+        # package directory. Files don't change under a running app, so
+        # this is cached.
+        meta = self.static_meta.get(fname)
+        if meta is None:
+            meta = (None, None, False)
+            try:
+                # also loads the package resources into pkg_resources.c
+                pkg_resources.resource_stream(self.pkg, fname).close()
+                res = pkg_resources.c[self.pkg]
+                if isinstance(res, dict):
+                    data = res[fname]
+                    meta = ('"%x-%x"' % (ubinascii.crc32(data), len(data)), None, fname + ".gz" in res)
+                else:
+                    st = uos.stat(res + fname)
+                    gz = True
+                    try:
+                        uos.stat(res + fname + ".gz")
+                    except OSError:
+                        gz = False
+                    meta = ('"%x-%x"' % (st[8], st[6]), http_date(st[8]), gz)
+            except (ImportError, AttributeError, TypeError, KeyError, OSError):
+                pass
+            self.static_meta[fname] = meta
+        return meta
+
+    def sendfile(self, writer, fname, content_type=None, headers=None, req=None):
         if not content_type:
             content_type = get_mime_type(fname)
+        # Conditional GET and precompressed variant, needs request headers
+        gz = False
+        req_headers = getattr(req, "headers", None)
+        if req_headers is not None and (headers is None or isinstance(headers, dict)):
+            etag, modified, gz = self._static_meta(fname)
+            if etag:
+                headers = dict(headers) if headers else {}
+                if gz:
+                    headers["Vary"] = "Accept-Encoding"
+                    gz = b"gzip" in req_headers.get(b"Accept-Encoding", b"")
+                    if gz:
+                        etag = etag[:-1] + '-gz"'
+                headers["ETag"] = etag
+                if modified:
+                    headers["Last-Modified"] = modified
+                headers["Cache-Control"] = "no-cache"
+                match = req_headers.get(b"If-None-Match")
+                if match is not None:
+                    not_modified = etag in match.decode()
+                else:
+                    not_modified = modified and req_headers.get(b"If-Modified-Since", b"").decode() == modified
+                if not_modified:
+                    yield from start_response(writer, content_type, "304", headers)
+                    return
+                if gz:
+                    headers["Content-Encoding"] = "gzip"
         try:
-            with pkg_resources.resource_stream(self.pkg, fname) as f:
-                yield from start_response(writer, content_type, "200", headers)
-                yield from sendstream(writer, f)
+            f = None
+            if gz:
+                try:
+                    f = pkg_resources.resource_stream(self.pkg, fname + ".gz")
+                except (KeyError, OSError):
+                    # variant gone, plain file with its own validator
+                    del headers["Content-Encoding"]
+                    headers["ETag"] = etag[:-4] + '"'
+            if f is None:
+                f = pkg_resources.resource_stream(self.pkg, fname)
+        except KeyError:
+            # not in the frozen resources
+            yield from http_error(writer, "404")
+            return
         except OSError as e:
             if e.args[0] == uerrno.ENOENT:
                 yield from http_error(writer, "404")
-            else:
-                raise
+                return
+            raise
+        with f:
+            yield from start_response(writer, content_type, "200", headers)
+            yield from sendstream(writer, f)
 
     def handle_static(self, req, resp):
         path = req.url_match.group(1)
         if ".." in path:
             yield from http_error(resp, "403")
             return
-        yield from self.sendfile(resp, path)
+        yield from self.sendfile(resp, path, req=req)
 
     def init(self):
         """Initialize a web application. This is for overriding by subclasses.
         This is good place to connect to/initialize a database, for example."""
+        self.compile()
         self.inited = True
 
-    def run(self, host="127.0.0.1", port=8081, debug=False, lazy_init=False, log=None):
+    def run(self, host="127.0.0.1", port=8081, debug=False, lazy_init=False, log=None, max_connections=None):
         if log is None and debug >= 0:
             import logging
             log = logging.getLogger("picoweb")
@@ -307,6 +879,8 @@ class WebApp:
         loop = asyncio.get_event_loop()
         if debug > 0:
             print("* Running on http://%s:%s/" % (host, port))
-        loop.create_task(asyncio.start_server(self._handle, host, port))
+        if max_connections:
+            self.max_connections = max_connections
+        loop.create_task(asyncio.start_server(self._serve, host, port))
         loop.run_forever()
         loop.close()
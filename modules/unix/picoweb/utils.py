@@ -5,6 +5,18 @@ def unquote_plus(s):
     arr2 = [chr(int(x[:2], 16)) + x[2:] for x in arr[1:]]
     return arr[0] + "".join(arr2)
 
+def unquote_bytes(b):
+    # unquote_plus for bytes, keeps non-ASCII (UTF-8) sequences intact
+    b = b.replace(b"+", b" ")
+    if b"%" not in b:
+        return b
+    arr = b.split(b"%")
+    res = bytearray(arr[0])
+    for x in arr[1:]:
+        res.append(int(x[:2], 16))
+        res.extend(x[2:])
+    return bytes(res)
+
 def parse_qs(s):
     res = {}
     if s:
@@ -0,0 +1,41 @@
+import sys
+import os
+import gzip
+
+
+# Build step: precompress static assets, picoweb serves <file>.gz when
+# the client accepts gzip. Run on the host before flashing/freezing.
+# With frozen resources (R.py) only .gz entries in R are used.
+
+if len(sys.argv) < 3:
+    print("Usage: %s <cmd> <dir>" % sys.argv[0])
+    sys.exit(1)
+
+cmd = sys.argv[1]
+
+if cmd == "gzip":
+    for cur_path, dirs, files in os.walk(sys.argv[2]):
+        for f in files:
+            if f.endswith(".gz") or f.endswith(".py") or f.endswith(".pyc"):
+                continue
+            fname = cur_path + "/" + f
+            with open(fname, "rb") as f_in:
+                data = f_in.read()
+            packed = gzip.compress(data, 9)
+            if len(packed) >= len(data):
+                # not worth it, make sure no stale variant is served
+                if os.path.exists(fname + ".gz"):
+                    os.unlink(fname + ".gz")
+                continue
+            with open(fname + ".gz", "wb") as f_out:
+                f_out.write(packed)
+            print("%s: %d -> %d" % (fname, len(data), len(packed)))
+
+elif cmd == "clean":
+    for cur_path, dirs, files in os.walk(sys.argv[2]):
+        for f in files:
+            if f.endswith(".gz"):
+                os.unlink(cur_path + "/" + f)
+
+else:
+    print("Unknown command:", cmd)
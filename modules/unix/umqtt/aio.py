@@ -0,0 +1,318 @@
+import utime
+import uerrno
+import ustruct as struct
+import uasyncio as asyncio
+from .simple import MQTTException
+
+# Non-blocking MQTT 3.1.1 client on top of uasyncio streams.
+#
+# One reader task per connection owns the socket in the poller and
+# handles all incoming packets (PUBACK, SUBACK, PINGRESP, PUBLISH).
+# Writes go straight to the non-blocking socket and never wait on
+# IOWrite, so they can't steal the reader's poll registration.
+# A supervisor task started by start() keeps the session alive:
+# connect with exponential backoff, PINGREQ at keepalive/2, drop
+# the link when the broker stays silent, resend unacked QoS 1
+# publishes (DUP) and restore subscriptions after reconnect.
+
+class MQTTClient:
+
+    WINDOW = 8              # max unacknowledged QoS 1 publishes
+    TIMEOUT = 10            # connect/window timeout, seconds
+    BACKOFF_MIN = 1         # reconnect backoff, seconds
+    BACKOFF_MAX = 60
+    POLL_MS = 20            # partial write/window full retry
+    DEBUG = False
+
+    def __init__(self, client_id, server, port=0, user=None, password=None, keepalive=60,
+                 ssl=False):
+        if port == 0:
+            port = 8883 if ssl else 1883
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.ssl = ssl
+        self.pid = 0
+        self.cb = None
+        self.user = user
+        self.pswd = password
+        self.keepalive = keepalive
+        self.lw_topic = None
+        self.lw_msg = None
+        self.lw_qos = 0
+        self.lw_retain = False
+        self._reader = None
+        self._sock = None
+        self._task = None
+        self._running = False
+        self._connected = False
+        self._writing = False
+        self._inflight = {}
+        self._subs = {}
+        self._backoff = self.BACKOFF_MIN
+        self._last_rx = 0
+        self._last_tx = 0
+
+    def log(self, in_reconnect, e):
+        if self.DEBUG:
+            print("mqtt:%s %r" % (" reconnect:" if in_reconnect else "", e))
+
+    def set_callback(self, f):
+        self.cb = f
+
+    def set_last_will(self, topic, msg, retain=False, qos=0):
+        assert 0 <= qos <= 2
+        assert topic
+        self.lw_topic = topic
+        self.lw_msg = msg
+        self.lw_qos = qos
+        self.lw_retain = retain
+
+    def isconnected(self):
+        return self._connected
+
+    def pending(self):
+        return len(self._inflight)
+
+    @staticmethod
+    def _str(s):
+        if isinstance(s, str):
+            s = s.encode()
+        return struct.pack("!H", len(s)) + s
+
+    @staticmethod
+    def _packet(op, body):
+        pkt = bytearray(b"\0\0\0\0\0")
+        pkt[0] = op
+        sz = len(body)
+        i = 1
+        while sz > 0x7f:
+            pkt[i] = (sz & 0x7f) | 0x80
+            sz >>= 7
+            i += 1
+        pkt[i] = sz
+        return pkt[:i + 1] + body
+
+    def _newpid(self):
+        self.pid = self.pid % 65535 + 1
+        return self.pid
+
+    async def _write(self, pkt):
+        # one packet at a time, partial writes are retried
+        while self._writing:
+            await asyncio.sleep_ms(self.POLL_MS)
+        self._writing = True
+        try:
+            mv = memoryview(pkt)
+            off = 0
+            while off < len(pkt):
+                if self._sock is None:
+                    raise OSError(uerrno.ENOTCONN)
+                n = self._sock.write(mv[off:])
+                if n:
+                    off += n
+                else:
+                    await asyncio.sleep_ms(self.POLL_MS)
+            self._last_tx = utime.ticks_ms()
+        finally:
+            self._writing = False
+
+    async def _recv_len(self):
+        n = 0
+        sh = 0
+        while 1:
+            b = await self._reader.readexactly(1)
+            if not b:
+                raise OSError(uerrno.ECONNRESET)
+            n |= (b[0] & 0x7f) << sh
+            if not b[0] & 0x80:
+                return n
+            sh += 7
+
+    async def connect(self, clean_session=True):
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(self.server, self.port, self.ssl), self.TIMEOUT)
+        self._reader = reader
+        self._sock = writer.s
+        try:
+            flags = clean_session << 1
+            payload = self._str(self.client_id)
+            if self.lw_topic:
+                flags |= 0x4 | (self.lw_qos & 0x3) << 3 | self.lw_retain << 5
+                payload += self._str(self.lw_topic) + self._str(self.lw_msg)
+            if self.user:
+                flags |= 0x80
+                payload += self._str(self.user)
+                if self.pswd:
+                    flags |= 0x40
+                    payload += self._str(self.pswd)
+            body = b"\0\x04MQTT\x04" + bytes([flags]) + struct.pack("!H", self.keepalive)
+            await self._write(self._packet(0x10, body + payload))
+            resp = await asyncio.wait_for(reader.readexactly(4), self.TIMEOUT)
+            if len(resp) != 4 or resp[0] != 0x20 or resp[1] != 0x02:
+                raise OSError(uerrno.ECONNRESET)
+            if resp[3] != 0:
+                raise MQTTException(resp[3])
+        except:
+            self._close()
+            raise
+        self._connected = True
+        self._last_rx = self._last_tx = utime.ticks_ms()
+        self._task = self._run()
+        asyncio.get_event_loop().create_task(self._task)
+        # restore session state the broker may have lost
+        for topic, qos in self._subs.items():
+            await self._subscribe(topic, qos)
+        for pkt in list(self._inflight.values()):
+            pkt[0] |= 0x08
+            await self._write(pkt)
+        return resp[2] & 1
+
+    def _close(self):
+        # tear down socket, reader task and poll registration
+        self._connected = False
+        sock, self._sock = self._sock, None
+        task, self._task = self._task, None
+        if sock is None:
+            return
+        loop = asyncio.get_event_loop()
+        try:
+            loop.remove_reader(self._reader.polls)
+        except (KeyError, OSError):
+            pass
+        if task is not None and task is not loop.cur_task:
+            try:
+                asyncio.cancel(task)
+            except (TypeError, ValueError):
+                # not started yet, exits on its own
+                pass
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+    async def _run(self):
+        # reader task, lives as long as the connection
+        task = self._task
+        try:
+            while self._connected:
+                op = await self._reader.readexactly(1)
+                if not op:
+                    raise OSError(uerrno.ECONNRESET)
+                sz = await self._recv_len()
+                body = await self._reader.readexactly(sz) if sz else b""
+                if len(body) != sz:
+                    raise OSError(uerrno.ECONNRESET)
+                self._last_rx = utime.ticks_ms()
+                await self._handle(op[0], body)
+        except Exception as e:
+            self.log(False, e)
+        # a cancelled reader must not close a newer connection
+        if self._task is task:
+            self._close()
+
+    async def _handle(self, op, body):
+        if op == 0x40:
+            # PUBACK, free in-flight slot
+            self._inflight.pop(struct.unpack("!H", body)[0], None)
+        elif op == 0x90:
+            # SUBACK
+            if body[2] == 0x80:
+                self.log(False, "subscribe refused")
+        elif op & 0xf0 == 0x30:
+            # PUBLISH
+            tsz = struct.unpack("!H", body[:2])[0]
+            topic = body[2:tsz + 2]
+            pos = tsz + 2
+            if op & 6:
+                pid = body[pos:pos + 2]
+                pos += 2
+            if self.cb:
+                self.cb(topic, body[pos:])
+            if op & 6 == 2:
+                await self._write(b"\x40\x02" + pid)
+        # PINGRESP only refreshes last_rx
+
+    async def _supervise(self):
+        while self._running:
+            if not self._connected:
+                try:
+                    await self.connect(False)
+                    self._backoff = self.BACKOFF_MIN
+                except Exception as e:
+                    self.log(True, e)
+                    await asyncio.sleep(self._backoff)
+                    self._backoff = min(self._backoff * 2, self.BACKOFF_MAX)
+                    continue
+            if self.keepalive:
+                now = utime.ticks_ms()
+                if utime.ticks_diff(now, self._last_rx) > self.keepalive * 1500:
+                    self.log(False, "keepalive timeout")
+                    self._close()
+                    continue
+                if utime.ticks_diff(now, self._last_tx) >= self.keepalive * 500:
+                    try:
+                        await self._write(b"\xc0\0")
+                    except OSError as e:
+                        self.log(False, e)
+                        self._close()
+                        continue
+                await asyncio.sleep_ms(self.keepalive * 250)
+            else:
+                await asyncio.sleep(1)
+
+    def start(self):
+        # start the session supervisor, safe to call repeatedly
+        if not self._running:
+            self._running = True
+            asyncio.get_event_loop().create_task(self._supervise())
+
+    async def disconnect(self):
+        self._running = False
+        if self._connected:
+            try:
+                await self._write(b"\xe0\0")
+            except OSError:
+                pass
+        self._close()
+
+    async def publish(self, topic, msg, retain=False, qos=0):
+        assert qos in (0, 1)
+        if isinstance(msg, str):
+            msg = msg.encode()
+        body = self._str(topic)
+        if qos:
+            # wait for a free in-flight slot, only PUBACKs free one, so
+            # fail fast while disconnected instead of stalling the caller
+            t = utime.ticks_ms()
+            while len(self._inflight) >= self.WINDOW:
+                if not self._connected:
+                    raise OSError(uerrno.ENOTCONN)
+                if utime.ticks_diff(utime.ticks_ms(), t) > self.TIMEOUT * 1000:
+                    raise OSError(uerrno.ETIMEDOUT)
+                await asyncio.sleep_ms(self.POLL_MS)
+            pid = self._newpid()
+            body += struct.pack("!H", pid)
+        pkt = self._packet(0x30 | qos << 1 | retain, body + msg)
+        if qos:
+            # kept until PUBACK, resent after reconnect
+            self._inflight[pid] = pkt
+        if self._connected:
+            try:
+                await self._write(pkt)
+            except OSError:
+                self._close()
+                if not qos:
+                    raise
+        elif not qos:
+            raise OSError(uerrno.ENOTCONN)
+
+    async def _subscribe(self, topic, qos):
+        body = struct.pack("!H", self._newpid()) + self._str(topic) + bytes([qos])
+        await self._write(self._packet(0x82, body))
+
+    async def subscribe(self, topic, qos=0):
+        assert qos in (0, 1)
+        self._subs[topic] = qos
+        if self._connected:
+            await self._subscribe(topic, qos)
@@ -1,3 +1,6 @@
+import sys
+
+
 class Loader:
 
     def __init__(self, pkg, dir):
@@ -8,7 +11,29 @@ class Loader:
         if pkg and pkg != "__main__":
             dir = pkg + "." + dir
         self.p = dir
+        # In-RAM render table: template name -> render function
+        self.renders = {}
 
     def load(self, name):
-        name = name.replace(".", "_")
-        return __import__(self.p + name, None, None, (name,)).render
+        render = self.renders.get(name)
+        if render is None:
+            mod = name.replace(".", "_")
+            render = __import__(self.p + mod, None, None, (mod,)).render
+            self.renders[name] = render
+        return render
+
+    def release(self, keep=()):
+        # Drop loaded templates (except keep) so their code can be
+        # collected under memory pressure, load() imports them again.
+        for name in list(self.renders):
+            if name in keep:
+                continue
+            del self.renders[name]
+            mod = name.replace(".", "_")
+            sys.modules.pop(self.p + mod, None)
+            parent = sys.modules.get(self.p[:-1])
+            if parent is not None:
+                try:
+                    delattr(parent, mod)
+                except (AttributeError, TypeError):
+                    pass
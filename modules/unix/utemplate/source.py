@@ -173,12 +173,7 @@ class Loader(compiled.Loader):
     def compiled_path(self, template):
         return self.dir + "/" + template.replace(".", "_") + ".py"
 
-    def load(self, name):
-        try:
-            return super().load(name)
-        except (OSError, ImportError):
-            pass
-
+    def compile(self, name):
         compiled_path = self.pkg_path + self.compiled_path(name)
 
         f_in = self.input_open(name)
@@ -187,4 +182,36 @@ class Loader(compiled.Loader):
         c.compile()
         f_in.close()
         f_out.close()
+
+    def check(self):
+        # Startup staleness check, the only time mtimes are looked at:
+        # recompile templates whose source is newer than the compiled
+        # file. Afterwards load() never touches the source again.
+        import os
+        path = self.pkg_path + self.dir + "/"
+        try:
+            files = os.listdir(path)
+        except OSError:
+            # frozen package, nothing to check
+            return 0
+        cnt = 0
+        for f in files:
+            if not f.endswith(".html"):
+                continue
+            try:
+                compiled = os.stat(self.pkg_path + self.compiled_path(f))[8]
+            except OSError:
+                compiled = -1
+            if os.stat(path + f)[8] > compiled:
+                self.compile(f)
+                cnt += 1
+        return cnt
+
+    def load(self, name):
+        try:
+            return super().load(name)
+        except (OSError, ImportError):
+            pass
+
+        self.compile(name)
         return super().load(name)
@@ -33,6 +33,19 @@ if cmd == "compileall":
             print(fname)
             loader.load(fname)
 
+elif cmd == "mpy":
+    # Build step: (re)compile every template and precompile the result
+    # to bytecode with mpy-cross, for freezing into the firmware.
+    import subprocess
+    loader = utemplate.source.Loader(package, sys.argv[2])
+    for f in sorted(os.listdir(sys.argv[2])):
+        if not f.endswith(".html"):
+            continue
+        loader.compile(f)
+        compiled = loader.compiled_path(f)
+        print(compiled)
+        subprocess.check_call(["mpy-cross", compiled])
+
 elif cmd == "compile":
     loader = utemplate.source.Loader(package, ".")
     try:
@@ -12,16 +12,45 @@
 
 import picoweb
 from utemplate import source
+from . import db
 
 ROUTES = [
     # You can specify exact URI string matches...
 #    ("/favicon.ico", lambda req, resp: (yield from app.sendfile(resp, "/static/favicon.ico"))),
 ]
 
+# Shared page chrome, cached rendered: template -> fingerprint of the arguments it uses
+FRAGMENTS = {
+    "header.html":      lambda info, menu, advanced: (info['srcname'], info['name'], menu, advanced['rules'], advanced['scripts'], advanced['notifications']),
+    "header_ap.html":   lambda info: (info['name'],),
+    "footer.html":      lambda info: (info['copyright'], info['holder']),
+}
+
 class EasyApp(picoweb.WebApp):
 
     def init(self):
         super().init()
+        # recompile stale templates once, no mtime checks per request
+        self.template_loader.check()
+        self._fragments = {}
+        self._versions  = None
+
+    def render_template(self, writer, tmpl_name, args=()):
+        fingerprint = FRAGMENTS.get(tmpl_name)
+        if not fingerprint:
+            yield from picoweb.WebApp.render_template(self, writer, tmpl_name, args)
+            return
+        # config/advanced changed: drop all rendered fragments
+        versions = (db.configTable.version(), db.advancedTable.version())
+        if versions != self._versions:
+            self._fragments = {}
+            self._versions  = versions
+        key = (tmpl_name, fingerprint(*args))
+        fragment = self._fragments.get(key)
+        if fragment is None:
+            fragment = self.render_str(tmpl_name, args).encode()
+            self._fragments[key] = fragment
+        yield from writer.awrite(fragment)
 
 app = EasyApp(__name__, ROUTES)
 # Add our own templates to the template path
@@ -57,8 +57,34 @@ SENSOR_TYPE_DIMMER          = "SENSOR_TYPE_DIMMER"          # Single value
 SENSOR_TYPE_LONG            = "SENSOR_TYPE_LONG"            # Single value
 SENSOR_TYPE_WIND            = "SENSOR_TYPE_WIND"            # Single value
 
-# Queueu types
-QUEUE_MESSAGE_START         = "UPYEASY_QMS"         # Start of every queue message
+# Values send per sensor type, 0 = not send yet
+SENSOR_TYPE_VALUES = {
+    SENSOR_TYPE_SINGLE          : 1,
+    SENSOR_TYPE_TEMP_HUM        : 2,
+    SENSOR_TYPE_TEMP_BARO       : 2,
+    SENSOR_TYPE_TEMP_HUM_BARO   : 3,
+    SENSOR_TYPE_DUAL            : 2,
+    SENSOR_TYPE_TRIPLE          : 3,
+    SENSOR_TYPE_QUAD            : 0,
+    SENSOR_TYPE_SWITCH          : 1,
+    SENSOR_TYPE_DIMMER          : 0,
+    SENSOR_TYPE_LONG            : 0,
+    SENSOR_TYPE_WIND            : 0,
+}
+
+# (name, value) keys of value 1..3, no key strings built per reading
+VALUE_KEYS = (('valueN1', 'valueV1'), ('valueN2', 'valueV2'), ('valueN3', 'valueV3'))
+
+# Device scheduler
+SCHEDULE_POLL_MS            = 10                    # poll period of devices without delay
+SCHEDULE_MAX_MS             = 1000                  # max sleep, picks up device changes
+SCHEDULE_JITTER             = 20                    # max jitter is 1/x of device delay
+
+# Input pipeline
+INPUT_MAX                   = 16                    # max number of irq input pins
+INPUT_RING_SIZE             = 64                    # edges buffered between irq and coroutine, power of 2
+INPUT_POLL_MS               = 10                    # ring drain period, also pins without irq
+INPUT_DEBOUNCE_MS           = 20                    # default debounce time
 
 # Status types
 STATUS_INIT                 = "INIT"                # initialising
@@ -85,6 +111,45 @@ PIN_OPEN_DRAIN      = 4
 PIN_ALT             = 5
 PIN_ALT_OPEN_DRAIN  = 6
 
+####################
+# Queue messages   #
+####################
+
+# One queue item per message, no framing needed.
+# Item access keeps them usable as devicedata dicts.
+
+class message(object):
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+class valuemessage(message):
+    # One value of a device, for value/script/rule queues
+    __slots__ = ('name', 'valuename', 'value', 'triggername')
+
+    def __init__(self, name, valuename, value):
+        self.name           = name
+        self.valuename      = valuename
+        self.value          = value
+        self.triggername    = name+'#'+valuename
+
+class devicemessage(message):
+    # All values of one device reading, for protocol queues
+    __slots__ = ('stype', 'serverid', 'unitname', 'devicename', 'valueV1', 'valueN1', 'valueV2', 'valueN2', 'valueV3', 'valueN3')
+
+    def __init__(self, stype, serverid, unitname, devicename):
+        self.stype          = stype
+        self.serverid       = serverid
+        self.unitname       = unitname
+        self.devicename     = devicename
+
 ####################
 # CORE             #
 ####################
@@ -98,3 +163,4 @@ _log       = None
 _hal       = None
 _utils     = None
 _scripts   = None
+_routes    = None
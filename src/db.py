@@ -14,7 +14,8 @@ import filedb as uorm, os, sys
 from ucollections import OrderedDict
 from . import core
 
-_dbc = uorm.DB(core.working_dir+"config")
+# one packed file per table, old one-file-per-record tables are migrated
+_dbc = uorm.PackedDB(core.working_dir+"config")
 _config = {}
 
 class configTable(uorm.Model):
@@ -37,14 +38,11 @@ class configTable(uorm.Model):
 
     @classmethod
     def getrow(cls):
-        # if cached: return cached record
-        if hasattr(cls,'_config'):  return cls._config
-        # no cache: fetch it!
         try:
-            cls._config = next(cls.get())
+            res = next(cls.get())
         except StopIteration:
             return None
-        return cls._config
+        return res
 
 class networkTable(uorm.Model):
 
@@ -96,34 +94,16 @@ class controllerTable(uorm.Model):
 
     @classmethod
     def public(cls):
-        # if cached: return cached table
-        if hasattr(cls,'_controller'):  return cls._controller
-        # no cache: fetch it!
-        try:
-            cls._controller = [x for x in cls.get()]
-        except StopIteration:
-            return None
-        return cls._controller
+        return list(cls.rows().values())
 
     @classmethod
     def getrow(cls):
         try:
             res = next(cls.get())
         except StopIteration:
-            return None           
+            return None
         return res
 
-    @classmethod
-    def delete(cls, timestamp):
-        # delete the table record
-        try:
-            os.remove(cls.fname(timestamp))
-            # if cached: delete cached table
-            if hasattr(cls,'_controller'):  del cls._controller
-        except KeyError:
-            return False
-        return True
-
 class protocolTable(uorm.Model):
 
     # Create protocol table
@@ -140,11 +120,7 @@ class protocolTable(uorm.Model):
 
     @classmethod
     def public(cls):
-        try:
-            res = [x for x in cls.get()]
-        except StopIteration:
-            return None
-        return res
+        return list(cls.rows().values())
 
     @classmethod
     def getrow(cls):
@@ -154,15 +130,6 @@ class protocolTable(uorm.Model):
             return None
         return res
 
-    @classmethod
-    def delete(cls, timestamp):
-        # delete the table record
-        try:
-            os.remove(cls.fname(timestamp))
-        except KeyError:
-            return False
-        return True
-
 class hardwareTable(uorm.Model):
 
     # Create hardware table
@@ -391,11 +358,7 @@ class pluginTable(uorm.Model):
 
     @classmethod
     def public(cls):
-        try:
-            res = [x for x in cls.get()]
-        except StopIteration:
-            return None
-        return res
+        return list(cls.rows().values())
         
     @classmethod
     def getrow(cls):
@@ -405,15 +368,6 @@ class pluginTable(uorm.Model):
             return None
         return res
 
-    @classmethod
-    def delete(cls, timestamp):
-        # delete the table record
-        try:
-            os.remove(cls.fname(timestamp))
-        except KeyError:
-            return False
-        return True
-
 class deviceTable(uorm.Model):
 
     # Create devices table
@@ -445,36 +399,15 @@ class deviceTable(uorm.Model):
 
     @classmethod
     def public(cls):
-        # if cached: return cached table
-        if hasattr(cls,'_device'):  return cls._device
-        # no cache: fetch it!
-        try:
-            cls._device = [x for x in cls.get()]
-        except StopIteration:
-            return None
-        return cls._device
+        return list(cls.rows().values())
 
     @classmethod
     def getrow(cls):
-        # if cached: return cached record
-        if hasattr(cls,'_device'):  return cls._device
-        # no cache: fetch it!
         try:
-            cls._device = next(cls.get())
+            res = next(cls.get())
         except StopIteration:
             return None
-        return cls._device
-
-    @classmethod
-    def delete(cls, timestamp):
-        # delete the table record
-        try:
-            os.remove(cls.fname(timestamp))
-            # if cached: delete cached table
-            if hasattr(cls,'_device'):  del cls._device
-        except KeyError:
-            return False
-        return True
+        return res
 
 class notificationTable(uorm.Model):
 
@@ -490,11 +423,7 @@ class notificationTable(uorm.Model):
 
     @classmethod
     def public(cls):
-        try:
-            res = [x for x in cls.get()]
-        except StopIteration:
-            return None
-        return res
+        return list(cls.rows().values())
         
     @classmethod
     def getrow(cls):
@@ -504,15 +433,6 @@ class notificationTable(uorm.Model):
             return None
         return res
 
-    @classmethod
-    def delete(cls, timestamp):
-        # delete the table record
-        try:
-            os.remove(cls.fname(timestamp))
-        except KeyError:
-            return False
-        return True
-
 class serviceTable(uorm.Model):
 
     # Create service table
@@ -529,11 +449,7 @@ class serviceTable(uorm.Model):
 
     @classmethod
     def public(cls):
-        try:
-            res = [x for x in cls.get()]
-        except StopIteration:
-            return None
-        return res
+        return list(cls.rows().values())
         
     @classmethod
     def getrow(cls):
@@ -543,15 +459,6 @@ class serviceTable(uorm.Model):
             return None
         return res
 
-    @classmethod
-    def delete(cls, timestamp):
-        # delete the table record
-        try:
-            os.remove(cls.fname(timestamp))
-        except KeyError:
-            return False
-        return True
-
 class advancedTable(uorm.Model):
 
     # Create advanced table
@@ -606,11 +513,7 @@ class pluginstoreTable(uorm.Model):
 
     @classmethod
     def public(cls):
-        try:
-            res = [x for x in cls.get()]
-        except StopIteration:
-            return None
-        return res
+        return list(cls.rows().values())
         
     @classmethod
     def getrow(cls):
@@ -620,15 +523,6 @@ class pluginstoreTable(uorm.Model):
             return None
         return res
 
-    @classmethod
-    def delete(cls, timestamp):
-        # delete the table record
-        try:
-            os.remove(cls.fname(timestamp))
-        except KeyError:
-            return False
-        return True
-
 class scriptTable(uorm.Model):
 
     # Create script table
@@ -646,14 +540,7 @@ class scriptTable(uorm.Model):
 
     @classmethod
     def public(cls):
-        # if cached: return cached table
-        if hasattr(cls,'_script'):  return cls._script
-        # no cache: fetch it!
-        try:
-            cls._script = [x for x in cls.get()]
-        except StopIteration:
-            return None
-        return cls._script
+        return list(cls.rows().values())
 
     @classmethod
     def getrow(cls):
@@ -663,17 +550,6 @@ class scriptTable(uorm.Model):
             return None
         return res
 
-    @classmethod
-    def delete(cls, timestamp):
-        # delete the table record
-        try:
-            os.remove(cls.fname(timestamp))
-            # if cached: delete cached table
-            if hasattr(cls,'_script'):  del cls._script
-        except KeyError:
-            return False
-        return True
-
 class ruleTable(uorm.Model):
 
     # Create script table
@@ -684,20 +560,14 @@ class ruleTable(uorm.Model):
         ("id",  1),
         ("enable", "off"),
         ("name", ""),
+        ("event", ""),
         ("filename", ""),
         ("delay",  60),
     ])
 
     @classmethod
     def public(cls):
-        # if cached: return cached table
-        if hasattr(cls,'_rule'):  return cls._rule
-        # no cache: fetch it!
-        try:
-            cls._rule = [x for x in cls.get()]
-        except StopIteration:
-            return None
-        return cls._rule
+        return list(cls.rows().values())
 
     @classmethod
     def getrow(cls):
@@ -706,15 +576,4 @@ class ruleTable(uorm.Model):
         except StopIteration:
             return None
         return res
-
-    @classmethod
-    def delete(cls, timestamp):
-        # delete the table record
-        try:
-            os.remove(cls.fname(timestamp))
-            # if cached: delete cached table
-            if hasattr(cls,'_rule'):  del cls._rule
-        except KeyError:
-            return False
-        return True
                 
@@ -12,13 +12,243 @@
 # See LICENSE file in the project root for full license information.  
 #
 
-import gc
+import gc, utime, uasyncio as asyncio
+from array import array
+from asyn import Lock
 from operator import attrgetter
 from . import core
 from . import utils
 from . import db
 from .db import _dbc
 
+class inputs(object):
+
+    # Edges are captured by the pin irq handlers into a preallocated ring
+    # (timestamp, channel) and counted per channel, nothing is allocated
+    # in the irq. One coroutine drains the ring, debounces every channel
+    # from its last edge and calls back only when the stable level changed.
+
+    def __init__(self) :
+        self._log       = core._log
+        self._ticks     = array('L', [0] * core.INPUT_RING_SIZE)
+        self._channel   = bytearray(core.INPUT_RING_SIZE)
+        self._counts    = array('L', [0] * core.INPUT_MAX)
+        # channels that lost edges to a full ring, re-read by the coroutine
+        self._dirty     = bytearray(core.INPUT_MAX)
+        self._mask      = core.INPUT_RING_SIZE - 1
+        self._head      = 0
+        self._tail      = 0
+        self._overflow  = 0
+        self._channels  = [None] * core.INPUT_MAX
+        self._running   = False
+
+    def _handler(self, channel, callback):
+        ticks, chan, counts, dirty, mask = self._ticks, self._channel, self._counts, self._dirty, self._mask
+        if not callback:
+            # pulse counters: count only, bursts never touch the ring
+            def counter(pin):
+                counts[channel] += 1
+            return counter
+        def handler(pin):
+            counts[channel] += 1
+            head = self._head
+            nxt = (head + 1) & mask
+            if nxt == self._tail:
+                # ring full, edge still counted and the level re-read later
+                self._overflow += 1
+                dirty[channel] = 1
+                return
+            ticks[head] = utime.ticks_ms()
+            chan[head] = channel
+            self._head = nxt
+        return handler
+
+    def register(self, pin, callback, debounce, edge='both'):
+        try:
+            channel = self._channels.index(None)
+        except ValueError:
+            self._log.error("Hal: input, no free channel")
+            return None
+        from machine import Pin
+        trigger = {'rising': Pin.IRQ_RISING, 'falling': Pin.IRQ_FALLING}.get(edge, Pin.IRQ_RISING | Pin.IRQ_FALLING)
+        value = pin.value()
+        # [pin, callback, debounce, stable level, last edge, dirty, polled level]
+        self._channels[channel] = [pin, callback, debounce, value, 0, False, None]
+        self._counts[channel] = 0
+        self._dirty[channel] = 0
+        try:
+            pin.irq(handler=self._handler(channel, callback), trigger=trigger)
+        except (AttributeError, TypeError):
+            # no irq support on this port, polled by the coroutine
+            self._channels[channel][6] = value
+        if not self._running and self._needed():
+            self._running = True
+            asyncio.get_event_loop().create_task(self.asyncinputs())
+        return channel
+
+    def unregister(self, channel):
+        if channel is None or not self._channels[channel]: return
+        try:
+            self._channels[channel][0].irq(handler=None)
+        except (AttributeError, TypeError):
+            pass
+        self._channels[channel] = None
+
+    def _needed(self):
+        # only callbacks and polled pins need the coroutine, irq counters don't
+        for cur in self._channels:
+            if cur and (cur[1] or cur[6] is not None): return True
+        return False
+
+    def count(self, channel, reset=False):
+        try:
+            from machine import disable_irq, enable_irq
+            state = disable_irq()
+        except ImportError:
+            state = None
+        count = self._counts[channel]
+        if reset: self._counts[channel] = 0
+        if state is not None: enable_irq(state)
+        return count
+
+    async def asyncinputs(self):
+        # Async coroutine to debounce and coalesce all input edges
+        self._log.debug("Hal: Async processing inputs")
+        channels = self._channels
+
+        while self._needed():
+            now = utime.ticks_ms()
+            # drain edges captured by the irq handlers
+            while self._tail != self._head:
+                cur = channels[self._channel[self._tail]]
+                if cur:
+                    cur[4] = self._ticks[self._tail]
+                    cur[5] = True
+                self._tail = (self._tail + 1) & self._mask
+            if self._overflow:
+                self._log.warning("Hal: input ring overflow, {} edges".format(self._overflow))
+                self._overflow = 0
+
+            delay = core.INPUT_POLL_MS
+            for channel, cur in enumerate(channels):
+                if not cur: continue
+                # edges lost to a full ring: debounce from now, read the pin again
+                if self._dirty[channel]:
+                    self._dirty[channel] = 0
+                    cur[4] = now
+                    cur[5] = True
+                # pins without irq: detect edges here
+                if cur[6] is not None:
+                    value = cur[0].value()
+                    if value != cur[6]:
+                        cur[6] = value
+                        cur[4] = now
+                        cur[5] = True
+                        self._counts[channel] += 1
+                if not cur[5]: continue
+                # stable long enough? report level if it changed
+                wait = cur[2] - utime.ticks_diff(now, cur[4])
+                if wait > 0:
+                    delay = min(delay, wait)
+                    continue
+                cur[5] = False
+                value = cur[0].value()
+                if value != cur[3]:
+                    cur[3] = value
+                    if cur[1]:
+                        try:
+                            cur[1](value)
+                        except Exception as e:
+                            self._log.error("Hal: input callback exception: "+repr(e))
+
+            await asyncio.sleep_ms(delay)
+
+        self._running = False
+
+class i2cbus(object):
+
+    # One per i2c bus, shared by all plugins on it. Every transaction runs
+    # under the bus lock, reads go into caller owned buffers and grouped
+    # operations run back to back without other devices in between.
+
+    def __init__(self, id, i2c) :
+        self._log       = core._log
+        self.id         = id
+        self.i2c        = i2c
+        self._lock      = Lock()
+        self.stats      = {'transactions': 0, 'bytes': 0, 'errors': 0, 'waits': 0, 'busy_us': 0, 'max_us': 0}
+
+    def _account(self, start, nbytes):
+        busy = utime.ticks_diff(utime.ticks_us(), start)
+        stats = self.stats
+        stats['transactions'] += 1
+        stats['bytes'] += nbytes
+        stats['busy_us'] += busy
+        if busy > stats['max_us']: stats['max_us'] = busy
+
+    async def __aenter__(self):
+        # exclusive bus access over several awaits, e.g. trigger/wait/read
+        if self._lock.locked(): self.stats['waits'] += 1
+        await self._lock.acquire()
+        return self.i2c
+
+    async def __aexit__(self, *args):
+        self._lock.release()
+
+    async def batch(self, ops):
+        # ops: preallocated list of (addr, reg, buf, write), run back to back
+        if self._lock.locked(): self.stats['waits'] += 1
+        await self._lock.acquire()
+        start = utime.ticks_us()
+        nbytes = 0
+        try:
+            for addr, reg, buf, write in ops:
+                if write: self.i2c.writeto_mem(addr, reg, buf)
+                else: self.i2c.readfrom_mem_into(addr, reg, buf)
+                nbytes += len(buf)
+        except OSError:
+            self.stats['errors'] += 1
+            raise
+        finally:
+            self._account(start, nbytes)
+            self._lock.release()
+
+    async def transfer(self, addr, reg, buf, write=False):
+        # one register burst from/to buf
+        if self._lock.locked(): self.stats['waits'] += 1
+        await self._lock.acquire()
+        start = utime.ticks_us()
+        try:
+            if write: self.i2c.writeto_mem(addr, reg, buf)
+            else: self.i2c.readfrom_mem_into(addr, reg, buf)
+        except OSError:
+            self.stats['errors'] += 1
+            raise
+        finally:
+            self._account(start, len(buf))
+            self._lock.release()
+
+    async def readfrom_mem_into(self, addr, reg, buf):
+        # burst read into caller owned buf, no allocation
+        await self.transfer(addr, reg, buf)
+
+    async def writeto_mem(self, addr, reg, buf):
+        await self.transfer(addr, reg, buf, True)
+
+    async def run(self, func, *args):
+        # run a synchronous driver call, e.g. a display refresh, as one transaction
+        if self._lock.locked(): self.stats['waits'] += 1
+        await self._lock.acquire()
+        start = utime.ticks_us()
+        try:
+            return func(*args)
+        except OSError:
+            self.stats['errors'] += 1
+            raise
+        finally:
+            self._account(start, 0)
+            self._lock.release()
+
 class hal(object):
 
     def __init__(self) :
@@ -29,6 +259,7 @@ class hal(object):
         self._log       = core._log
         self._hal       = core._hal
         self._utils     = core._utils
+        self._inputs    = inputs()
 
     def init_network(self, mode = core.NET_STA):
         self._log.debug("Hal: Init")
@@ -418,6 +649,9 @@ class hal(object):
         #DST
         if dst == 'on': rtctime+=3600
         self._log.debug("Hal: DST corrected NTP Time: %d" % rtctime)
+        # the rtc runs on local time, http dates need gmt
+        import picoweb
+        picoweb.UTC_OFFSET = timezone*60 + (3600 if dst == 'on' else 0)
 
         return rtctime
             
@@ -893,6 +1127,19 @@ class hal(object):
 
         return pin
 
+    def input(self, vpin, callback=None, pull=core.PIN_PULL_UP, debounce=core.INPUT_DEBOUNCE_MS, edge='both'):
+        # irq driven, debounced input: callback(value) on every state change
+        pin = self.pin(vpin, core.PIN_IN, pull)
+        if not pin: return None
+        return self._inputs.register(pin, callback, debounce, edge)
+
+    def input_release(self, channel):
+        self._inputs.unregister(channel)
+
+    def input_count(self, channel, reset=False):
+        # raw edges seen by the irq handler, bursts included
+        return self._inputs.count(channel, reset)
+
     def vpin2pin(self, vpin):
         self._log.debug("Hal: vpin2pin = {}".format(vpin))
 
@@ -1066,6 +1313,21 @@ class hal(object):
             self._log.error("Hal: get i2c failure")
             return None
 
+    def get_i2cbus(self, id=1):
+        # shared, serialised access to i2c bus id
+        if not hasattr(self,'_i2cbus'):
+            self._i2cbus = {}
+        if id not in self._i2cbus:
+            i2c = self.get_i2c(id)
+            if i2c is None: return None
+            self._i2cbus[id] = i2cbus(id, i2c)
+        return self._i2cbus[id]
+
+    def get_i2cstats(self):
+        # per bus timing statistics
+        if not hasattr(self,'_i2cbus'): return {}
+        return dict((id, bus.stats) for id, bus in self._i2cbus.items())
+
     def get_spi(self, id=1):
         self._log.debug("Hal: get spi")
 
@@ -19,6 +19,7 @@ from .hal import hal
 from .plugin import plugins
 from .protocol import protocol
 from .script import scripts
+from .route import routes
 
 class init (object):
     
@@ -219,6 +220,10 @@ class init (object):
             core._protocols = self._protocols
             self._protocols.init()
            
+        # Init routing table
+        self._routes = routes()
+        core._routes = self._routes
+
         # Init all plugins
         self._plugins = plugins()
         core._plugins = self._plugins
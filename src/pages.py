@@ -26,6 +26,69 @@ _hal        = core._hal
 _utils      = core._utils
 _scripts    = core._scripts
 
+class formfile:
+    # read_form() sink: streams the 'content' field straight into
+    # prefix+filename instead of keeping the whole text in RAM
+    def __init__(self, request, prefix=''):
+        self.request = request
+        self.prefix = prefix
+        self.file = None
+
+    def __call__(self, name, filename):
+        if name != 'content' or not self.request.form.get('filename'): return None
+        try:
+            self.file = open(self.prefix+self.request.form['filename'], 'wb')
+        except OSError:
+            _log.error("Pages: Exception opening file for form content!")
+        return self.file
+
+    def finish(self):
+        # content not streamed (posted before the filename, or not at all):
+        # write the buffered field, an empty file if there is none
+        if not self.file and self.request.form.get('filename'):
+            self.file = open(self.prefix+self.request.form['filename'], 'wb')
+            self.file.write(self.request.form.get('content', '').encode())
+            self.file.close()
+
+class settingsfile:
+    # read_form() sink for an uploaded settings backup: restores the
+    # alternating "config/<table>/<pkey>" / record lines as they arrive
+    def __init__(self):
+        self.line = b""
+        self.name = None
+
+    def write(self, data):
+        lines = (self.line + data).split(b"\n")
+        self.line = lines.pop()
+        for line in lines: self.record(line.strip())
+
+    def close(self):
+        self.record(self.line.strip())
+        self.line = b""
+
+    def record(self, line):
+        if not line: return
+        line = line.decode("utf-8")
+        if self.name is None:
+            self.name = line
+            return
+        name, self.name = self.name, None
+        # don't import backup file data
+        if name[:16] == 'Backup Filename:':
+            _log.debug("Pages: Loadsettings: Loaded backupfile: "+name)
+            _log.debug("Pages: Loadsettings: Loaded backupfilesize: "+line)
+        # don't import protocol/plugin data which are regenerated everytime upyeasy starts!
+        elif name[:15] != 'config/protocol' and name[:13] != 'config/plugin':
+            gc.collect()
+            _log.debug("Pages: Loadsettings: Loading Filename: "+name)
+            try:
+                dbdir, table, pkey = name.split('/')
+                # records are saved as json encoded json strings
+                _dbc.store(table, pkey, ujson.loads(ujson.loads(line)))
+            except (TypeError, ValueError, OSError):
+                _log.error("Pages: Loadsettings: Exception writing settings file!")
+            _log.debug("Pages: Loadsettings: Settingsfile "+name+" processed")
+
 def auth_page(request, response):
     # Are you authorized to use uPyEasy?
     _log.debug("Pages: Authorized User?")
@@ -166,11 +229,10 @@ def post_home_page(request, response):
     dbnetwork = db.networkTable.getrow()
 
     # Get all form values in a dict
-    yield from request.read_form_data()
-    uform = _utils.get_form_values(request.form)
+    uform = yield from request.read_form()
 
     # map form values to db records
-    network = _utils.map_form2db(dbnetwork, uform)
+    network = _utils.map_form2db(db.networkTable, dbnetwork, uform)
 
     # STA mode or AP mode?
     if network['ssid'] == 'APMODE':
@@ -328,12 +390,11 @@ def post_config_page(request, response):
     dbnetwork = db.networkTable.getrow()
 
     # Get all form values in a dict
-    yield from request.read_form_data()
-    uform = _utils.get_form_values(request.form)
+    uform = yield from request.read_form()
 
     # map form values to db records
-    config = _utils.map_form2db(_dbconfig, uform)
-    network = _utils.map_form2db(dbnetwork, uform)
+    config = _utils.map_form2db(db.configTable, _dbconfig, uform)
+    network = _utils.map_form2db(db.networkTable, dbnetwork, uform)
 
     # convert password to base64 pw
     if config['password']:
@@ -505,8 +566,7 @@ def post_controller_settingpage(request, response):
         _log.debug(oper)
     else: oper = None
     # Get all form values in a dict
-    yield from request.read_form_data()
-    uform = _utils.get_form_values(request.form)
+    uform = yield from request.read_form()
     
     if id > 0:
         #Update controller
@@ -535,7 +595,7 @@ def post_controller_settingpage(request, response):
             if _dbcontroller['id'] == id:
                break
 
-        controller = _utils.map_form2db(_dbcontroller, uform)
+        controller = _utils.map_form2db(db.controllerTable, _dbcontroller, uform)
         
         # Verify mandatory fields!
         if controller['hostname']:
@@ -622,7 +682,7 @@ def post_controller_settingpage(request, response):
             # Empty controller
             _dbcontroller = OrderedDict(db.controllerTable.__schema__)
 
-            controller = _utils.map_form2db(_dbcontroller, uform)
+            controller = _utils.map_form2db(db.controllerTable, _dbcontroller, uform)
             print(controller)
             print(uform)
             # Verify mandatory fields!
@@ -736,10 +796,9 @@ def post_hardware_page(request, response):
     dxmap = db.dxmapTable.getrow()
     
     # Get all form values in a dict
-    yield from request.read_form_data()
-    uform = _utils.get_form_values(request.form)
+    uform = yield from request.read_form()
 
-    hardware = _utils.map_form2db(dbhardware, uform)
+    hardware = _utils.map_form2db(db.hardwareTable, dbhardware, uform)
 
     # New/reassigned/delete pin assignment
     _utils.pin_assignment('boardled',hardware['boardled'],dxmap["count"],dxpin)
@@ -822,10 +881,9 @@ def post_dxbootstate_page(request, response):
     dxmap = db.dxmapTable.getrow()
     
     # Get all form values in a dict
-    yield from request.read_form_data()
-    uform = _utils.get_form_values(request.form)
+    uform = yield from request.read_form()
 
-    hardware = _utils.map_form2db(dbhardware, uform)
+    hardware = _utils.map_form2db(db.hardwareTable, dbhardware, uform)
 
     # Verify mandatory fields!
     cid = db.hardwareTable.update({"timestamp":hardware['timestamp']},d0=hardware['d0'],d1=hardware['d1'],d2=hardware['d2'],d3=hardware['d3'],d4=hardware['d4'],d5=hardware['d5'],d6=hardware['d6'],d7=hardware['d7'],d8=hardware['d8'],d9=hardware['d9'],d10=hardware['d10'],d11=hardware['d11'],d12=hardware['d12'],d13=hardware['d13'],d14=hardware['d14'],d15=hardware['d15'],d16=dxpin['d16'],d17=dxpin['d17'],d18=dxpin['d18'],d19=dxpin['d19'],d20=dxpin['d20'],d21=dxpin['d21'],d22=dxpin['d22'],d23=dxpin['d23'],d24=dxpin['d24'],d25=dxpin['d25'],d26=dxpin['d26'],d27=dxpin['d27'],d28=dxpin['d28'],d29=dxpin['d29'],d30=dxpin['d30'],d31=dxpin['d31'],d32=dxpin['d32'],d33=dxpin['d33'],d34=dxpin['d34'],d35=dxpin['d35'],d36=dxpin['d36'],d37=dxpin['d37'],d38=dxpin['d38'],d39=dxpin['d39'])
@@ -1037,6 +1095,71 @@ def get_devicesetting_page(request, response):
             yield from app.render_template(response, "plugin.html",(info, plugins,))
             yield from app.render_template(response, "footer.html",(info,))
 
+@app.route("/api/v1.0/values", methods=['GET'])
+def get_values_api(request, response):
+    if not auth_page(request, response): 
+        yield from response.awrite('HTTP/1.1 401 Unauthorized\r\n')
+        yield from response.awrite("WWW-Authenticate: Basic realm='Access to uPyEasy', charset='UTF-8'\r\n")
+        return
+
+    _log.debug("Pages GET: Entering Values API")
+
+    # all devices, or /api/v1.0/values/<devicename>
+    if request.qs:
+        devicename = picoweb.utils.unquote_plus(request.qs[0])
+        last = _utils.get_lastvalues(devicename)
+        if last is None:
+            yield from picoweb.start_response(response, "application/json", "404")
+            yield from response.awrite('{"error":"unknown device"}')
+            return
+        devices = ((devicename, last),)
+    else:
+        devices = _utils.get_lastvalues()
+        devices = [(name, devices[name]) for name in list(devices)]
+
+    # streamed, device by device
+    yield from picoweb.start_response(response, "application/json")
+    yield from response.awrite('{"unit":')
+    yield from response.awrite(ujson.dumps(_utils.get_upyeasy_name()))
+    yield from response.awrite(',"time":{},"devices":{{'.format(_hal.get_time_sec()))
+    first = True
+    for name, last in devices:
+        if not first: yield from response.awrite(',')
+        first = False
+        yield from response.awrite(ujson.dumps(name))
+        yield from response.awrite(':{{"time":{},"values":'.format(last[0]))
+        yield from picoweb.jsonstream(response, last[1])
+        yield from response.awrite('}')
+    yield from response.awrite('}}')
+
+@app.route("/api/v1.0/events", methods=['GET'], stream=True)
+def get_events_api(request, response):
+    if not auth_page(request, response): 
+        yield from response.awrite('HTTP/1.1 401 Unauthorized\r\n')
+        yield from response.awrite("WWW-Authenticate: Basic realm='Access to uPyEasy', charset='UTF-8'\r\n")
+        return
+
+    _log.debug("Pages GET: Entering Events API")
+
+    # Server-Sent Events, one data line per device reading
+    yield from picoweb.start_response(response, "text/event-stream", headers={"Cache-Control":"no-cache"})
+    yield from response.flush()
+    client = _utils.subscribe_events()
+    try:
+        while True:
+            events = yield from client.get(15000)
+            if events:
+                for event in events:
+                    yield from response.awrite(event)
+            else:
+                # keepalive comment, finds dead clients
+                yield from response.awrite(":\n\n")
+            yield from response.flush()
+    except OSError as e:
+        _log.debug("Pages: Events client gone: "+repr(e))
+    finally:
+        _utils.unsubscribe_events(client)
+
 @app.route("/api/v1.0/device", methods=['DELETE'])
 def del_devicesetting_page(request, response):
     if not auth_page(request, response): 
@@ -1121,8 +1244,7 @@ def post_devicesetting_page(request, response):
         else: oper = None
 
         # Get all form values in a dict
-        yield from request.read_form_data()
-        uform = _utils.get_form_values(request.form)
+        uform = yield from request.read_form()
  
         if 'pluginid' in uform: 
             #get new plugin id
@@ -1159,15 +1281,16 @@ def post_devicesetting_page(request, response):
             # Get dxpin config
             dxpin = db.dxpinTable.getrow()
 
+            # exchange values from form to device, a copy of the cached record
+            device = _utils.map_form2db(db.deviceTable, dbdevice, uform)
+
             #contract dxpin fields
-            dbdevice['dxpin'] = ""
+            device['dxpin'] = ""
             for dxcnt in range(0,plugin['pincnt']):
                 dxpin["d{}".format(dxcnt)] = dbdevice['name']
-                dbdevice['dxpin'] += str(uform['dxpin'+str(dxcnt)])
-                if dxcnt < plugin['pincnt']-1: dbdevice['dxpin'] += ";"
+                device['dxpin'] += str(uform['dxpin'+str(dxcnt)])
+                if dxcnt < plugin['pincnt']-1: device['dxpin'] += ";"
                 
-            # exchange values from form to device
-            device = _utils.map_form2db(dbdevice, uform)
 
             # Verify mandatory fields!
             if device['id']:
@@ -1298,7 +1421,7 @@ def post_devicesetting_page(request, response):
                 # set form values
                 # Empty device, dict converted to list
                 db_device = OrderedDict(db.deviceTable.__schema__)
-                device = _utils.map_form2db(db_device, uform)
+                device = _utils.map_form2db(db.deviceTable, db_device, uform)
 
                 # Get correct plugin
                 plugfound = False
@@ -1536,27 +1659,16 @@ def post_rulesetting_page(request, response):
     _log.debug("Pages POST: Entering rule Settings Page")
     # Get all form values in a dict
     parsed_qs = picoweb.utils.parse_qs(request.qs)
-    yield from request.read_form_data()
-    uform = _utils.get_form_values(request.form)
+    sink = formfile(request, 'rules/')
+    uform = yield from request.read_form(sink)
 
-    if uform['filename']:
+    if uform.get('filename'):
         #Create rule
         _log.debug("Pages: Create rule: {}".format(uform['filename']))
-        
+        _log.debug("Pages: rule filename: rules/"+uform['filename'])
         try:
-            content = uform['content']
-        except TypeError:
-            content = ""
-                    
-        # get filename
-        filename = 'rules/'+uform['filename']
-
-        _log.debug("Pages: rule filename: "+filename)
-        try:
-            rule_file = open(filename, 'w')
-            rule_file.write(content)
-            rule_file.close() 
-        except TypeError:
+            sink.finish()
+        except OSError:
             _log.error("Pages: Exception getting rule creation from data!")
 
         # reload all rules
@@ -1754,27 +1866,16 @@ def post_scriptsetting_page(request, response):
     _log.debug("Pages POST: Entering Script Settings Page")
     parsed_qs = picoweb.utils.parse_qs(request.qs)
     # Get all form values in a dict
-    yield from request.read_form_data()
-    uform = _utils.get_form_values(request.form)
+    sink = formfile(request, 'scripts/')
+    uform = yield from request.read_form(sink)
 
-    if uform['filename']:
+    if uform.get('filename'):
         #Create Script
         _log.debug("Pages: Create Script: {} ".format(uform['filename']))
-        
-        try:
-            content = uform['content']
-        except TypeError:
-            content = ""
-        
-        # get filename
-        filename = 'scripts/'+uform['filename']
-
-        _log.debug("Pages: Script filename: "+filename)
+        _log.debug("Pages: Script filename: scripts/"+uform['filename'])
         try:
-            script_file = open(filename, 'w')
-            script_file.write(content)
-            script_file.close() 
-        except TypeError:
+            sink.finish()
+        except OSError:
             _log.error("Pages: Exception getting script creation from data!")
 
         # reload all scripts
@@ -1972,8 +2073,7 @@ def post_notificationsetting_page(request, response):
         else: oper = None
 
         # Get all form values in a dict
-        yield from request.read_form_data()
-        uform = _utils.get_form_values(request.form)
+        uform = yield from request.read_form()
 
         if uform['currentserviceid'] != uform['serviceid']:
             notificationchange = True
@@ -1998,7 +2098,7 @@ def post_notificationsetting_page(request, response):
                        break
                     
                 # set form values
-                notification = _utils.map_form2db(dbnotification, uform)
+                notification = _utils.map_form2db(db.notificationTable, dbnotification, uform)
 
                 # Verify mandatory fields!
                 if notification['id'] != 0:
@@ -2130,7 +2230,7 @@ def post_notificationsetting_page(request, response):
                 _log.debug("Pages: notification max Count: {}".format(cnt))
                     
                 # set form values
-                notification = _utils.map_form2db(dbnotification, uform)
+                notification = _utils.map_form2db(db.notificationTable, dbnotification, uform)
                 
                 # Verify mandatory fields!
                 if serviceid != 0:
@@ -2278,36 +2378,30 @@ def get_tool_page(request, response):
         # start html transfer
         yield from picoweb.start_response(response,content_type="text/plain\r\nContent-Disposition: attachment; filename={}\r\n".format(backupfilename))
         
-        # get all config file names
-        import uos 
-        
-        # get all config dirs
+        # get all config tables
         try:
-            dirs = sorted(uos.ilistdir('config'))
+            tables = sorted(_dbc.tables())
         except OSError as e:
            _log.error("Pages: savesettings dir exception: "+repr(e))
            return False
         
-        # get all config files
-        for dir in dirs: 
-            if dir[0] != '.' and dir[0] != '..':
-                fulldir = 'config/'+dir[0]
-                _log.debug("Pages: savesettings fulldir: "+fulldir)
-                try:
-                    files = sorted(uos.ilistdir(fulldir))
-                except OSError as e:
-                    _log.error("Pages: savesettings file exception: "+repr(e))
-                    return False
-                for file in files:
-                    if file[0] != '.' and file[0] != '..':
-                        fullfile = fulldir +'/'+ file[0]
-                        gc.collect()
-                        file_desc = open(fullfile, 'r')
-                        content = ujson.dumps(file_desc.read())
-                        file_desc.close()
-                        filedata = fullfile+"\r\n"+content+"\r\n"
-                        yield from response.awrite(filedata)
-                        backupfilesize += len(filedata)
+        # get all config records, one config/<table>/<record> entry each
+        for table in tables: 
+            fulldir = 'config/'+table
+            _log.debug("Pages: savesettings fulldir: "+fulldir)
+            try:
+                # from flash, cached rows may carry page decorations
+                rows = _dbc.load(table)
+            except OSError as e:
+                _log.error("Pages: savesettings file exception: "+repr(e))
+                return False
+            for pkey in sorted(rows):
+                fullfile = fulldir +'/'+ pkey
+                gc.collect()
+                content = ujson.dumps(ujson.dumps(rows[pkey]))
+                filedata = fullfile+"\r\n"+content+"\r\n"
+                yield from response.awrite(filedata)
+                backupfilesize += len(filedata)
         
         # end file with filename and size
         filedata = "Backup Filename: "+backupfilename+"\r\nBackup File Size: "
@@ -2349,35 +2443,11 @@ def post_tool_page(request, response):
 
     _log.debug("Pages POST: Entering Tools Page")
 
-    # get data and size of return backup file
-    size = int(request.headers[b"Content-Length"])
-    data = yield from request.reader.read(size)
-    # We're cutting off the boundary part
-    size -= 214
+    # restore the backup file record by record while it is uploaded
+    yield from request.read_form(lambda name, filename: settingsfile() if name == 'datafile' else None)
 
-    # Get all data in a string
-    content = data.decode("utf-8").split("octet-stream")[1].split("------")[0].replace("\\","").strip().splitlines()
-    
-    # save all files
-    for cnt in range(0, len(content), 2):
-        # don't import backup file data
-        if content[cnt][:16] != 'Backup Filename:':
-            # don't import protocol/plugin data which are regenerated everytime upyeasy starts!
-            if content[cnt][:15] != 'config/protocol' and content[cnt][:13] != 'config/plugin':
-                gc.collect()
-                _log.debug("Pages: Loadsettings: Loading Filename: "+content[cnt])
-                _log.debug("Pages: Loadsettings: Filename content: "+content[cnt+1][1:20]+"...")
-                try:
-                    file_desc = open(content[cnt], 'w')
-                    file_desc.write(content[cnt+1][1:-1])
-                    file_desc.close() 
-                except TypeError:
-                    _log.error("Pages: Loadsettings: Exception writing settings file!")
-                _log.debug("Pages: Loadsettings: Settingsfile "+content[cnt]+" processed")
-        else:
-            _log.debug("Pages: Loadsettings: Loaded backupfile: "+content[cnt])
-            _log.debug("Pages: Loadsettings: Loaded backupfilesize: "+content[cnt+1])
-            _log.debug("Pages: Loadsettings: original backupfilesize: "+str(size))
+    # records stored behind the models: drop all table caches
+    _dbc.invalidate()
 
     #return to tools page
     yield from response.awrite("HTTP/1.0 301 Moved Permanently\r\n")
@@ -2566,31 +2636,18 @@ def post_filesetting_page(request, response):
     #Display device settings page
     _log.debug("Pages POST: Entering file settings Page")
     # Get all form values in a dict
-    yield from request.read_form_data()
-    uform = _utils.get_form_values(request.form)
+    sink = formfile(request)
+    uform = yield from request.read_form(sink)
 
-    try:
-        qs_name = uform["filename"]
-    except TypeError:
-        qs_name = ""
+    qs_name = uform.get("filename", "")
     _log.debug('Parsed name: {}'.format(qs_name))
 
     if qs_name:
         #Create Script
         _log.debug("Pages: Create file: "+qs_name)
-        
-        try:
-            content = uform['content']
-        except TypeError:
-            content = ""
-        
-        filename = ''.join(qs_name)
-        _log.debug("Pages: File name: "+filename)
         try:
-            file_desc = open(filename, 'w')
-            file_desc.write(content)
-            file_desc.close() 
-        except TypeError:
+            sink.finish()
+        except OSError:
             _log.error("Pages: Exception getting file creation form data!")
 
         #return to devices page
@@ -2637,8 +2694,7 @@ def post_advanced_page(request, response):
     _log.debug("Pages: Update Advanced")
     
     # Get all form values in a dict
-    yield from request.read_form_data()
-    uform = _utils.get_form_values(request.form)
+    uform = yield from request.read_form()
 
     #init ONLY!
     try:
@@ -2650,7 +2706,7 @@ def post_advanced_page(request, response):
     dbadvanced = db.advancedTable.getrow()
 
     # get form values
-    advanced = _utils.map_form2db(dbadvanced, uform)
+    advanced = _utils.map_form2db(db.advancedTable, dbadvanced, uform)
 
     # new ntp server = run settime
     if advanced['ntphostname'] != dbadvanced['ntphostname']: _hal.settime()
@@ -2737,6 +2793,10 @@ def get_info_page(request, response):
     info['gateway'] = _hal.get_ip_gw()    
     info['subnet'] = _hal.get_ip_netmask('eth0')    
     info['dns'] = _hal.get_ip_dns('eth0')    
+    # web server admission counters
+    info['web'] = app.stats
+    info['webactive'] = app.active
+    info['weblimit'] = app.max_connections
 
     # menu settings
     menu = 9
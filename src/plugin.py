@@ -9,7 +9,7 @@
 # Licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
 # See LICENSE file in the project root for full license information.  
 #
-import gc, sys, os, utime, ujson, uasyncio as asyncio, uasyncio.queues as queues
+import gc, sys, os, utime, ujson, urandom, uheapq, uasyncio as asyncio
 from asyn import Event
 from . import core, db, utils
 from .app import app
@@ -30,6 +30,11 @@ class plugins(object):
         self._plugin = {}
         self._plugin_class = {}
         self._mod = {}
+        # device scheduler: deadline heap of [due, seq, period, base, device]
+        self._schedule = []
+        self._version = None
+        self._now = 0
+        self._ticks = 0
         
     def init(self): 
         # Load all plugins
@@ -37,11 +42,11 @@ class plugins(object):
 
         self._log.debug("Plugins: Init plugin records")
         # script queue
-        self._scriptqueue = queues.Queue(maxsize=100)
+        self._scriptqueue = utils.wakequeue(maxsize=100)
         # rules queue
-        self._rulequeue = queues.Queue(maxsize=100)
+        self._rulequeue = utils.wakequeue(maxsize=100)
         # script queue
-        self._valuequeue = queues.Queue(maxsize=100)
+        self._valuequeue = utils.wakequeue(maxsize=100)
        
         # delete plugin record if plugin NOT present in frozen firmware!
         tplugins = db.pluginTable.public()
@@ -83,53 +88,50 @@ class plugins(object):
 
         _initcomplete = False
         # find plugin
-        tplugins = db.pluginTable.public()
+        plugin = db.pluginTable.lookup('id', device['pluginid'])
         pluginname = None
-        for plugin in tplugins:
-            if plugin['id'] == device['pluginid']:
-                pluginname = plugin['name']
-                devicename = device['name']
-                queue      = None
+        if plugin:
+            pluginname = plugin['name']
+            devicename = device['name']
+            queue      = None
                 
-                # only get controller in non-AP mode!
-                if core.initial_upyeasywifi != core.NET_STA_AP:
-                    # Get correct controller
-                    controllers = db.controllerTable.public()
-                    for controller in controllers:
-                        if controller['id'] == device['controller']:
-                           queue = self._protocols.getqueue(controller)
-                           break
-
-                # load plugin  
-                modname = plugin['module']
-                self._mod[pluginname] = __import__("upyeasy.plugins."+modname,globals(), locals(), 'plugin')
-                self._plugin_class[pluginname] = getattr(self._mod[pluginname], modname+'_plugin')
-
-                # update plugin?
-                if plugin["dtype"] == "":
-                    modplugin = self._mod[pluginname]
-                    try:
-                       self._log.debug("Plugins: Updating frozen plugin db record:"+pluginname)
-                       db.pluginTable.update({"timestamp":plugin['timestamp']},dtype=modplugin.dtype,stype=modplugin.stype,valuecnt=modplugin.valuecnt,senddata=modplugin.senddata,formula=modplugin.formula,sync=modplugin.sync,timer=modplugin.timer,pullup=modplugin.pullup,inverse=modplugin.inverse,port=modplugin.port)
-                    except OSError:
-                        self._log.error("Plugins: Exception creating frozen plugin db record:"+pluginname)
+            # only get controller in non-AP mode!
+            if core.initial_upyeasywifi != core.NET_STA_AP:
+                # Get correct controller
+                controller = db.controllerTable.lookup('id', device['controller'])
+                if controller:
+                       queue = self._protocols.getqueue(controller)
+
+            # load plugin  
+            modname = plugin['module']
+            self._mod[pluginname] = __import__("upyeasy.plugins."+modname,globals(), locals(), 'plugin')
+            self._plugin_class[pluginname] = getattr(self._mod[pluginname], modname+'_plugin')
+
+            # update plugin?
+            if plugin["dtype"] == "":
+                modplugin = self._mod[pluginname]
+                try:
+                   self._log.debug("Plugins: Updating frozen plugin db record:"+pluginname)
+                   db.pluginTable.update({"timestamp":plugin['timestamp']},dtype=modplugin.dtype,stype=modplugin.stype,valuecnt=modplugin.valuecnt,senddata=modplugin.senddata,formula=modplugin.formula,sync=modplugin.sync,timer=modplugin.timer,pullup=modplugin.pullup,inverse=modplugin.inverse,port=modplugin.port)
+                except OSError:
+                    self._log.error("Plugins: Exception creating frozen plugin db record:"+pluginname)
                 
-                # instantiate plugin
-                self._plugin[devicename] = self._plugin_class[pluginname]()
-                self._log.debug("Plugins: Init device: "+devicename+" ,instantiate plugin: "+pluginname)
+            # instantiate plugin
+            self._plugin[devicename] = self._plugin_class[pluginname]()
+            self._log.debug("Plugins: Init device: "+devicename+" ,instantiate plugin: "+pluginname)
 
-                # init plugin
-                plugin['client_id'] = core.__logname__+self._utils.get_upyeasy_name()
-                if devicename: 
-                    try:
-                        if not self._plugin[devicename].init(plugin, device, queue, self._scriptqueue, self._rulequeue, self._valuequeue):
-                            self._log.debug("Plugins: Init device: "+device['name']+" with plugin: "+str(device['pluginid'])+" failed, disabling!")
-                            # device init failed, disable!
-                            db.deviceTable.update({"timestamp":device['timestamp']},enable="off")
-                    except Exception as e:
-                        self._log.error("Plugins: Init device: "+device['name']+" with plugin: "+str(device['pluginid'])+" failed, exception: "+repr(e))
-                    else: 
-                        _initcomplete = True
+            # init plugin
+            plugin['client_id'] = core.__logname__+self._utils.get_upyeasy_name()
+            if devicename: 
+                try:
+                    if not self._plugin[devicename].init(plugin, device, queue, self._scriptqueue, self._rulequeue, self._valuequeue):
+                        self._log.debug("Plugins: Init device: "+device['name']+" with plugin: "+str(device['pluginid'])+" failed, disabling!")
+                        # device init failed, disable!
+                        db.deviceTable.update({"timestamp":device['timestamp']},enable="off")
+                except Exception as e:
+                    self._log.error("Plugins: Init device: "+device['name']+" with plugin: "+str(device['pluginid'])+" failed, exception: "+repr(e))
+                else: 
+                    _initcomplete = True
                 
         if not _initcomplete: 
             self._log.debug("Plugins: Init device {} failed!".format(device['name']))
@@ -154,68 +156,61 @@ class plugins(object):
     def loadvalues(self, device, valuenames): 
         self._log.debug("Plugins: Loadvalues plugin")
 
-        # load values
-        devices=db.deviceTable.public()
-        # Get right device!
-        for devicedb in devices:
-            if devicedb['name'] == device['name']:
-                valuenames["valueN1"],valuenames["valueN2"],valuenames["valueN3"]=devicedb['valuename']
-                valuenames["valueF1"],valuenames["valueF2"],valuenames["valueF3"]=devicedb['valueformula']
-                valuenames["valueD1"],valuenames["valueD2"],valuenames["valueD3"]=devicedb['valuedecimal']
+        # load values, get right device!
+        devicedb = db.deviceTable.lookup('name', device['name'])
+        if devicedb:
+            valuenames["valueN1"],valuenames["valueN2"],valuenames["valueN3"]=devicedb['valuename']
+            valuenames["valueF1"],valuenames["valueF2"],valuenames["valueF3"]=devicedb['valueformula']
+            valuenames["valueD1"],valuenames["valueD2"],valuenames["valueD3"]=devicedb['valuedecimal']
 
     def savevalues(self, device, valuenames): 
         self._log.debug("Plugins: Savevalues plugin")
 
-        # process values
-        devices=db.deviceTable.public()
-        # Get right device!
-        for devicedb in devices:
-            if devicedb['name'] == device['name']:
-                namelist = valuenames["valueN1"]+';'+valuenames["valueN2"]+';'+valuenames["valueN3"]
-                formulalist = valuenames["valueF1"]+';'+valuenames["valueF2"]+';'+valuenames["valueF3"]
-                decimallist = valuenames["valueD1"]+';'+valuenames["valueD2"]+';'+valuenames["valueD3"]
-                db.deviceTable.update({"timestamp":devicedb['timestamp']},valuename=namelist, valueformula=formulalist , valuedecimal=decimallist)
-                return
+        # process values, get right device!
+        devicedb = db.deviceTable.lookup('name', device['name'])
+        if devicedb:
+            namelist = valuenames["valueN1"]+';'+valuenames["valueN2"]+';'+valuenames["valueN3"]
+            formulalist = valuenames["valueF1"]+';'+valuenames["valueF2"]+';'+valuenames["valueF3"]
+            decimallist = valuenames["valueD1"]+';'+valuenames["valueD2"]+';'+valuenames["valueD3"]
+            # unchanged: no write, no device table version bump
+            if devicedb['valuename'] == namelist and devicedb['valueformula'] == formulalist and devicedb['valuedecimal'] == decimallist: return
+            db.deviceTable.update({"timestamp":devicedb['timestamp']},valuename=namelist, valueformula=formulalist , valuedecimal=decimallist)
+            return
 
     def read(self, device, values): 
         self._log.debug("Plugins: Read device "+device['name'])
         # init done?
-        plugins = db.pluginTable.public()
-        for plugin in plugins:
-            if plugin['id'] == device['pluginid'] and plugin["dtype"] == "":
-                self.initdevice(device)
+        plugin = db.pluginTable.lookup('id', device['pluginid'])
+        if plugin and plugin["dtype"] == "":
+            self.initdevice(device)
         # read plugin values  
         self._plugin[device['name']].read(values)
 
     def write(self, device, values): 
         self._log.debug("Plugins: Write device "+device['name'])
         # init done?
-        plugins = db.pluginTable.public()
-        for plugin in plugins:
-            if plugin['id'] == device['pluginid'] and plugin["dtype"] == "":
-                self.initdevice(device)
+        plugin = db.pluginTable.lookup('id', device['pluginid'])
+        if plugin and plugin["dtype"] == "":
+            self.initdevice(device)
         # write plugin values  
         self._plugin[device['name']].write(values)
 
     def triggers(self, device, triggers):
         self._log.debug("Plugins: Triggers device "+device['name'])
-        # process triggers
-        devices=db.deviceTable.public()
-        # Get right device!
-        for devicedb in devices:
-            if devicedb['name'] == device['name']:
-                db.deviceTable.update({"timestamp":devicedb['timestamp']},valuesubscription=triggers)
-                return
+        # process triggers, get right device!
+        devicedb = db.deviceTable.lookup('name', device['name'])
+        # unchanged: no write, no device table version bump
+        if devicedb and devicedb['valuesubscription'] != triggers:
+            db.deviceTable.update({"timestamp":devicedb['timestamp']},valuesubscription=triggers)
+            return
         
     def readstore(self, pname):
         self._log.debug("Plugins: Read device store: "+pname)
-        datastores = db.pluginstoreTable.public()
         data = None
         # read plugin data
-        for datastore in datastores:
-            if datastore['name'] == pname:
-                data = ujson.loads(datastore['data'])
-                break
+        datastore = db.pluginstoreTable.lookup('name', pname)
+        if datastore:
+            data = ujson.loads(datastore['data'])
             
         return data
 
@@ -223,11 +218,10 @@ class plugins(object):
         self._log.debug("Plugins: Write device store: "+pname)
         data = ujson.dumps(pdata)
         # if exists: get timestamp
-        datastores = db.pluginstoreTable.public()
-        for datastore in datastores:
-            if datastore['name'] == pname:
-                db.pluginstoreTable.update({"timestamp":datastore['timestamp']},name=pname,data=data)
-                return
+        datastore = db.pluginstoreTable.lookup('name', pname)
+        if datastore:
+            db.pluginstoreTable.update({"timestamp":datastore['timestamp']},name=pname,data=data)
+            return
 
         # create/update datastore entry
         db.pluginstoreTable.create(name=pname,data=data)
@@ -247,45 +241,95 @@ class plugins(object):
 
         return self._rulequeue
 
+    def tick(self):
+        # monotonic ms clock, survives ticks_ms wrap around
+        ticks = utime.ticks_ms()
+        self._now += utime.ticks_diff(ticks, self._ticks)
+        self._ticks = ticks
+        return self._now
+
+    def schedule(self):
+        # (re)build deadline heap of all enabled devices
+        self._log.debug("Plugins: Build device schedule")
+        self._version = db.deviceTable.version()
+        # scheduled devices keep their deadline across rebuilds
+        old = {}
+        for entry in self._schedule:
+            old[entry[4]['id']] = entry
+        self._schedule = []
+
+        # group new devices, or devices with a changed delay, by period
+        periods = {}
+        seq = 0
+        for device in db.deviceTable.public():
+            if device['enable'] == 'on' and db.pluginTable.lookup('id', device['pluginid']):
+                period = int(device['delay'] * 1000)
+                if period <= 0: period = core.SCHEDULE_POLL_MS
+                entry = old.get(device['id'])
+                if entry and entry[2] == period:
+                    entry[1] = seq
+                    entry[4] = device
+                    uheapq.heappush(self._schedule, entry)
+                    seq += 1
+                elif period in periods: periods[period].append(device)
+                else: periods[period] = [device]
+
+        # phase spreading: new devices with the same period are spread evenly over it
+        for period, devices in periods.items():
+            for cnt, device in enumerate(devices):
+                due = self._now + cnt * period // len(devices)
+                uheapq.heappush(self._schedule, [due, seq, period, due, device])
+                seq += 1
+
     async def asyncdevices(self):
         # Async coroutine to process all plugin work todo 
         self._log.debug("Plugins: Async processing plugins")
 
         # get loop
         loop = asyncio.get_event_loop()
+        self._ticks = utime.ticks_ms()
         
-        # Get all (frozen) plugins
-        plugins = db.pluginTable.public()
-
         while True:
-            # process all devices
-            devices=db.deviceTable.public()
-                    
-            # Get all plugin values!
-            for device in devices:
-                # skip not enabled devices
-                if device['enable'] == 'on': 
-                    pluginname = None
-                    # get plugin data from plugin
-                    for plugin in plugins:
-                        # get devices
-                        if plugin['id'] == device['pluginid']:
-                            # init plugin?
-                            try:
-                               _mod = self._mod[plugin['name']]
-                            except KeyError:
-                                self.initdevice(device)
-                            # process plugin
-                            #self._plugin[plugin['name']].process()
-                            if not self._plugin[device['name']]._lock.is_set():
-                                self._log.debug("Plugins: Scheduling Async processing plugin: "+plugin['name'])
-                                plugin_function = getattr(self._plugin[device['name']], 'asyncprocess')
-                                if plugin_function: 
-                                    if device['delay'] > 0: loop.call_later(device['delay'],plugin_function())
-                                    else: loop.call_soon(plugin_function())
-                                self._plugin[device['name']]._lock.set()
-                        await asyncio.sleep(0)
-            await asyncio.sleep_ms(10)
+            self.tick()
+            # device saved? rebuild schedule
+            if self._version != db.deviceTable.version():
+                self.schedule()
+
+            # process all due devices
+            while self._schedule and self._schedule[0][0] <= self._now:
+                entry = uheapq.heappop(self._schedule)
+                device = entry[4]
+                plugin = db.pluginTable.lookup('id', device['pluginid'])
+                if plugin:
+                    # init plugin?
+                    try:
+                       _mod = self._mod[plugin['name']]
+                    except KeyError:
+                        self.initdevice(device)
+                    # process plugin, if previous run is done
+                    if device['name'] in self._plugin and not self._plugin[device['name']]._lock.is_set():
+                        self._log.debug("Plugins: Scheduling Async processing plugin: "+plugin['name'])
+                        plugin_function = getattr(self._plugin[device['name']], 'asyncprocess')
+                        if plugin_function: loop.call_soon(plugin_function())
+                        self._plugin[device['name']]._lock.set()
+
+                # next deadline on a fixed grid, skip missed periods
+                period = entry[2]
+                entry[3] += period
+                if entry[3] <= self._now: entry[3] = self._now + period
+                entry[0] = entry[3]
+                # jitter, keeps devices from locking into the same tick
+                if period >= core.SCHEDULE_JITTER: entry[0] += urandom.getrandbits(16) % (period // core.SCHEDULE_JITTER)
+                uheapq.heappush(self._schedule, entry)
+
+                # Give async a change to schedule something else
+                await asyncio.sleep(0)
+                self.tick()
+
+            # sleep until next deadline
+            delay = core.SCHEDULE_MAX_MS
+            if self._schedule: delay = min(max(self._schedule[0][0] - self._now, 0), delay)
+            await asyncio.sleep_ms(delay)
 
     async def asyncvalues(self):
         # Async coroutine to process all script work todo 
@@ -295,33 +339,24 @@ class plugins(object):
         loop = asyncio.get_event_loop()
 
         while True:
-            # get scriptqueue message
-            devicedata = {}
+            # wait for valuequeue messages, woken up by put, no polling
             try:
-                while await(self._valuequeue.get()) != core.QUEUE_MESSAGE_START:
-                    # Give async a change to schedule something else
-                    await asyncio.sleep_ms(100)
-                devicedata['name'] = self._valuequeue.get_nowait()
-                devicedata['valuename'] = self._valuequeue.get_nowait()
-                devicedata['value'] = self._valuequeue.get_nowait()
+                messages = [await self._valuequeue.get()]
+                # drain all queued messages in the same wakeup
+                while not self._valuequeue.empty():
+                    messages.append(self._valuequeue.get_nowait())
             except Exception as e:
                 self._log.error("Plugins: valuequeue proces Exception: "+repr(e))
+                continue
 
-            # Assemble triggername
-            devicedata['triggername'] = devicedata['name']+'#'+devicedata['valuename']
-
-            # process all devices
-            devices=db.deviceTable.public()
-                    
-            # Get all device values!
-            for device in devices:
-                # skip not enabled devices
-                if device['enable'] == 'on' and devicedata['triggername'] in device['valuesubscription']: 
+            for devicedata in messages:
+                # Get all subscribed, enabled devices!
+                for device in core._routes.devices(devicedata['triggername']):
                     plugin_function = getattr(self._plugin[device['name']], 'write')
                     if plugin_function: 
                         # Write data to plugin
                         self._plugin[device['name']].write(devicedata)
-                await asyncio.sleep(0)
+                    await asyncio.sleep(0)
                     
             # Give async a change to schedule something else
-            await asyncio.sleep_ms(100)
+            await asyncio.sleep(0)
@@ -10,6 +10,7 @@
 # See LICENSE file in the project root for full license information.  
 #
 
+import uasyncio as asyncio
 from upyeasy import core
 from asyn import Event
 
@@ -100,6 +101,7 @@ class bme280_plugin:
         # plugin specific section
         self.bme_elev           = bme_elev
         self.i2c_addr            = i2c_addr
+        self.bus                = core._hal.get_i2cbus(i2c)
         self.i2c                = core._hal.get_i2c(i2c)
         if self.i2c != None: 
             try:
@@ -133,6 +135,7 @@ class bme280_plugin:
         sf_bme_elev                 = plugindata.get('bme_elev',None)
         if sf_bme_elev: self.bme_elev = int(sf_bme_elev)
         else: self.bme_elev = None
+        self.bus                    = core._hal.get_i2cbus(i2c)
         self.i2c                    = core._hal.get_i2c(i2c)
         if self.i2c:
             try:
@@ -180,9 +183,12 @@ class bme280_plugin:
     async def asyncprocess(self):
         # plugin specific section
         self._log.debug("Plugin: bme280 process")
-        if self.i2c: 
+        if self.bus: 
             try:
-                t, p, h = self.bme280_read_compensated_data()
+                # measure on the shared bus without blocking the loop
+                await self.bme280_read_raw_async(self._l3_resultarray)
+                # compensate in place, no new array per reading
+                t, p, h = self.bme280_compensate(self._l3_resultarray)
             except Exception as e:
                 self._log.debug("Plugin: bme280 process exception: "+repr(e))
                 # release lock, ready for next measurement
@@ -237,9 +243,20 @@ class bme280_plugin:
 
         # temporary data holders which stay allocated
         self._l1_barray = bytearray(1)
+        self._l1b_barray = bytearray(1)
         self._l8_barray = bytearray(8)
         self._l3_resultarray = array("i", [0, 0, 0])
 
+        # forced measurement: both control writes as one bus transaction
+        self._l1_barray[0] = self._mode
+        self._l1b_barray[0] = self._mode << 5 | self._mode << 2 | 1
+        self._trigger = [(self.address, BME280_REGISTER_CONTROL_HUM, self._l1_barray, True),
+                         (self.address, BME280_REGISTER_CONTROL, self._l1b_barray, True)]
+        sleep_time = 1250 + 2300 * (1 << self._mode)
+        sleep_time = sleep_time + 2300 * (1 << self._mode) + 575
+        sleep_time = sleep_time + 2300 * (1 << self._mode) + 575
+        self._sleep_us = sleep_time
+
     def bme280_read_raw_data(self, result):
         """ Reads the raw (uncompensated) data from the sensor.
 
@@ -250,20 +267,25 @@ class bme280_plugin:
                 None
         """
 
-        self._l1_barray[0] = self._mode
-        self.i2c.writeto_mem(self.address, BME280_REGISTER_CONTROL_HUM,
-                             self._l1_barray)
-        self._l1_barray[0] = self._mode << 5 | self._mode << 2 | 1
-        self.i2c.writeto_mem(self.address, BME280_REGISTER_CONTROL,
-                             self._l1_barray)
-
-        sleep_time = 1250 + 2300 * (1 << self._mode)
-        sleep_time = sleep_time + 2300 * (1 << self._mode) + 575
-        sleep_time = sleep_time + 2300 * (1 << self._mode) + 575
-        time.sleep_us(sleep_time)  # Wait the required time
+        for addr, reg, buf, write in self._trigger:
+            self.i2c.writeto_mem(addr, reg, buf)
+        time.sleep_us(self._sleep_us)  # Wait the required time
 
         # burst readout from 0xF7 to 0xFE, recommended by datasheet
         self.i2c.readfrom_mem_into(self.address, 0xF7, self._l8_barray)
+        self.bme280_decode(result)
+
+    async def bme280_read_raw_async(self, result):
+        """ Same as bme280_read_raw_data, through the shared i2c bus and
+            waiting for the measurement without blocking the event loop.
+        """
+
+        await self.bus.batch(self._trigger)
+        await asyncio.sleep_ms((self._sleep_us + 999) // 1000)
+        await self.bus.readfrom_mem_into(self.address, 0xF7, self._l8_barray)
+        self.bme280_decode(result)
+
+    def bme280_decode(self, result):
         readout = self._l8_barray
         # pressure(0xF7): ((msb << 16) | (lsb << 8) | xlsb) >> 4
         raw_press = ((readout[0] << 16) | (readout[1] << 8) | readout[2]) >> 4
@@ -289,6 +311,10 @@ class bme280_plugin:
                 the result parameter if not None
         """
         self.bme280_read_raw_data(self._l3_resultarray)
+        return self.bme280_compensate(result)
+
+    def bme280_compensate(self, result=None):
+        """ Compensates the raw data in the internal result array. """
         raw_temp, raw_press, raw_hum = self._l3_resultarray
         # temperature
         var1 = ((raw_temp >> 3) - (self.dig_T1 << 1)) * (self.dig_T2 >> 11)
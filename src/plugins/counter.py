@@ -0,0 +1,225 @@
+#          
+# Filename: counter.py
+# Version : 0.1
+# Author  : Lisa Esselink
+# Purpose : Plugin Pulse Counter
+# Usage   : Count pulses of energy meters, rain gauges and flow sensors
+#
+# Copyright (c) 2018 - Lisa Esselink. All rights reserved.  
+# Licensend under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# See LICENSE file in the project root for full license information.  
+#
+
+import utime
+from upyeasy import core
+from asyn import Event
+
+#
+# CUSTOM SENSOR GLOBALS
+#
+
+name                = "Counter"
+dtype               = core.DEVICE_TYPE_SINGLE
+stype               = core.SENSOR_TYPE_TRIPLE
+template            = "counter.html"
+pullup              = "off"
+inverse             = "off"
+port                = "off"
+formula             = "off"
+senddata            = "off"
+timer               = "off"
+sync                = "off"
+delay               = 60
+pincnt              = 1
+valuecnt            = 3
+dxpin               = "d0"
+edge                = "falling"                 # count rising or falling edges
+window              = 60                        # rate window in seconds
+store               = 300                       # min seconds between total writes to flash
+samples             = 16                        # max samples kept for the rate window
+content             = '<a class="button link" href="" target="_blank">?</a>'
+
+#
+#
+#
+
+class counter_plugin:
+    datastore           = None
+    
+    def __init__(self) :
+        # generic section
+        self._log       = core._log
+        self._log.debug("Plugin: counter contruction")
+        self._utils     = core._utils
+        self._plugins   = core._plugins
+        self._hal       = core._hal
+        self._lock      = Event()
+        # plugin specific section
+        self.dxpin      = dxpin
+        self.edge       = edge
+        self.window     = window
+        self.store      = store
+        self.channel    = None
+        self.total      = 0
+        self.stored     = 0
+        self.storetime  = 0
+        self.samples    = []
+        self.valuenames = {}
+        self.valuenames["valueV1"]= 0
+        self.valuenames["valueV2"]= 0
+        self.valuenames["valueV3"]= 0
+        self.valuenames["valueN1"]= "Total"
+        self.valuenames["valueN2"]= "Delta"
+        self.valuenames["valueN3"]= "Rate"
+        self.valuenames["valueF1"]= ""
+        self.valuenames["valueF2"]= ""
+        self.valuenames["valueF3"]= ""
+        self.valuenames["valueD1"]= 0
+        self.valuenames["valueD2"]= 0
+        self.valuenames["valueD3"]= 2
+        # release lock, ready for next measurement
+        self._lock.clear()
+        
+    def init(self, plugin, device, queue, scriptqueue, rulequeue, valuequeue):        
+        self._log.debug("Plugin: counter init")
+        # generic section
+        self._utils.plugin_initdata(self, plugin, device, queue, scriptqueue, rulequeue, valuequeue)
+        self.content            = plugin.get('content',content)
+        self.pincnt             = pincnt
+        self.valuecnt           = valuecnt
+        self.stype              = stype
+        self.dxpin              = device.get('dxpin',dxpin)
+        self.valuenames['devicename'] = device['name']
+        plugin['dtype']         = dtype
+        plugin['stype']         = stype
+        plugin['template']      = template
+        datastore               = self._plugins.readstore(device["name"])
+        # plugin specific section
+        if datastore:
+            self.edge           = datastore.get('edge', edge)
+            self.window         = datastore.get('window', window)
+            self.store          = datastore.get('store', store)
+            self.total          = datastore.get('total', 0)
+        self.stored             = self.total
+        self.storetime          = utime.ticks_ms()
+        self.setup()
+        return True
+
+    def setup(self):
+        # count edges in the hal irq handler, no callback per pulse
+        self.accumulate()
+        self._hal.input_release(self.channel)
+        self._log.debug("Plugin: counter setup, pin: "+self.dxpin+", edge: "+self.edge)
+        self.channel            = self._hal.input(self.dxpin, None, core.PIN_PULL_UP, 0, self.edge)
+        self.samples            = [(utime.ticks_ms(), self.total)]
+        return self.channel is not None
+
+    def loadform(self,plugindata):
+        self._log.debug("Plugin: counter loadform")
+        # generic section
+        self._utils.plugin_loadform(self, plugindata)
+        # plugin specific section
+        plugindata['dxpin0']    = self.dxpin
+        plugindata['edge']      = self.edge
+        plugindata['window']    = self.window
+        plugindata['store']     = self.store
+        plugindata['total']     = self.total
+        
+    def saveform(self,plugindata):
+        self._log.debug("Plugin: counter saveform")
+        # generic section
+        self._utils.plugin_saveform(self, plugindata)
+        # plugin specific section
+        self.dxpin              = plugindata.get('dxpin0', self.dxpin)
+        self.edge               = plugindata.get('edge', edge)
+        try:
+            self.window         = max(int(plugindata.get('window', window)), 1)
+            self.store          = max(int(plugindata.get('store', store)), 0)
+        except ValueError:
+            self._log.error("Plugin: counter saveform, invalid window or store time")
+        if plugindata.get('reset') == 'on':
+            self.accumulate()
+            self.total          = 0
+        self.setup()
+        self.save()
+
+    def save(self):
+        # store settings and total
+        data = {}
+        data["dxpin"]       = self.dxpin
+        data["edge"]        = self.edge
+        data["window"]      = self.window
+        data["store"]       = self.store
+        data["total"]       = self.total
+        data["valueN1"]     = self.valuenames["valueN1"]
+        data["valueF1"]     = self.valuenames["valueF1"] 
+        data["valueD1"]     = self.valuenames["valueD1"]
+        self._plugins.writestore(self.devicename, data)
+        self.stored         = self.total
+        self.storetime      = utime.ticks_ms()
+
+    def accumulate(self):
+        # move irq counts into the total, returns new pulses
+        if self.channel is None: return 0
+        delta = self._hal.input_count(self.channel, True)
+        self.total += delta
+        return delta
+
+    def rate(self, now):
+        # pulses per second over the rate window
+        self.samples.append((now, self.total))
+        while len(self.samples) > 2 and utime.ticks_diff(now, self.samples[1][0]) >= self.window * 1000:
+            self.samples.pop(0)
+        if len(self.samples) > samples: self.samples.pop(0)
+        start, count = self.samples[0]
+        elapsed = utime.ticks_diff(now, start)
+        if elapsed <= 0: return 0
+        return (self.total - count) * 1000 / elapsed
+
+    def read(self, values):
+        self._log.debug("Plugin: counter read")
+        # generic section
+        values['valueN1'] = self.valuenames["valueN1"]
+        values['valueN2'] = self.valuenames["valueN2"]
+        values['valueN3'] = self.valuenames["valueN3"]
+        # plugin specific section, pending pulses are shown but not reported
+        pending = 0
+        if self.channel is not None: pending = self._hal.input_count(self.channel)
+        values['valueV1'] = self.total + pending
+        values['valueV2'] = self.valuenames["valueV2"]
+        values['valueV3'] = self.valuenames["valueV3"]
+   
+    def write(self, values):
+        self._log.debug("Plugin: counter write")
+
+    async def asyncprocess(self):
+        self._log.debug("Plugin: counter process")
+        # plugin specific section, only the aggregate is published
+        now = utime.ticks_ms()
+        delta = self.accumulate()
+        self.valuenames["valueV1"] = self.total
+        self.valuenames["valueV2"] = delta
+        self.valuenames["valueV3"] = round(self.rate(now), int(self.valuenames['valueD3']))
+        self._utils.plugin_senddata(self)
+        # throttled persist of the total
+        if self.total != self.stored and utime.ticks_diff(now, self.storetime) >= self.store * 1000:
+            try:
+                self.save()
+            except OSError as e:
+                self._log.error("Plugin: counter store failed: "+repr(e))
+        # release lock, ready for next measurement
+        self._lock.clear()
+
+#
+#Module Code...    
+#
+
+counter = counter_plugin()
+
+def loadform(plugindata):
+    counter.loadform(plugindata)
+        
+#
+#CUSTOM SENSOR CODE...    
+#
+    
@@ -40,16 +40,21 @@ pincnt              = 1
 valuecnt            = 1
 dxpin               = "d0"
 resolution          = 9
+convtime            = 750                       # conversion time at 12 bit, halves per bit less
 content             = '<a class="button link" href="" target="_blank">?</a>'
 
 #
 #
 #
 
+def romstr(rom):
+    return ''.join('{:02x}-'.format(x) for x in rom)[:-1]
+
 class ds18_plugin:
     valuenames          = {}
     datastore           = None
     roms                = None
+    temps               = {}
     
     def __init__(self) :
         # generic section
@@ -83,29 +88,69 @@ class ds18_plugin:
         plugin['template']      = template
         datastore               = self._plugins.readstore(device["name"])
         # plugin specific section
+        self.resolution         = resolution
+        self.romid              = ''
+        self.temps              = {}
+        if datastore:
+            self.resolution     = int(datastore.get('resolution', resolution))
+            self.romid          = datastore.get('romid', '')
         self._log.debug("Plugin: ds18 init, pin used: "+str(self.dxpin))
         # the device is on Dx
         self.mPin                   = self._hal.pin(self.dxpin)
         if self.mPin:
             # create the onewire object
             self.ds18                   = ds18x20.DS18X20(onewire.OneWire(self.mPin))
-            # scan for devices on the bus
-            roms                        = self.ds18.scan()
-            # scan for devices on the bus
-            self.roms                   = self.ds18.scan()
+            # cached roms, only scan the bus if there are none
+            if datastore and datastore.get('roms'):
+                self.roms               = [bytes(int(x, 16) for x in rom.split('-')) for rom in datastore['roms']]
+            else:
+                self.scan()
+                self.save()
+            self.setup()
 
         return True
 
+    def scan(self):
+        # scan for devices on the bus
+        self.roms                   = self.ds18.scan()
+        self._log.debug("Plugin: ds18 scan, {} roms".format(len(self.roms)))
+
+    def setup(self):
+        # set resolution of all DS18B20s, DS18S20s are fixed at 750 ms
+        self.convtime = convtime // (1 << (12 - self.resolution)) + 1
+        for rom in self.roms:
+            if rom[0] != 0x28:
+                self.convtime = convtime
+                continue
+            try:
+                buf = self.ds18.read_scratch(rom)
+                # keep alarm registers TH/TL
+                self.ds18.write_scratch(rom, bytes([buf[2], buf[3], (self.resolution - 9) << 5 | 0x1f]))
+            except Exception as e:
+                self._log.debug("Plugin: ds18 set resolution failed! Error: "+repr(e))
+
+    def save(self):
+        # store settings and scanned roms
+        data = {}
+        data["romid"]       = self.romid
+        data["dxpin"]       = self.dxpin
+        data["resolution"]  = self.resolution
+        data["roms"]        = [romstr(rom) for rom in self.roms or []]
+        data["valueN1"]     = self.valuenames["valueN1"]
+        data["valueF1"]     = self.valuenames["valueF1"] 
+        data["valueD1"]     = self.valuenames["valueD1"]
+        self._plugins.writestore(self.devicename, data)
+
     def loadform(self,plugindata):
         self._log.debug("Plugin: ds18 loadform")
         # generic section
         self._utils.plugin_loadform(self, plugindata)
         # plugin specific section
-        plugindata['resolution']= resolution
+        plugindata['resolution']= self.resolution
         romcnt = 0
         if not self.roms == None:
             for rom in self.roms:
-                plugindata['rom'+str(romcnt)] = ''.join('{:02x}-'.format(x) for x in rom)[:-1]
+                plugindata['rom'+str(romcnt)] = romstr(rom)
                 self._log.debug("Plugin: ds18 loadform, rom: "+plugindata['rom'+str(romcnt)])
                 romcnt+=1
         else:
@@ -119,42 +164,28 @@ class ds18_plugin:
 
         # plugin specific section
         self.romid                  = plugindata.get('deviceid','')
-        self.resolution             = plugindata['resolution']
-
-        # store values
-        data = {}
-        data["romid"]       = self.romid
-        data["dxpin"]       = self.dxpin
-        data["resolution"]  = self.resolution
-        data["valueN1"]     = self.valuenames["valueN1"]
-        data["valueF1"]     = self.valuenames["valueF1"] 
-        data["valueD1"]     = self.valuenames["valueD1"]
-        self._plugins.writestore(self.devicename, data)
+        self.resolution             = int(plugindata['resolution'])
 
         # the device is on Dx
         self.mPin                   = self._hal.pin(self.dxpin)
         self._log.debug("Plugin: ds18 saveform, pin used: "+str(self.dxpin))
         # create the onewire object
         self.ds18                   = ds18x20.DS18X20(onewire.OneWire(self.mPin))
-        # scan for devices on the bus
-        roms                        = self.ds18.scan()
-        # scan for devices on the bus
-        self.roms                   = self.ds18.scan()
+        # rescan once, probes may have been added
+        self.scan()
+        self.setup()
+        self.temps                  = {}
+
+        # store values and roms
+        self.save()
         
     def read(self, values):
         self._log.debug("Plugin: ds18 read")
-        # plugin specific section
-        if not self.roms == None:
-            for rom in self.roms:
-                # Set convert on
-                self.ds18.convert_temp()
-                # wait 750ms for value to return
-                #await asyncio.sleep_ms(750)
-                import utime
-                utime.sleep_ms(750)
-                # Read temp
-                values['valueN1'] = ''.join('{:02x}-'.format(x) for x in rom)[:-1]
-                values["valueV1"] = round(self.ds18.read_temp(rom), int(self.valuenames['valueD1']) )
+        # plugin specific section, last values of asyncprocess, never waits on the bus
+        if self.temps:
+            for rom, temp in self.temps.items():
+                values['valueN1'] = rom
+                values["valueV1"] = temp
         else:
             self._log.debug("Plugin: ds18 read, empty values")
             # dummy values
@@ -167,22 +198,28 @@ class ds18_plugin:
     async def asyncprocess(self):
         self._log.debug("Plugin: ds18 process")
         # plugin specific section
-        if not self.roms == None:
-            for rom in self.roms:
-                # Set convert on
+        if self.roms:
+            try:
+                # one convert for all roms on the bus
                 self.ds18.convert_temp()
-                # wait 750ms for value to return
-                await asyncio.sleep_ms(750)
-                # put temperature value(s) in queue
-                try:
-                    ds18temp = self.ds18.read_temp(rom)
-                    self._log.debug("Plugin: ds18 data read: "+str(ds18temp))
-                    # send data to protocol and script/rule queues
-                    #self.valuenames["valueV1"] = ds18temp        
-                    self.valuenames['valueV1'] = round(ds18temp, int(self.valuenames['valueD1']) )
-                    self._utils.plugin_senddata(self)
-                except Exception as e:
-                    self._log.debug("Plugin: ds18 readtemp failed! Error: "+repr(e))
+            except Exception as e:
+                self._log.debug("Plugin: ds18 convert failed! Error: "+repr(e))
+            else:
+                # wait once, scaled to the resolution
+                await asyncio.sleep_ms(self.convtime)
+                for rom in self.roms:
+                    # put temperature value(s) in queue
+                    try:
+                        ds18temp = self.ds18.read_temp(rom)
+                        self._log.debug("Plugin: ds18 data read: "+str(ds18temp))
+                        # send data to protocol and script/rule queues
+                        # one value per rom, named after the rom
+                        self.valuenames['valueN1'] = romstr(rom)
+                        self.valuenames['valueV1'] = round(ds18temp, int(self.valuenames['valueD1']) )
+                        self.temps[romstr(rom)] = self.valuenames['valueV1']
+                        self._utils.plugin_senddata(self)
+                    except Exception as e:
+                        self._log.debug("Plugin: ds18 readtemp failed! Error: "+repr(e))
         # release lock, ready for next measurement
         self._lock.clear()
 
@@ -17,8 +17,7 @@ from asyn import Event
 # CUSTOM SENSOR GLOBALS
 #
 
-from machine import Pin
-from aswitch import Switch, Pushbutton
+import utime
 
 name                = "Switch"            # Name of the plugin
 dtype               = core.DEVICE_TYPE_SINGLE   # Device type
@@ -36,6 +35,8 @@ delay               = 0                         # Delay is ms between measuremen
 pincnt              = 1                         # Number of dxpins needed 
 valuecnt            = 1                         # Number of values needed
 dxpin               = "d0"                      # dxpin number where to measure
+double_ms           = 400                       # max time between presses of a double click
+long_ms             = 1000                      # min press time of a long press
 content             = '<a class="button link" href="" target="_blank">?</a>'    # Additional HTML for device screen
 
 #
@@ -55,6 +56,8 @@ class switch_plugin:
         self._hal           = core._hal
         self._lock          = Event()
         self.dxpin          = dxpin
+        self.channel        = None
+        self.pressed        = 0
         # plugin specific section
         self.valuenames     = {}
         self.valuenames["valueN1"]= "switch"
@@ -78,33 +81,22 @@ class switch_plugin:
         self.valuenames['devicename'] = device['name'] # gets device/plugin name, added AJ
         # plugin specific section
         self.switch_status      = bootstate
+        self._log.debug("Plugin: switch init "+self.inputtype+", pin: "+self.dxpin)
+        self.setup()
+        return True
+
+    def setup(self):
+        # (re)register pin with the hal irq input pipeline
+        self._hal.input_release(self.channel)
         if self.inputtype == 'normal':
-            self._log.debug("Plugin: switch init normal, pin: "+self.dxpin)
             # Setup switch
-            self.swpin                  = self._hal.pin(self.dxpin, core.PIN_IN, core.PIN_PULL_UP)
-            self.switch                 = Switch(self.swpin)
-            # Register coros to launch on contact close and open
-            self.switch.close_func(self.asyncswitchopen)
-            self.switch.open_func(self.asyncswitchclosed)
+            self.channel                = self._hal.input(self.dxpin, self.switchchange, core.PIN_PULL_UP)
         elif self.inputtype == 'low':
-            self._log.debug("Plugin: switch init low, pin: "+self.dxpin)
             # Setup button active low
-            self.swpin                  = self._hal.pin(self.dxpin, core.PIN_IN, core.PIN_PULL_UP)
-            self.switch                 = Pushbutton(self.swpin)
-            self.switch.press_func(self.asyncbuttonpress)
-            self.switch.release_func(self.asyncbuttonrelease)
-            self.switch.double_func(self.asyncbuttondouble)
-            self.switch.long_func(self.asyncbuttonlong)
+            self.channel                = self._hal.input(self.dxpin, self.buttonchange, core.PIN_PULL_UP)
         else:
-            self._log.debug("Plugin: switch init high, pin: "+self.dxpin)
             # Setup button active high
-            self.swpin                  = self._hal.pin(self.dxpin, core.PIN_IN, core.PIN_PULL_DOWN)
-            self.switch                 = Pushbutton(self.swpin)
-            self.switch.press_func(self.asyncbuttonpress)
-            self.switch.release_func(self.asyncbuttonrelease)
-            self.switch.double_func(self.asyncbuttondouble)
-            self.switch.long_func(self.asyncbuttonlong)
-        return True
+            self.channel                = self._hal.input(self.dxpin, self.buttonchange, core.PIN_PULL_DOWN)
 
     def loadform(self,plugindata):
         self._log.debug("Plugin: switch loadform")
@@ -131,28 +123,7 @@ class switch_plugin:
         data["valueD1"]     = self.valuenames["valueD1"]
         self._plugins.writestore(self.devicename, data)
         
-        if self.inputtype == 'normal':
-            # Setup switch
-            self.swpin                  = self._hal.pin(self.dxpin, core.PIN_IN, core.PIN_PULL_UP)
-            self.switch                 = Switch(self.swpin)
-            # Register coros to launch on contact close and open
-            self.switch.close_func(self.asyncswitchopen)
-            self.switch.open_func(self.asyncswitchclosed)
-        elif self.inputtype == 'low':
-            # Setup button active low
-            self.swpin                  = self._hal.pin(self.dxpin, core.PIN_IN, core.PIN_PULL_UP)
-            self.switch                 = Pushbutton(self.swpin)
-            self.switch.press_func(self.asyncbuttonpress)
-            self.switch.release_func(self.asyncbuttonrelease)
-            self.switch.double_func(self.asyncbuttondouble)
-            self.switch.long_func(self.asyncbuttonlong)
-        else:
-            # Setup button active high
-            self.swpin                  = self._hal.pin(self.dxpin, core.PIN_IN, core.PIN_PULL_DOWN)
-            self.switch.press_func(self.asyncbuttonpress)
-            self.switch.release_func(self.asyncbuttonrelease)
-            self.switch.double_func(self.asyncbuttondouble)
-            self.switch.long_func(self.asyncbuttonlong)
+        self.setup()
         
     def read(self, values):
         self._log.debug("Plugin: switch read")
@@ -178,35 +149,25 @@ class switch_plugin:
     #CUSTOM SENSOR CODE...    
     #
     
-    async def asyncswitchopen(self):
-        self.switch_status = 'open'
-        # release lock, ready for next measurement
-        self._lock.clear()
-
-    async def asyncswitchclosed(self):
-        self.switch_status = 'closed'
+    def switchchange(self, value):
+        # debounced level change, same labels as the former aswitch version
+        if value: self.switch_status = 'closed'
+        else: self.switch_status = 'open'
         # release lock, ready for next measurement
         self._lock.clear()
 
-    async def asyncbuttonpress(self):
-        self.switch_status = 'press'
-        # release lock, ready for next measurement
-        self._lock.clear()
-        
-    async def asyncbuttonrelease(self):
-        self.switch_status = 'release'
-        # release lock, ready for next measurement
-        self._lock.clear()
-        
-    async def asyncbuttondouble(self):
-        self.switch_status = 'double'
+    def buttonchange(self, value):
+        # debounced level change, derive press/release/double/long
+        now = utime.ticks_ms()
+        if value == (self.inputtype != 'low'):
+            if self.pressed and utime.ticks_diff(now, self.pressed) < double_ms: self.switch_status = 'double'
+            else: self.switch_status = 'press'
+            self.pressed = now
+        else:
+            if utime.ticks_diff(now, self.pressed) >= long_ms: self.switch_status = 'long'
+            else: self.switch_status = 'release'
         # release lock, ready for next measurement
         self._lock.clear()
-        
-    async def asyncbuttonlong(self):
-        self.switch_status = 'long'
-         # release lock, ready for next measurement
-        self._lock.clear()      
 
 #
 #Module Code...    
@@ -73,26 +73,25 @@ class protocol(object):
         self._log.debug("Protocols: Init controller "+controller["hostname"]+"-"+controller["protocol"]+"-"+str(controller["id"]))
 
         _initcomplete = False
-        protocols = db.protocolTable.public()
-        for protocol in protocols:
-            if protocol['name'] == controller['protocol']:
-                controllername = controller["hostname"]+"-"+str(controller["id"])
-                modname = protocol['module']
+        protocol = db.protocolTable.lookup('name', controller['protocol'])
+        if protocol:
+            controllername = controller["hostname"]+"-"+str(controller["id"])
+            modname = protocol['module']
                 
-                # load frozen protocol module
-                self._log.debug("Protocols: Load protocol "+modname)
-                self._mod[modname] = __import__("upyeasy.protocols."+modname, None, None, 'protocol')
-                self._mod[protocol['name']] = self._mod[modname]
-                self._protocol_class[protocol['name']] = getattr(self._mod[modname],modname+'_protocol')
+            # load frozen protocol module
+            self._log.debug("Protocols: Load protocol "+modname)
+            self._mod[modname] = __import__("upyeasy.protocols."+modname, None, None, 'protocol')
+            self._mod[protocol['name']] = self._mod[modname]
+            self._protocol_class[protocol['name']] = getattr(self._mod[modname],modname+'_protocol')
 
-                # instantiate plugin
-                self._protocol[controllername] = self._protocol_class[controller["protocol"]]()
+            # instantiate plugin
+            self._protocol[controllername] = self._protocol_class[controller["protocol"]]()
                     
-                # init protocol
-                controller['client_id'] = core.__logname__+self._utils.get_upyeasy_name()
-                self._queue[controllername] = self._protocol[controllername].init(controller)
+            # init protocol
+            controller['client_id'] = core.__logname__+self._utils.get_upyeasy_name()
+            self._queue[controllername] = self._protocol[controllername].init(controller)
                 
-                _initcomplete = True
+            _initcomplete = True
                 
         if not _initcomplete: 
             self._log.error("Protocols: Init controller {} failed!".format(controller['protocol']))
@@ -106,8 +105,7 @@ class protocol(object):
     async def asynccontrollers(self):
         # Async coroutine to process all protocol work todo 
         self._log.debug("Protocols: Async processing protocols")
-        # Get list of protocols
-        protocols = db.protocolTable.public()
+        loop = asyncio.get_event_loop()
         # Run forever
         while True:
             # Get correct controller
@@ -116,20 +114,24 @@ class protocol(object):
                 # only run active controllers!
                 if controller['enable'] == 'on':
                     controllername = controller["hostname"]+"-"+str(controller["id"])
-                    for protocol in protocols:
-                        if protocol['name'] == controller['protocol']:
-                            # init controller?
-                            try:
-                               _mod = self._mod[protocol['name']]
-                            except KeyError:
-                                self.initcontroller(controller)
-                            # process protocol
-                            try:
-                                if (not self._queue[controllername].empty()) and (not self._protocol[controllername]._lock.is_set()):
-                                    self._protocol[controllername]._lock.set()
+                    protocol = db.protocolTable.lookup('name', controller['protocol'])
+                    if protocol:
+                        # init controller?
+                        try:
+                           _mod = self._mod[protocol['name']]
+                        except KeyError:
+                            self.initcontroller(controller)
+                        # process protocol
+                        try:
+                            if (not self._queue[controllername].empty()) and (not self._protocol[controllername]._lock.is_set()):
+                                self._protocol[controllername]._lock.set()
+                                # async protocols run as their own task
+                                protocol_function = getattr(self._protocol[controllername],'asyncprocess', None)
+                                if protocol_function: loop.call_soon(protocol_function())
+                                else:
                                     protocol_function = getattr(self._protocol[controllername],'process')
                                     if protocol_function: protocol_function()
-                            except KeyError:
-                                self._log.error("Protocols: Async processing protocols KeyError exception, controller: "+controllername)
+                        except KeyError:
+                            self._log.error("Protocols: Async processing protocols KeyError exception, controller: "+controllername)
                 await asyncio.sleep(0)
             await asyncio.sleep(1)
@@ -10,7 +10,7 @@
 # See LICENSE file in the project root for full license information.  
 #
 
-import ujson, urequests, uasyncio.queues as queues
+import ujson, ubinascii, utime, uasyncio as asyncio, uasyncio.queues as queues
 from upyeasy import protocol as uprotocol, core
 from asyn import Event
 
@@ -26,11 +26,153 @@ template = "domoticz_http.html"
 #
 #
 
+class httppool:
+    # HTTP/1.1 keep-alive connections to one server, requests are pipelined
+
+    def __init__(self, host, port, size=1, timeout=10, auth=None):
+        self._host      = host
+        self._port      = port
+        self._size      = size
+        self._timeout   = timeout
+        self._free      = []
+        self._count     = 0
+        # last pipeline: answered requests and whether it ran on an idle connection
+        self.done       = 0
+        self.reused     = False
+        # one deadline per pipeline, at most one timer pending per pool
+        self._task      = None
+        self._deadline  = 0
+        self._armed     = False
+        self._head      = "Host: "+host+":"+str(port)+"\r\n"
+        if auth: self._head += "Authorization: Basic "+ubinascii.b2a_base64(auth.encode()).decode().strip()+"\r\n"
+        self._head     += "Connection: keep-alive\r\n\r\n"
+
+    async def acquire(self):
+        # idle connection first, else open a new one when below pool size
+        while True:
+            if self._free:
+                self.reused = True
+                return self._free.pop()
+            if self._count < self._size: break
+            await asyncio.sleep_ms(20)
+        self.reused = False
+        self._count += 1
+        try:
+            return await asyncio.open_connection(self._host, self._port)
+        except:
+            self._count -= 1
+            raise
+
+    async def release(self, conn, keep):
+        reader, writer = conn
+        if keep:
+            # idle sockets are not polled, a server close is seen on next use
+            try:
+                asyncio.get_event_loop().remove_writer(writer.s)
+            except (KeyError, OSError):
+                pass
+            self._free.append(conn)
+        else:
+            self._count -= 1
+            try:
+                await writer.aclose()
+            except OSError:
+                pass
+
+    async def close(self):
+        while self._free:
+            await self.release(self._free.pop(), False)
+
+    def _arm(self):
+        # uasyncio timers can't be cancelled: keep one pending, re-armed
+        # by _expire() while a pipeline runs, instead of one per response
+        loop = asyncio.get_event_loop()
+        self._task = loop.cur_task
+        self._deadline = utime.ticks_add(utime.ticks_ms(), self._timeout * 1000)
+        if not self._armed:
+            self._armed = True
+            loop.call_later_ms(self._timeout * 1000, self._expire)
+
+    def _expire(self):
+        loop = asyncio.get_event_loop()
+        if self._task is None:
+            self._armed = False
+            return
+        left = utime.ticks_diff(self._deadline, utime.ticks_ms())
+        if left > 0:
+            loop.call_later_ms(left, self._expire)
+            return
+        task, self._task = self._task, None
+        self._armed = False
+        # same as wait_for(): reschedule a task parked on I/O
+        if task.pend_throw(asyncio.TimeoutError()) is False:
+            loop.call_soon(task)
+
+    async def response(self, reader):
+        # read one response, returns (status, keep-alive)
+        line = await reader.readline()
+        if not line: raise OSError("connection closed")
+        status = int(line.split(None, 2)[1])
+        keep = line.startswith(b"HTTP/1.1")
+        size = None
+        chunked = False
+        while True:
+            line = await reader.readline()
+            if not line or line == b"\r\n": break
+            key, _, value = line.partition(b":")
+            key = key.strip().lower()
+            value = value.strip().lower()
+            if key == b"content-length": size = int(value)
+            elif key == b"transfer-encoding": chunked = value == b"chunked"
+            elif key == b"connection": keep = value == b"keep-alive"
+        if chunked:
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                await reader.readexactly(size+2)
+                if size == 0: break
+        elif size is not None:
+            if size: await reader.readexactly(size)
+        else:
+            # body ends at close
+            while await reader.read(256): pass
+            keep = False
+        return status, keep
+
+    async def pipeline(self, paths):
+        # write all requests at once, then read responses in order
+        # returns the number of answered requests, also kept in self.done
+        # when an exception is raised halfway
+        # one timeout for the whole batch, connecting included
+        self.done = 0
+        self._arm()
+        try:
+            conn = await self.acquire()
+            reader, writer = conn
+            done = 0
+            keep = False
+            try:
+                await writer.awrite("".join(["GET "+path+" HTTP/1.1\r\n"+self._head for path in paths]))
+                while done < len(paths):
+                    keep = False
+                    status, keep = await self.response(reader)
+                    if status != 200: core._log.debug("Protocol "+name+": "+paths[done]+" status "+str(status))
+                    done += 1
+                    self.done = done
+                    if not keep: break
+            finally:
+                await self.release(conn, keep)
+        finally:
+            self._task = None
+        return done
+
 class domoticz_http_protocol:
     processcnt          = 1
+    coalesce            = True
+    pipeline            = 8
 
     def __init__(self) :
         self._log   = core._log
+        self._utils = core._utils
         self._log.debug("Protocol: domoticz http contruction")
         self._lock  = Event()
         # release lock, ready for next loop
@@ -44,13 +186,17 @@ class domoticz_http_protocol:
         self._user       = protocol['user']
         self._password   = protocol['password']
         self._queue      = queues.Queue(maxsize=100)
+        auth = None
+        if self._user: auth = self._user+":"+self._password
+        self._pool       = httppool(self._server, self._port, auth=auth)
         return self._queue
         
     def connect(self):
         self._log.debug("Protocol "+name+": connect")
         
-    def disconnect(self):
+    async def disconnect(self):
         self._log.debug("Protocol "+name+": disconnect")
+        await self._pool.close()
 
     def check(self):
         self._log.debug("Protocol "+name+": check")
@@ -61,8 +207,8 @@ class domoticz_http_protocol:
     def receive(self):
         self._log.debug("Protocol "+name+": recieve")
         
-    def send(self,devicedata):    
-        self._log.debug("Protocol "+name+": send "+devicedata["stype"])
+    def assemble(self,devicedata):    
+        self._log.debug("Protocol "+name+": assemble "+devicedata["stype"])
         # Assemble server url
         message = None
         # case
@@ -71,14 +217,6 @@ class domoticz_http_protocol:
             # case SENSOR_TYPE_SINGLE
             if devicedata["stype"] == core.SENSOR_TYPE_SINGLE:
                 self._log.debug("Protocol "+name+": SENSOR_TYPE_SINGLE")
-                # Get plugin values
-                try:
-                    devicedata['valueV1'] = self._queue.get_nowait()
-                    devicedata['valueN1'] = self._queue.get_nowait()
-                except Exception:
-                    self._log.debug("Protocol "+name+" SENSOR_TYPE_SINGLE exception: Queue Emtpy!")
-                    break
-                
                 # Assemble http message
                 message = "/json.htm?type=command&param=udevice&idx="+str(devicedata["serverid"])+"&nvalue=0&svalue="+str(devicedata["valueV1"])+";0"
                 break
@@ -96,17 +234,6 @@ class domoticz_http_protocol:
             # case SENSOR_TYPE_TRIPLE
             if devicedata["stype"] == core.SENSOR_TYPE_TRIPLE:
                 self._log.debug("Protocol "+name+": SENSOR_TYPE_TRIPLE")
-                # Get plugin values
-                try:
-                    devicedata['valueV1'] = self._queue.get_nowait()
-                    devicedata['valueN1'] = self._queue.get_nowait()
-                    devicedata['valueV2'] = self._queue.get_nowait()
-                    devicedata['valueN2'] = self._queue.get_nowait()
-                    devicedata['valueV3'] = self._queue.get_nowait()
-                    devicedata['valueN3'] = self._queue.get_nowait()
-                except Exception:
-                    self._log.debug("Protocol "+name+" SENSOR_TYPE_TRIPLE exception: Queue Emtpy!")
-                    break
                 # Assemble http message
                 message = "/json.htm?type=command&param=udevice&idx="+str(devicedata["serverid"])+"&nvalue=0&svalue="+str(devicedata["valueV1"])+";0;"+str(devicedata["valueV2"])+";0;"+str(devicedata["valueV3"])+";0"
                 break
@@ -114,15 +241,6 @@ class domoticz_http_protocol:
             # case SENSOR_TYPE_TEMP_HUM
             if devicedata["stype"] == core.SENSOR_TYPE_TEMP_HUM:
                 self._log.debug("Protocol "+name+": SENSOR_TYPE_TEMP_HUM")
-                # Get plugin values
-                try:
-                    devicedata['valueV1'] = self._queue.get_nowait()
-                    devicedata['valueN1'] = self._queue.get_nowait()
-                    devicedata['valueV2'] = self._queue.get_nowait()
-                    devicedata['valueN2'] = self._queue.get_nowait()
-                except Exception:
-                    self._log.debug("Protocol "+name+" SENSOR_TYPE_TEMP_HUM exception: Queue Emtpy!")
-                    break
                 # Assemble http message
                 message = "/json.htm?type=command&param=udevice&idx="+str(devicedata["serverid"])+"&nvalue=0&svalue="+str(devicedata["valueV1"])+str(devicedata["valueV2"])+";0"
                 break
@@ -135,17 +253,6 @@ class domoticz_http_protocol:
             # case SENSOR_TYPE_TEMP_HUM_BARO
             if devicedata["stype"] == core.SENSOR_TYPE_TEMP_HUM_BARO:
                 self._log.debug("Protocol "+name+": SENSOR_TYPE_TEMP_HUM_BARO")
-                # Get plugin values
-                try:
-                    devicedata['valueV1'] = self._queue.get_nowait()
-                    devicedata['valueN1'] = self._queue.get_nowait()
-                    devicedata['valueV2'] = self._queue.get_nowait()
-                    devicedata['valueN2'] = self._queue.get_nowait()
-                    devicedata['valueV3'] = self._queue.get_nowait()
-                    devicedata['valueN3'] = self._queue.get_nowait()
-                except Exception:
-                    self._log.debug("Protocol "+name+" SENSOR_TYPE_TEMP_HUM_BARO exception: Queue Emtpy!")
-                    break
                 # Assemble http message
                 message = "/json.htm?type=command&param=udevice&idx="+str(devicedata["serverid"])+"&nvalue=0&svalue="+str(devicedata["valueV1"])+";0;"+str(devicedata["valueV2"])+";0;"+str(devicedata["valueV3"])+";0"
                 break
@@ -153,14 +260,6 @@ class domoticz_http_protocol:
             # case SENSOR_TYPE_SWITCH
             if devicedata["stype"] == core.SENSOR_TYPE_SWITCH:
                 self._log.debug("Protocol "+name+": SENSOR_TYPE_SWITCH")
-                # Get plugin values
-                try:
-                    devicedata['valueV1'] = self._queue.get_nowait()
-                    devicedata['valueN1'] = self._queue.get_nowait()
-                except Exception:
-                    self._log.debug("Protocol "+name+" SENSOR_TYPE_SWITCH exception: Queue Emtpy!")
-                    break
-
                 # Switches can have many values, domoticz only two: on or off
                 switch_on  = ['closed','press','double','long', 'on']
                 switch_off = ['open','release', 'off']    
@@ -194,29 +293,38 @@ class domoticz_http_protocol:
 
         if message != None: 
             self._log.debug("Protocol "+name+" message: "+"http://"+self._server+":"+str(self._port)+message)
-            # Send data
+        return message
+
+    async def send(self, messages):
+        # pipeline over a pooled connection, an idle connection closed by
+        # the server is retried once on a fresh one. Answered requests are
+        # never sent again: switch commands and counters must not repeat.
+        retry = 1
+        while messages:
             try:
-                response = urequests.get("http://"+self._server+":"+str(self._port)+message)
-                self._log.debug("Protocol "+name+" response: "+response.text)
-                response.close()
-            except OSError as e:
-                self._log.debug("Protocol "+name+" Exception: "+repr(e))
-            #self._log.debug("Protocol "+name+" response: "+resp.read().decode("utf-8"))
+                done = await self._pool.pipeline(messages)
+            except Exception as e:
+                done = self._pool.done
+                if done or not self._pool.reused or not retry: raise
+                self._log.debug("Protocol "+name+" retry: "+repr(e))
+                retry -= 1
+                continue
+            messages = messages[done:]
            
-    def process(self):
+    async def asyncprocess(self):
         # processing todo for protocol
         self._log.debug("Protocol "+name)
-        devicedata = {}
-        try:
-            while self._queue.get_nowait() != core.QUEUE_MESSAGE_START:
-                pass
-            devicedata['stype'] = self._queue.get_nowait()
-            devicedata['serverid'] = self._queue.get_nowait()
-            devicedata['unitname'] = self._queue.get_nowait()
-            devicedata['devicename'] = self._queue.get_nowait()
-        except Exception as e:
-            self._log.debug("Protocol "+name+" proces Exception: "+repr(e))
-        self.send(devicedata)
+        messages = []
+        # all queued device readings in one batch
+        for devicedata in self._utils.protocol_readqueue(self._queue, self.coalesce):
+            message = self.assemble(devicedata)
+            if message != None: messages.append(message)
+        # send in pipelined groups
+        for i in range(0, len(messages), self.pipeline):
+            try:
+                await self.send(messages[i:i+self.pipeline])
+            except Exception as e:
+                self._log.debug("Protocol "+name+" process Exception: "+repr(e))
 
         # release lock, ready for next processing
         self._lock.clear()
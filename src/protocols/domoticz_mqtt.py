@@ -11,7 +11,7 @@
 #
 
 import ujson, uasyncio.queues as queues
-from umqtt.robust import MQTTClient
+from umqtt.aio import MQTTClient
 from upyeasy import protocol as uprotocol, core
 from asyn import Event
 
@@ -29,9 +29,12 @@ template = "domoticz_mqtt.html"
 
 class domoticz_mqtt_protocol:
     processcnt          = 1
+    coalesce            = True
+    qos                 = 1
 
     def __init__(self) :
         self._log   = core._log
+        self._utils = core._utils
         self._log.debug("Protocol: domoticz mqtt contruction")
         self._lock  = Event()
         # release lock, ready for next loop
@@ -53,29 +56,25 @@ class domoticz_mqtt_protocol:
         return self._queue
         
     def connect(self):
-        self._log.debug("Protocol "+name+": connect")
-        return self._mq.reconnect()
+        # persistent session, the client (re)connects in the background
+        if not self._mq.isconnected():
+            self._log.debug("Protocol "+name+": connect")
+        self._mq.start()
 
-    def disconnect(self):
+    async def disconnect(self):
         self._log.debug("Protocol "+name+": disconnect")
-        self._mq.disconnect()
+        await self._mq.disconnect()
 
-    def check(self):
-        self._log.debug("Protocol "+name+": check")
-        self._mq.check_msg()
-        
     def status(self):
         self._log.debug("Protocol "+name+": status")
-        self._mq.ping()
+        return self._mq.isconnected()
 
-    def recieve(self):
+    async def recieve(self):
         self._log.debug("Protocol "+name+": recieve")
-        self._mq.subscribe(self.queue_in)
+        await self._mq.subscribe(self._queue_in, self.qos)
 
-    def send(self, devicedata):
+    async def send(self, devicedata):
         self._log.debug("Protocol "+name+": send "+devicedata["stype"])
-        # connect or reconnect to mqtt server
-        self.connect()
         mqttdata = None
         # case
         while True:
@@ -84,14 +83,6 @@ class domoticz_mqtt_protocol:
             # case SENSOR_TYPE_SINGLE
             if devicedata["stype"] == core.SENSOR_TYPE_SINGLE:
                 self._log.debug("Protocol "+name+": SENSOR_TYPE_SINGLE")
-                # Get plugin values
-                try:
-                    devicedata['valueV1'] = self._queue.get_nowait()
-                    devicedata['valueN1'] = self._queue.get_nowait()
-                except Exception as e:
-                    self._log.debug("Protocol "+name+" SENSOR_TYPE_SINGLE exception: "+repr(e))
-                    break
-                    
                 # Assemble mqtt message
                 mqttdata = {}
                 mqttdata["idx"] = devicedata["serverid"]
@@ -114,15 +105,6 @@ class domoticz_mqtt_protocol:
             # case SENSOR_TYPE_TEMP_HUM
             if devicedata["stype"] == core.SENSOR_TYPE_TEMP_HUM:
                 self._log.debug("Protocol "+name+": SENSOR_TYPE_TEMP_HUM")
-                # Get plugin values
-                try:
-                    devicedata['valueV1'] = self._queue.get_nowait()
-                    devicedata['valueN1'] = self._queue.get_nowait()
-                    devicedata['valueV2'] = self._queue.get_nowait()
-                    devicedata['valueN2'] = self._queue.get_nowait()
-                except Exception as e:
-                    self._log.debug("Protocol "+self._name+" SENSOR_TYPE_TEMP_HUM Exception: "+repr(e))
-                    break
                 # Assemble mqtt message
                 mqttdata = {}
                 mqttdata["idx"] = devicedata["serverid"]
@@ -139,17 +121,6 @@ class domoticz_mqtt_protocol:
             # case SENSOR_TYPE_TEMP_HUM_BARO
             if devicedata["stype"] == core.SENSOR_TYPE_TEMP_HUM_BARO:
                 self._log.debug("Protocol "+name+": SENSOR_TYPE_TEMP_HUM_BARO")
-                # Get plugin values
-                try:
-                    devicedata['valueV1'] = self._queue.get_nowait()
-                    devicedata['valueN1'] = self._queue.get_nowait()
-                    devicedata['valueV2'] = self._queue.get_nowait()
-                    devicedata['valueN2'] = self._queue.get_nowait()
-                    devicedata['valueV3'] = self._queue.get_nowait()
-                    devicedata['valueN3'] = self._queue.get_nowait()
-                except Exception as e:
-                    self._log.debug("Protocol "+self._name+" SENSOR_TYPE_TEMP_HUM_BARO Exception: "+repr(e))
-                    break
                 # Assemble mqtt message
                 mqttdata = {}
                 mqttdata["idx"] = devicedata["serverid"]
@@ -161,14 +132,6 @@ class domoticz_mqtt_protocol:
             # case SENSOR_TYPE_SWITCH
             if devicedata["stype"] == core.SENSOR_TYPE_SWITCH:
                 self._log.debug("Protocol "+name+": SENSOR_TYPE_SWITCH")
-                # Get plugin values
-                try:
-                    devicedata['valueV1'] = self._queue.get_nowait()
-                    devicedata['valueN1'] = self._queue.get_nowait()
-                except Exception as e:
-                    self._log.debug("Protocol "+self._name+" SENSOR_TYPE_SWITCH Exception: "+repr(e))
-                    break
-
                 # Switches can have many values, domoticz only two: on or off
                 switch_on  = ['closed','press','double','long']
                 switch_off = ['open','release']    
@@ -201,24 +164,18 @@ class domoticz_mqtt_protocol:
 
         if mqttdata != None: 
            self._log.debug("Protocol "+name+": Message: "+message)
-           self._mq.publish(self._queue_out, message)
+           await self._mq.publish(self._queue_out, message, qos=self.qos)
 
-    def process(self):
+    async def asyncprocess(self):
         # processing todo for protocol
         self._log.debug("Protocol "+name+" Processing...")
-        devicedata = {}
-        try:
-            while True:
-                message = self._queue.get_nowait() 
-                if message == core.QUEUE_MESSAGE_START:
-                    break
-            devicedata['stype'] = self._queue.get_nowait()
-            devicedata['serverid'] = self._queue.get_nowait()
-            devicedata['unitname'] = self._queue.get_nowait()
-            devicedata['devicename'] = self._queue.get_nowait()
-            self.send(devicedata)
-        except Exception as e:
-            self._log.debug("Protocol "+name+" process Exception: "+repr(e))
+        self.connect()
+        # all queued device readings in one batch
+        for devicedata in self._utils.protocol_readqueue(self._queue, self.coalesce):
+            try:
+                await self.send(devicedata)
+            except Exception as e:
+                self._log.debug("Protocol "+name+" process Exception: "+repr(e))
 
         # release lock, ready for next processing
         self._lock.clear()
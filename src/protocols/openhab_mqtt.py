@@ -12,7 +12,7 @@
 #         : code simplified to reduce duplication in send()
 
 import ujson, uasyncio.queues as queues  # replaced ujson by json (?) # uasyncio gives not found error (in Pycharm console)!
-from umqtt.robust import MQTTClient
+from umqtt.aio import MQTTClient
 from upyeasy import protocol as uprotocol, core
 from asyn import Event
 
@@ -30,9 +30,12 @@ template = "openhab_mqtt.html"
 
 class openhab_mqtt_protocol:
     processcnt          = 1
+    coalesce            = True
+    qos                 = 1
 
     def __init__(self) :
         self._log   = core._log
+        self._utils = core._utils
         self._log.debug("Protocol: openhab mqtt contruction")
         self._lock  = Event()
         # release lock, ready for next loop
@@ -52,35 +55,29 @@ class openhab_mqtt_protocol:
         self._pubstr     = protocol['publish'] #### added AJ
         self._queue_in   = protocol['subscribe']
         self._mq         = MQTTClient(self._client_id, self._server, self._port, self._user, self._password)
-        # Print diagnostic messages when retries/reconnects happens
-        self._mq.DEBUG = True
         self._queue      = queues.Queue(maxsize=100)
         return self._queue
         
     def connect(self):
-        self._log.debug("Protocol: "+name+": connect")
-        return self._mq.reconnect()
+        # persistent session, the client (re)connects in the background
+        if not self._mq.isconnected():
+            self._log.debug("Protocol: "+name+": connect")
+        self._mq.start()
 
-    def disconnect(self):
+    async def disconnect(self):
         self._log.debug("Protocol: "+name+": disconnect")
-        self._mq.disconnect()
+        await self._mq.disconnect()
 
-    def check(self):
-        self._log.debug("Protocol: "+name+": check")
-        self._mq.check_msg()
-        
     def status(self):
         self._log.debug("Protocol: "+name+": status")
-        self._mq.ping()
+        return self._mq.isconnected()
 
-    def recieve(self):
+    async def recieve(self):
         self._log.debug("Protocol: "+name+": recieve")
-        self._mq.subscribe(self.queue_in)
+        await self._mq.subscribe(self._queue_in, self.qos)
 
-    def send(self, devicedata):
+    async def send(self, devicedata):
         self._log.debug("Protocol: "+name+": send "+devicedata["stype"])
-        # connect or reconnect to mqtt server
-        self.connect()
         mqttdata1 = None
         mqttdata2 = None
         mqttdata3 = None
@@ -98,19 +95,8 @@ class openhab_mqtt_protocol:
             message2 = ''
             message3 = ''
 
-            # Get next plugin datavalues from utils.py, plugin_senddata(self, queuedata)
-            try:
-                devicedata['unitname'] = self._queue.get_nowait()
-                devicedata['devicename'] = self._queue.get_nowait()
-            except Exception as e:
-                self._log.debug("Protocol: "+name+" SENSOR_TYPE_SINGLE exception: "+repr(e))
-                break
-            
             # case SENSOR_TYPE_SINGLE
             if devicedata["stype"] == core.SENSOR_TYPE_SINGLE:
-                # get plugin values
-                devicedata['valueV1'] = self._queue.get_nowait()
-                devicedata['valueN1'] = self._queue.get_nowait()
                 # Assemble mqtt message
                 mqttdata1 = {}
                 mqttdata1['topic'] = devicedata['unitname']+"/"+devicedata['devicename']+"/"+devicedata['valueN1']
@@ -131,16 +117,6 @@ class openhab_mqtt_protocol:
             # case SENSOR_TYPE_TEMP_HUM
             if devicedata["stype"] == core.SENSOR_TYPE_TEMP_HUM :
                 self._log.debug("Protocol: "+name+": SENSOR_TYPE_TEMP_HUM")
-                # Get plugin values
-                try:
-                    devicedata['valueV1'] = self._queue.get_nowait()
-                    devicedata['valueN1'] = self._queue.get_nowait()
-                    devicedata['valueV2'] = self._queue.get_nowait()
-                    devicedata['valueN2'] = self._queue.get_nowait()
-                except Exception as e:
-                    self._log.debug("Protocol: "+self._name+" SENSOR_TYPE_TEMP_HUM Exception: "+repr(e))
-                    break
-                
                 # Assemble mqtt messages
                 mqttdata1 = {}
                 mqttdata1['topic'] = devicedata['unitname']+"/"+devicedata['devicename']+"/"+devicedata['valueN1']
@@ -160,17 +136,6 @@ class openhab_mqtt_protocol:
             # case SENSOR_TYPE_TEMP_HUM_BARO
             if devicedata["stype"] == core.SENSOR_TYPE_TEMP_HUM_BARO:
                 #self._log.debug("Protocol: "+name+": SENSOR_TYPE_TEMP_HUM_BARO")
-                # Get plugin values
-                try:
-                    devicedata['valueV1'] = self._queue.get_nowait()
-                    devicedata['valueN1'] = self._queue.get_nowait()
-                    devicedata['valueV2'] = self._queue.get_nowait()
-                    devicedata['valueN2'] = self._queue.get_nowait()
-                    devicedata['valueV3'] = self._queue.get_nowait()
-                    devicedata['valueN3'] = self._queue.get_nowait()
-                except Exception as e:
-                    self._log.debug("Protocol: "+self._name+" SENSOR_TYPE_TEMP_HUM_BARO Exception: "+repr(e))
-                    break
                 # Assemble mqtt topics for valueV1, V2, V3
                 mqttdata1 = {}
                 mqttdata1['topic'] = devicedata['unitname']+"/"+devicedata['devicename']+"/"+devicedata['valueN1']
@@ -189,13 +154,6 @@ class openhab_mqtt_protocol:
             # case SENSOR_TYPE_SWITCH
             if devicedata["stype"] == core.SENSOR_TYPE_SWITCH:
                 self._log.debug("Protocol: "+name+": SENSOR_TYPE_SWITCH")
-                # Get plugin values
-                try:
-                    devicedata['valueV1'] = self._queue.get_nowait()
-                    devicedata['valueN1'] = self._queue.get_nowait()
-                except Exception as e:
-                    self._log.debug("Protocol: "+self._name+" SENSOR_TYPE_SWITCH Exception: "+repr(e))
-                    break
                 # Switches can have many values, OpenHAB (usually) only two: 1 (=on) or 0 (=off)
                 switch_on  = ['closed','press','double','long', 'on']
                 switch_off = ['open','release', 'off']    
@@ -245,38 +203,33 @@ class openhab_mqtt_protocol:
         # publish datavalue1...
         if message1 != None:
             self._log.debug("Protocol: "+name+" Publish: Topic: "+self._queue_out1+", Message: "+message1 )
-            self._mq.publish(self._queue_out1, message1 )
+            await self._mq.publish(self._queue_out1, message1, qos=self.qos)
             
         # publish datavalue2 (if it exists)
         if devicedata.get('valueN2') != None:
             if message2 != None: 
                 self._log.debug("Protocol: "+name+" Publish: Topic: "+self._queue_out2+", Message: "+message2 )
-                self._mq.publish(self._queue_out2, message2 )
+                await self._mq.publish(self._queue_out2, message2, qos=self.qos)
 
         # publish datavalue3 (if it exists)
         if devicedata.get('valueN3') != None:
             if mqttdata3['msg'] != None: 
                 self._log.debug("Protocol: "+name+" Publish: Topic: "+self._queue_out3+", Message: "+message3 )
-                self._mq.publish(self._queue_out3, message3 )
+                await self._mq.publish(self._queue_out3, message3, qos=self.qos)
         
         # we may eventually need more, for example for Dummy device (4 values)...
         # End of send #
 
-    def process(self):
+    async def asyncprocess(self):
         # processing todo for protocol (main loop of protocol)
         self._log.debug("Protocol: "+name+" Processing...")
-        devicedata = {}
-        try:
-            while True:
-                message1 = self._queue.get_nowait() # keep reading from the protocol queue
-                if message1 == core.QUEUE_MESSAGE_START: # found "start" message
-                    break  # ready to read devicedata values
-            devicedata['stype'] = self._queue.get_nowait() # get sensor type
-            devicedata['serverid'] = self._queue.get_nowait() # get server id
-            #print("OHmqtt l 266: devicedata = ", devicedata)
-            self.send(devicedata) # go and get other datavalues as needed, and publish them to MQTT ...
-        except Exception as e:
-            self._log.debug("Protocol: "+name+" process Exception: "+repr(e))
+        self.connect()
+        # all queued device readings in one batch, with all datavalues from utils.py, plugin_senddata(self, queuedata)
+        for devicedata in self._utils.protocol_readqueue(self._queue, self.coalesce):
+            try:
+                await self.send(devicedata) # publish datavalues to MQTT ...
+            except Exception as e:
+                self._log.debug("Protocol: "+name+" process Exception: "+repr(e))
 
         # release lock, ready for next processing
         self._lock.clear()
@@ -0,0 +1,82 @@
+#          
+# Filename: route.py
+# Version : 0.1
+# Author  : Lisa Esselink
+# Purpose : Route class
+# Usage   : Routing table from device#value triggers to their subscribers
+#
+# Copyright (c) 2018 - Lisa Esselink. All rights reserved.  
+# Licensed under the Creative Commons Attribution-NonCommercial 4.0 International License.
+# See LICENSE file in the project root for full license information.  
+#
+import gc
+from . import core, db
+
+class routes(object):
+
+    def __init__(self) :
+        self._log       = core._log
+
+        self._log.debug("Routes: Load")
+        self._table     = {}
+        self._triggers  = {}
+        self._version   = None
+        self._none      = ([], [], [])
+
+    def settriggers(self, scriptname, triggers):
+        # script triggers only live in the script instance
+        if triggers: self._triggers[scriptname] = triggers
+        else: self._triggers.pop(scriptname, None)
+        self._version = None
+
+    def invalidate(self):
+        self._version = None
+
+    def _subscribers(self, triggername):
+        try:
+            return self._table[triggername]
+        except KeyError:
+            subscribers = self._table[triggername] = ([], [], [])
+            return subscribers
+
+    def build(self):
+        self._log.debug("Routes: Build routing table")
+        self._table = {}
+
+        # devices subscribe to a ; separated list of triggers
+        for device in db.deviceTable.public():
+            if device['enable'] == 'on' and device['valuesubscription']:
+                for triggername in device['valuesubscription'].split(';'):
+                    if triggername: self._subscribers(triggername.strip())[0].append(device)
+
+        # rules fire on every event they reference, ; separated
+        for rule in db.ruleTable.public():
+            if rule['enable'] == 'on' and rule['event']:
+                for triggername in rule['event'].split(';'):
+                    if triggername: self._subscribers(triggername)[1].append(rule)
+
+        # scripts fire on any trigger in their trigger dict
+        for script in db.scriptTable.public():
+            if script['enable'] == 'on' and script['name'] in self._triggers:
+                for triggername in set(self._triggers[script['name']].values()):
+                    self._subscribers(triggername)[2].append(script)
+
+        # Clean up!
+        gc.collect()
+
+    def get(self, triggername):
+        # rebuild only after a device, rule or script save
+        version = (db.deviceTable.version(), db.ruleTable.version(), db.scriptTable.version())
+        if version != self._version:
+            self.build()
+            self._version = version
+        return self._table.get(triggername, self._none)
+
+    def devices(self, triggername):
+        return self.get(triggername)[0]
+
+    def rules(self, triggername):
+        return self.get(triggername)[1]
+
+    def scripts(self, triggername):
+        return self.get(triggername)[2]
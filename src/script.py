@@ -35,6 +35,8 @@ class scripts(object):
         self._script_class = {}
         self._mod = {}
         self._triggers = {}
+        # compiled rules: filename -> (stamp, code, events)
+        self._rules = {}
         
     def init(self): 
         self._log.debug("Scripts: Init")
@@ -43,19 +45,13 @@ class scripts(object):
         self._scriptqueue = self._plugins.getscriptqueue()
         
         # put system boot message in queue!
-        self._scriptqueue.put_nowait(core.QUEUE_MESSAGE_START)
-        self._scriptqueue.put_nowait("System")
-        self._scriptqueue.put_nowait("Boot")
-        self._scriptqueue.put_nowait(True)
+        self._scriptqueue.put_nowait(core.valuemessage("System","Boot",True))
 
         # get plugins rulequeue
         self._rulequeue = self._plugins.getrulequeue()
         
         # put system boot message in queue!
-        self._rulequeue.put_nowait(core.QUEUE_MESSAGE_START)
-        self._rulequeue.put_nowait("System")
-        self._rulequeue.put_nowait("Boot")
-        self._rulequeue.put_nowait(True)
+        self._rulequeue.put_nowait(core.valuemessage("System","Boot",True))
         
         # create all script records
         self.loadscripts()
@@ -148,28 +144,12 @@ class scripts(object):
                 continue
             rulename = module[:-5]
             
-            # load rule file
+            # load and compile rule file, unless unchanged
             self._log.debug("Scripts: Load rule "+rulename)
-            rule_file = open("rules/{}".format(module), 'r')
-            content = rule_file.read()
-            rule_file.close()
-
-            # parse file content and get event
-            matchcontent = re.search( r'if (.*):', content)
-            if matchcontent:
-                # strip any comparison
-                matchcomp = re.search( r'(.*)[<>=!]', matchcontent.group(1))
-                if matchcomp: match = re.search( r'\'(.*)\'', matchcomp.group(1))
-                else: match = re.search( r'\'(.*)\'', matchcontent.group(1))
-                if match: 
-                    ruleevent = match.group(1)
-                    self._log.debug("Scripts: Rule: {}, event: {}".format(rulename,ruleevent))
-                else:
-                    self._log.warning("Scripts: Rule error, no event match 2: "+rulename)
-                    continue                                
-            else:
-                self._log.warning("Scripts: Rule error, no event match: "+rulename)
-                continue                
+            if not self.compilerule(module):
+                continue
+            ruleevent = ';'.join(self._rules[module][2])
+            self._log.debug("Scripts: Rule: {}, events: {}".format(rulename,ruleevent))
             
             # done, save rule
             self._log.debug("Scripts: Create rule Record: "+rulename)
@@ -186,8 +166,54 @@ class scripts(object):
             # Clean up!
             gc.collect()
 
+        # forget rules whose file is gone
+        for module in list(self._rules):
+            if module not in listdir: del self._rules[module]
+
         # Clean up!
         gc.collect()
+
+    def compilerule(self, module):
+        # compile rule file once, recompile only when size/mtime changed
+        filename = "rules/{}".format(module)
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            self._log.error("Scripts: Rule file not found: "+filename)
+            return False
+        stamp = (stat[6], stat[8])
+        if module in self._rules and self._rules[module][0] == stamp:
+            return True
+
+        rule_file = open(filename, 'r')
+        content = rule_file.read()
+        rule_file.close()
+
+        # index every event the rule references, one per if block
+        events = []
+        rest = content
+        while True:
+            match = re.search(r"event\[['\"]([^'\"]+)['\"]\]", rest)
+            if not match: break
+            if match.group(1) not in events: events.append(match.group(1))
+            rest = rest[rest.find(match.group(0))+len(match.group(0)):]
+        if not events:
+            self._log.warning("Scripts: Rule error, no event match: "+module)
+            self._rules.pop(module, None)
+            return False
+
+        try:
+            code = compile(content, filename, 'exec')
+        except NameError:
+            # port without compile(), exec the source
+            code = content
+        except SyntaxError as e:
+            self._log.error("Scripts: Rule: {}, syntax error: {}".format(module,repr(e)))
+            self._rules.pop(module, None)
+            return False
+
+        self._rules[module] = (stamp, code, events)
+        return True
         
     def initscript(self, script): 
         self._log.debug("Scripts: Init script: "+script['name'])
@@ -202,7 +228,9 @@ class scripts(object):
 
         # init script
         script['client_id'] = core.__logname__+self._utils.get_upyeasy_name()
-        if scriptname: self._triggers[scriptname] = self._script[scriptname].init(script)
+        if scriptname: 
+            self._triggers[scriptname] = self._script[scriptname].init(script)
+            core._routes.settriggers(scriptname, self._triggers[scriptname])
         
         # Clean up!
         gc.collect()
@@ -224,17 +252,19 @@ class scripts(object):
     def runrule(self, rule, devicedata): 
         self._log.debug("Rules: Run rule: "+rule['name'])
         self._rulename = rule['name']
-        # load rule file
-        rule_file = open("rules/{}".format(rule['filename']), 'r')
-        content = rule_file.read()
-        rule_file.close()
+        # get compiled rule
+        try:
+            stamp, code, events = self._rules[rule['filename']]
+        except KeyError:
+            self._log.error("Rules: Run rule: {}, not compiled".format(rule['name']))
+            return
 
-        # setup rule environment
-        event = {}
+        # setup rule environment, events that didn't fire are False
+        event = dict.fromkeys(events, False)
         event[devicedata['triggername']] = devicedata['value']
 
         try:
-            exec(content, {}, {'gpio':self.gpio,'timerSet':self.timerSet,'event':event})
+            exec(code, {}, {'gpio':self.gpio,'timerSet':self.timerSet,'event':event})
         except Exception as e:
             self._log.error("Rules: Run rule: {}, exception: {}".format(rule['name'],repr(e)))
         
@@ -246,31 +276,21 @@ class scripts(object):
         loop = asyncio.get_event_loop()
 
         while True:
-            # get scriptqueue message
-            devicedata = {}
+            # wait for scriptqueue messages, woken up by put, no polling
             try:
-                while await(self._scriptqueue.get()) != core.QUEUE_MESSAGE_START:
-                    # Give async a change to schedule something else
-                    await asyncio.sleep_ms(100)
-                devicedata['name'] = self._scriptqueue.get_nowait()
-                devicedata['valuename'] = self._scriptqueue.get_nowait()
-                devicedata['value'] = self._scriptqueue.get_nowait()
+                messages = [await self._scriptqueue.get()]
+                # drain all queued messages in the same wakeup
+                while not self._scriptqueue.empty():
+                    messages.append(self._scriptqueue.get_nowait())
             except Exception as e:
                 self._log.error("Script: scriptqueue proces Exception: "+repr(e))
-
-            # Assemble triggername
-            devicedata['triggername'] = devicedata['name']+'#'+devicedata['valuename']
+                continue
             
-            #print(devicedata)
             ### SCRIPTS
         
-            # process all scripts
-            scripts=db.scriptTable.public()
-                    
-            # Get all script values!
-            for script in scripts:
-                # skip not enabled scripts
-                if script['enable'] == 'on' and devicedata['triggername'] in self._triggers[script['name']].values(): 
+            for devicedata in messages:
+                # Get all subscribed, enabled scripts!
+                for script in core._routes.scripts(devicedata['triggername']):
                     # get scripts
                     if not self._script[script['name']]._lock.locked:
                         self._log.debug("Scripts: Scheduling Async processing script: "+script['name'])
@@ -282,7 +302,7 @@ class scripts(object):
                     await asyncio.sleep(0)
 
             # Give async a change to schedule something else
-            await asyncio.sleep_ms(100)
+            await asyncio.sleep(0)
 
     async def asyncrules(self):
         # Async coroutine to process all script work todo 
@@ -292,54 +312,36 @@ class scripts(object):
         loop = asyncio.get_event_loop()
 
         while True:
-            # get scriptqueue message
-            devicedata = {}
+            # wait for rulequeue messages, woken up by put, no polling
             try:
-                while await(self._rulequeue.get()) != core.QUEUE_MESSAGE_START:
-                    # Give async a change to schedule something else
-                    await asyncio.sleep_ms(100)
-                devicedata['name'] = self._rulequeue.get_nowait()
-                devicedata['valuename'] = self._rulequeue.get_nowait()
-                devicedata['value'] = self._rulequeue.get_nowait()
+                messages = [await self._rulequeue.get()]
+                # drain all queued messages in the same wakeup
+                while not self._rulequeue.empty():
+                    messages.append(self._rulequeue.get_nowait())
             except Exception as e:
-                self._log.error("Script: scriptqueue proces Exception: "+repr(e))
-
-            # Assemble triggername
-            devicedata['triggername'] = devicedata['name']+'#'+devicedata['valuename']
+                self._log.error("Script: rulequeue proces Exception: "+repr(e))
+                continue
 
-            # process all rules
-            rules=db.ruleTable.public()
+            for devicedata in messages:
+                ### RULES
 
-            # Get all rule values!
-            for rule in rules:
-                # skip not enabled rules
-                if rule['enable'] == 'on' and devicedata['triggername'] == rule['event']: 
+                # Get all subscribed, enabled rules!
+                for rule in core._routes.rules(devicedata['triggername']):
                     self._log.debug("Rules: Scheduling Async processing rule: "+rule['name'])
                     # run rule
                     self.runrule(rule, devicedata)
 
-            # Give async a change to schedule something else
-            await asyncio.sleep_ms(100)
+                ### DEVICES
 
-            ### DEVICES
-
-            # process all devices
-            devices=db.deviceTable.public()
-                    
-            # Get all device values!
-            for device in devices:
-                # skip not enabled devices
-                if device['enable'] == 'on' and devicedata['triggername'] in device['valuesubscription']: 
+                # Get all subscribed, enabled devices!
+                for device in core._routes.devices(devicedata['triggername']):
                     # Write data to plugin
                     self._plugins.write(device, devicedata)
                     
             # Give async a change to schedule something else
-            await asyncio.sleep_ms(100)
+            await asyncio.sleep(0)
 
     async def asynctimer(self, timer):
-        # put timer1 message in queue!
-        self._scriptqueue.put_nowait(core.QUEUE_MESSAGE_START)
-        self._scriptqueue.put_nowait("Rules")
-        self._scriptqueue.put_nowait("Timer")
-        self._scriptqueue.put_nowait(timer)
+        # put timer message in queue!
+        self._scriptqueue.put_nowait(core.valuemessage("Rules","Timer",timer))
                  
\ No newline at end of file
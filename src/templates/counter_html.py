@@ -0,0 +1,38 @@
+# Autogenerated file
+def render(info, plugindata):
+    yield """
+<!- DO NOT CHANGE LINE ABOVE! -->
+<TR>
+   <TD>Count Edge:
+   <TD>
+      <select name='edge'>
+      <option value='falling'"""
+    if plugindata['edge'] == 'falling':
+        yield """selected"""
+    yield """>Falling</option>
+      <option value='rising'"""
+    if plugindata['edge'] == 'rising':
+        yield """selected"""
+    yield """>Rising</option>
+      <option value='both'"""
+    if plugindata['edge'] == 'both':
+        yield """selected"""
+    yield """>Both</option>
+      </select>
+<TR>
+   <TD>Rate Window:
+   <TD><input type='text' name='window' maxlength='5' value='"""
+    yield str(plugindata['window'])
+    yield """'> Seconds
+<TR>
+   <TD>Store Total Every:
+   <TD><input type='text' name='store' maxlength='5' value='"""
+    yield str(plugindata['store'])
+    yield """'> Seconds
+<TR>
+   <TD>Total:
+   <TD>"""
+    yield str(plugindata['total'])
+    yield """ <input type='checkbox' name='reset'> Reset
+"""
+    yield str(plugindata['content'])
@@ -121,6 +121,44 @@ def render(info):
                <TD>Used Stack 
                <TD>"""
     yield str(info['stack'])
+    yield """
+            <TR>
+               <TD colspan='2'>
+                  <hr>
+                  <B>Web Server</B>
+            <TR>
+               <TD>Connections (active/peak/limit)
+               <TD>"""
+    yield str(info['webactive'])
+    yield """/"""
+    yield str(info['web']['peak'])
+    yield """/"""
+    yield str(info['weblimit'])
+    yield """
+            <TR>
+               <TD>Accepted
+               <TD>"""
+    yield str(info['web']['accepted'])
+    yield """
+            <TR>
+               <TD>Queued
+               <TD>"""
+    yield str(info['web']['queued'])
+    yield """
+            <TR>
+               <TD>Rejected (busy)
+               <TD>"""
+    yield str(info['web']['rejected'])
+    yield """
+            <TR>
+               <TD>Rejected (low memory)
+               <TD>"""
+    yield str(info['web']['lowmem'])
+    yield """
+            <TR>
+               <TD>Timeouts
+               <TD>"""
+    yield str(info['web']['timeouts'])
     yield """
             <TR>
                <TD colspan='2'>
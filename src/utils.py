@@ -9,13 +9,85 @@
 # See LICENSE file in the project root for full license information.  
 #
 
+import ujson, uasyncio as asyncio, uasyncio.queues as queues
 from . import core, db
 from .db import _dbc
 
+class eventbuffer(object):
+    # Bounded buffer of encoded events for one live client, drop oldest when full
+
+    def __init__(self, size):
+        self._size      = size
+        self._events    = []
+        self._task      = None
+        self._armed     = False
+        self.dropped    = 0
+
+    def put(self, event):
+        if len(self._events) >= self._size:
+            self._events.pop(0)
+            self.dropped += 1
+        self._events.append(event)
+        self._wake()
+
+    def _wake(self):
+        if self._task is not None:
+            task, self._task = self._task, None
+            asyncio.get_event_loop().call_soon(task)
+
+    def _timeout(self):
+        self._armed = False
+        self._wake()
+
+    def get(self, timeout_ms):
+        # wait for events, empty list on timeout; at most one timer is
+        # pending per client so busy streams don't flood the timer queue
+        if not self._events:
+            loop = asyncio.get_event_loop()
+            self._task = loop.cur_task
+            if not self._armed:
+                self._armed = True
+                loop.call_later_ms(timeout_ms, self._timeout)
+            yield False
+        events, self._events = self._events, []
+        return events
+
+class wakequeue(queues.Queue):
+    # Queue whose get() parks the task until a put wakes it, no polling
+
+    def __init__(self, maxsize=0):
+        super().__init__(maxsize)
+        self._getters   = []
+
+    def get(self):
+        while not self._queue:
+            task = asyncio.get_event_loop().cur_task
+            self._getters.append(task)
+            # mark the task parked, like IORead/IOWrite, so cancel() and
+            # wait_for() reschedule it with the exception
+            task.pend_throw(False)
+            try:
+                yield False
+            finally:
+                # cancelled or timed out getters must not stay parked
+                if task in self._getters: self._getters.remove(task)
+        return self._get()
+
+    def _put(self, val):
+        self._queue.append(val)
+        if self._getters:
+            task = self._getters.pop(0)
+            task.pend_throw(None)
+            asyncio.get_event_loop().call_soon(task)
+
 class utils(object):
 
     def __init__(self):
         self._log = core._log
+        # last reading per device: devicename -> [time, {valuename: value}]
+        self._lastvalues = {}
+        # live event clients, see subscribe_events()
+        self._eventclients = []
         
     def setnet(self, spi_nr, cs, rst, ip, gtw, mask, dns):
         #self._log.debug("setnet: "+ip+"/"+gtw+"/"+mask+"/"+dns)
@@ -171,39 +243,15 @@ class utils(object):
             
         return uform
 
-    def map_form2db(self,dbtable, uform):
+    def map_form2db(self, table, dbtable, uform):
         # get db dict and form dict and map them so that db keys have right value from form
-        #print(type(dbtable))
-        #print(uform)
-        #print(dbtable)
+        # values are typed by the table schema, only submitted fields are visited
 
         if not dbtable or not uform:
            self._log.warning("Utils: map_form2db not all input available");
            return None
         
-        # compare keys and if they match: copy value over
-        for key in dbtable:
-            # DB Key in form?
-            if key in uform:
-                # String or not?
-                if type(uform[key]) is str:
-                    # Positive Number ?
-                    if uform[key].isdigit():
-                        dbtable[key] = int(uform[key])
-                    elif uform[key].lstrip("-").isdigit():
-                        # Negative number
-                        dbtable[key] = int(uform[key])
-                    elif uform[key].replace('.','',1).isdigit():
-                        # Float!
-                        dbtable[key] = float(uform[key])
-                    else: 
-                        # No number or float
-                        dbtable[key] = uform[key]
-                else: dbtable[key] = uform[key]
-        
-        #print(dbtable)
-        
-        return dbtable
+        return table.from_form(dbtable, uform)
 
     def get_dbversion(self):
         config = db.configTable.getrow()
@@ -240,10 +288,28 @@ class utils(object):
             self._log.warning("Utils: Senddata value queue not existing!")
             return
 
-        # full queue, no deal
-        if queuedata.valuequeue.full():  # Value queue
-            self._log.warning("Utils: Senddata value queue full!")
+        # get number of values to send
+        valuecnt = core.SENSOR_TYPE_VALUES.get(queuedata.stype)
+        if valuecnt == None:
+            self._log.error("Utils: Senddata unknown sensor type!")
             return
+        # sensor type not send (yet)
+        if not valuecnt: return
+
+        # last-value store, updated in place
+        last = self._lastvalues.get(queuedata.devicename)
+        if last is None:
+            last = self._lastvalues[queuedata.devicename] = [0, {}]
+        last[0] = core._hal.get_time_sec()
+        keys = core.VALUE_KEYS[:valuecnt]
+        for nkey, vkey in keys:
+            last[1][queuedata.valuenames[nkey]] = queuedata.valuenames[vkey]
+
+        # live event stream, encoded once for all clients
+        if self._eventclients:
+            event = "data: "+ujson.dumps({"device":queuedata.devicename, "time":last[0], "values":last[1]})+"\n\n"
+            for client in self._eventclients:
+                client.put(event)
 
         # check if rules/scripts are needed!
         advanced = db.advancedTable.getrow()
@@ -252,321 +318,62 @@ class utils(object):
         # Read unitname and put into queuedata
         queuedata.valuenames['unitname'] = self.get_upyeasy_name() # AJ added for OHmqtt
 
-        # Value queue...
-        # Put start message in value queue
-        queuedata.valuequeue.put_nowait(core.QUEUE_MESSAGE_START)
-        # Put device/plugin name in value queue
-        queuedata.valuequeue.put_nowait(queuedata.devicename)
-        # put  first valuename datavalue into value queue
-        queuedata.valuequeue.put_nowait(queuedata.valuenames['valueN1'])
-
-        # Protocol queue...
+        # Protocol queue, one message with all values
         if queuedata.queue: # Protocol queue for Domoticz, Openhab etc
-            # Put start message in protocol queue
-            queuedata.queue.put_nowait(core.QUEUE_MESSAGE_START)
-            # put sensor type in protocol queue
-            queuedata.queue.put_nowait(queuedata.stype)
-            # put HA server id in protocol queue
-            queuedata.queue.put_nowait(queuedata.queue_sid)
-            
-            # Additional parameters for use by Openhab MQTT protocol (for all sensor types) (AJ)
-            queuedata.queue.put_nowait(queuedata.valuenames['unitname']) # aka upyeasyname
-            queuedata.queue.put_nowait(queuedata.valuenames['devicename']) # given name of device/plugin
-
-        if advanced["scripts"] == "on": 
-            # Scrip queue...
-            # Put start message in script queue
-            queuedata.scriptqueue.put_nowait(core.QUEUE_MESSAGE_START)
-            # Put device/plugin name in script queue
-            queuedata.scriptqueue.put_nowait(queuedata.devicename)
-            # put  first valuename datavalue into script queue
-            queuedata.scriptqueue.put_nowait(queuedata.valuenames['valueN1'])
-
-        if advanced["rules"] == "on": 
-            # Rule queue...
-            # Put start message in Rule queue
-            queuedata.rulequeue.put_nowait(core.QUEUE_MESSAGE_START)
-            # Put device/plugin name in Rule queue
-            queuedata.rulequeue.put_nowait(queuedata.devicename)
-            # put  first valuename datavalue into Rule queue
-            queuedata.rulequeue.put_nowait(queuedata.valuenames['valueN1'])
-        
-        # Start of code for specific sensor types...
-        while True:
-            # case SENSOR_TYPE_SINGLE
-            if queuedata.stype == core.SENSOR_TYPE_SINGLE:
-                # put first data value in value queue (order to match script.py)
-                queuedata.valuequeue.put_nowait(queuedata.valuenames["valueV1"]) # (name done in general section)
-
-                if queuedata.queue:
-                    # put valuedata and name in protocol queue
-                    queuedata.queue.put_nowait(queuedata.valuenames['valueV1'])
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueN1"])
-
-                if advanced["scripts"] == "on": 
-                    # put first data value in script queue (order to match script.py)
-                    queuedata.scriptqueue.put_nowait(queuedata.valuenames["valueV1"]) # (name done in general section)
-
-                if advanced["rules"] == "on": 
-                    # put first data value in rule queue (order to match script.py)
-                    queuedata.rulequeue.put_nowait(queuedata.valuenames["valueV1"]) # (name done in general section)
-
-                break
-
-            # case SENSOR_TYPE_LONG
-            if queuedata.stype == core.SENSOR_TYPE_LONG:
-                break
-
-            # case SENSOR_TYPE_DUAL
-            if queuedata.stype == core.SENSOR_TYPE_DUAL:
-                # put valuenames and valuees in value queue
-                queuedata.valuequeue.put_nowait(queuedata.valuenames["valueV1"]) # (name done in general section)
-                # start second block of data
-                queuedata.valuequeue.put_nowait(core.QUEUE_MESSAGE_START)
-                queuedata.valuequeue.put_nowait(queuedata.devicename)
-                queuedata.valuequeue.put_nowait(queuedata.valuenames["valueN2"])
-                queuedata.valuequeue.put_nowait(queuedata.valuenames["valueV2"])
-                
-                if queuedata.queue:
-                    # put valuedata and names in protocol queue
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueV1"])
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueN1"])
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueV2"])
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueN2"])
-                
-                if advanced["scripts"] == "on": 
-                    # put valuenames and valuees in script queue
-                    queuedata.scriptqueue.put_nowait(queuedata.valuenames["valueV1"]) # (name done in general section)
-                    # start second block of data
-                    queuedata.scriptqueue.put_nowait(core.QUEUE_MESSAGE_START)
-                    queuedata.scriptqueue.put_nowait(queuedata.devicename)
-                    queuedata.scriptqueue.put_nowait(queuedata.valuenames["valueN2"])
-                    queuedata.scriptqueue.put_nowait(queuedata.valuenames["valueV2"])
-                
-                if advanced["rules"] == "on": 
-                    # put valuenames and valuees in rule queue
-                    queuedata.rulequeue.put_nowait(queuedata.valuenames["valueV1"]) # (name done in general section)
-                    # start second block of data
-                    queuedata.rulequeue.put_nowait(core.QUEUE_MESSAGE_START)
-                    queuedata.rulequeue.put_nowait(queuedata.devicename)
-                    queuedata.rulequeue.put_nowait(queuedata.valuenames["valueN2"])
-                    queuedata.rulequeue.put_nowait(queuedata.valuenames["valueV2"])
-                
-                break
-
-            # case SENSOR_TYPE_TRIPLE
-            if queuedata.stype == core.SENSOR_TYPE_TRIPLE:
-                # put first value in value queue
-                queuedata.valuequeue.put_nowait(queuedata.valuenames["valueV1"]) # (name done in general section)
-                # second block of data for value queue
-                queuedata.valuequeue.put_nowait(core.QUEUE_MESSAGE_START)
-                queuedata.valuequeue.put_nowait(queuedata.devicename)
-                queuedata.valuequeue.put_nowait(queuedata.valuenames["valueN2"])
-                queuedata.valuequeue.put_nowait(queuedata.valuenames["valueV2"])
-                # third block of data for value queue
-                queuedata.valuequeue.put_nowait(core.QUEUE_MESSAGE_START)
-                queuedata.valuequeue.put_nowait(queuedata.devicename)
-                queuedata.valuequeue.put_nowait(queuedata.valuenames["valueN3"])
-                queuedata.valuequeue.put_nowait(queuedata.valuenames["valueV3"])
-                
-                if queuedata.queue:
-                    # put valuedata and names in protocol queue
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueV1"])
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueN1"])
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueV2"])
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueN2"])
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueV3"])
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueN3"])
-                    
-                if advanced["scripts"] == "on": 
-                    # put first value in script queue
-                    queuedata.scriptqueue.put_nowait(queuedata.valuenames["valueV1"]) # (name done in general section)
-                    # second block of data for script queue
-                    queuedata.scriptqueue.put_nowait(core.QUEUE_MESSAGE_START)
-                    queuedata.scriptqueue.put_nowait(queuedata.devicename)
-                    queuedata.scriptqueue.put_nowait(queuedata.valuenames["valueN2"])
-                    queuedata.scriptqueue.put_nowait(queuedata.valuenames["valueV2"])
-                    # third block of data for script queue
-                    queuedata.scriptqueue.put_nowait(core.QUEUE_MESSAGE_START)
-                    queuedata.scriptqueue.put_nowait(queuedata.devicename)
-                    queuedata.scriptqueue.put_nowait(queuedata.valuenames["valueN3"])
-                    queuedata.scriptqueue.put_nowait(queuedata.valuenames["valueV3"])
-                
-                if advanced["rules"] == "on": 
-                    # put first value in rule queue
-                    queuedata.rulequeue.put_nowait(queuedata.valuenames["valueV1"]) # (name done in general section)
-                    # second block of data for rule queue
-                    queuedata.rulequeue.put_nowait(core.QUEUE_MESSAGE_START)
-                    queuedata.rulequeue.put_nowait(queuedata.devicename)
-                    queuedata.rulequeue.put_nowait(queuedata.valuenames["valueN2"])
-                    queuedata.rulequeue.put_nowait(queuedata.valuenames["valueV2"])
-                    # third block of data for rule queue
-                    queuedata.rulequeue.put_nowait(core.QUEUE_MESSAGE_START)
-                    queuedata.rulequeue.put_nowait(queuedata.devicename)
-                    queuedata.rulequeue.put_nowait(queuedata.valuenames["valueN3"])
-                    queuedata.rulequeue.put_nowait(queuedata.valuenames["valueV3"])
-                
-                break
-
-            # case SENSOR_TYPE_TEMP_HUM
-            if queuedata.stype == core.SENSOR_TYPE_TEMP_HUM:
-                # put valuenames and valuees in value queue
-                queuedata.valuequeue.put_nowait(queuedata.valuenames["valueV1"]) # (name done in general section)
-                # start second block of data
-                queuedata.valuequeue.put_nowait(core.QUEUE_MESSAGE_START)
-                queuedata.valuequeue.put_nowait(queuedata.devicename)
-                queuedata.valuequeue.put_nowait(queuedata.valuenames["valueN2"])
-                queuedata.valuequeue.put_nowait(queuedata.valuenames["valueV2"])
-                
-                if queuedata.queue:
-                    # put valuedata and names in protocol queue
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueV1"])
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueN1"])
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueV2"])
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueN2"])
-                
-                if advanced["scripts"] == "on": 
-                    # put valuenames and valuees in script queue
-                    queuedata.scriptqueue.put_nowait(queuedata.valuenames["valueV1"]) # (name done in general section)
-                    # start second block of data
-                    queuedata.scriptqueue.put_nowait(core.QUEUE_MESSAGE_START)
-                    queuedata.scriptqueue.put_nowait(queuedata.devicename)
-                    queuedata.scriptqueue.put_nowait(queuedata.valuenames["valueN2"])
-                    queuedata.scriptqueue.put_nowait(queuedata.valuenames["valueV2"])
-                
-                if advanced["rules"] == "on": 
-                    # put valuenames and valuees in rule queue
-                    queuedata.rulequeue.put_nowait(queuedata.valuenames["valueV1"]) # (name done in general section)
-                    # start second block of data
-                    queuedata.rulequeue.put_nowait(core.QUEUE_MESSAGE_START)
-                    queuedata.rulequeue.put_nowait(queuedata.devicename)
-                    queuedata.rulequeue.put_nowait(queuedata.valuenames["valueN2"])
-                    queuedata.rulequeue.put_nowait(queuedata.valuenames["valueV2"])
-                
-                break
-
-            # case SENSOR_TYPE_TEMP_BARO
-            if queuedata.stype == core.SENSOR_TYPE_TEMP_BARO:
-                # put first value in value queue
-                queuedata.valuequeue.put_nowait(queuedata.valuenames["valueV1"]) # (name done in general section)
-                # second block of data for value queue
-                queuedata.valuequeue.put_nowait(core.QUEUE_MESSAGE_START)
-                queuedata.valuequeue.put_nowait(queuedata.devicename)
-                queuedata.valuequeue.put_nowait(queuedata.valuenames["valueN2"])
-                queuedata.valuequeue.put_nowait(queuedata.valuenames["valueV2"])
-                
-                if queuedata.queue:
-                    # put valuedata and names in protocol queue
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueV1"])
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueN1"])
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueV2"])
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueN2"])
-               
-                if advanced["scripts"] == "on": 
-                    # put first value in script queue
-                    queuedata.scriptqueue.put_nowait(queuedata.valuenames["valueV1"]) # (name done in general section)
-                    # second block of data for script queue
-                    queuedata.scriptqueue.put_nowait(core.QUEUE_MESSAGE_START)
-                    queuedata.scriptqueue.put_nowait(queuedata.devicename)
-                    queuedata.scriptqueue.put_nowait(queuedata.valuenames["valueN2"])
-                    queuedata.scriptqueue.put_nowait(queuedata.valuenames["valueV2"])
-                
-                if advanced["rules"] == "on": 
-                    # put first value in rule queue
-                    queuedata.rulequeue.put_nowait(queuedata.valuenames["valueV1"]) # (name done in general section)
-                    # second block of data for rule queue
-                    queuedata.rulequeue.put_nowait(core.QUEUE_MESSAGE_START)
-                    queuedata.rulequeue.put_nowait(queuedata.devicename)
-                    queuedata.rulequeue.put_nowait(queuedata.valuenames["valueN2"])
-                    queuedata.rulequeue.put_nowait(queuedata.valuenames["valueV2"])
-                
-                break
-
-            # case SENSOR_TYPE_TEMP_HUM_BARO
-            if queuedata.stype == core.SENSOR_TYPE_TEMP_HUM_BARO:
-                # put first value in value queue
-                queuedata.valuequeue.put_nowait(queuedata.valuenames["valueV1"]) # (name done in general section)
-                # second block of data for value queue
-                queuedata.valuequeue.put_nowait(core.QUEUE_MESSAGE_START)
-                queuedata.valuequeue.put_nowait(queuedata.devicename)
-                queuedata.valuequeue.put_nowait(queuedata.valuenames["valueN2"])
-                queuedata.valuequeue.put_nowait(queuedata.valuenames["valueV2"])
-                # third block of data for value queue
-                queuedata.valuequeue.put_nowait(core.QUEUE_MESSAGE_START)
-                queuedata.valuequeue.put_nowait(queuedata.devicename)
-                queuedata.valuequeue.put_nowait(queuedata.valuenames["valueN3"])
-                queuedata.valuequeue.put_nowait(queuedata.valuenames["valueV3"])
-                
-                if queuedata.queue:
-                    # put valuedata and names in protocol queue
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueV1"])
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueN1"])
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueV2"])
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueN2"])
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueV3"])
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueN3"])
-                    
-                if advanced["scripts"] == "on": 
-                    # put first value in script queue
-                    queuedata.scriptqueue.put_nowait(queuedata.valuenames["valueV1"]) # (name done in general section)
-                    # second block of data for script queue
-                    queuedata.scriptqueue.put_nowait(core.QUEUE_MESSAGE_START)
-                    queuedata.scriptqueue.put_nowait(queuedata.devicename)
-                    queuedata.scriptqueue.put_nowait(queuedata.valuenames["valueN2"])
-                    queuedata.scriptqueue.put_nowait(queuedata.valuenames["valueV2"])
-                    # third block of data for script queue
-                    queuedata.scriptqueue.put_nowait(core.QUEUE_MESSAGE_START)
-                    queuedata.scriptqueue.put_nowait(queuedata.devicename)
-                    queuedata.scriptqueue.put_nowait(queuedata.valuenames["valueN3"])
-                    queuedata.scriptqueue.put_nowait(queuedata.valuenames["valueV3"])
-                
-                if advanced["rules"] == "on": 
-                    # put first value in rule queue
-                    queuedata.rulequeue.put_nowait(queuedata.valuenames["valueV1"]) # (name done in general section)
-                    # second block of data for rule queue
-                    queuedata.rulequeue.put_nowait(core.QUEUE_MESSAGE_START)
-                    queuedata.rulequeue.put_nowait(queuedata.devicename)
-                    queuedata.rulequeue.put_nowait(queuedata.valuenames["valueN2"])
-                    queuedata.rulequeue.put_nowait(queuedata.valuenames["valueV2"])
-                    # third block of data for rule queue
-                    queuedata.rulequeue.put_nowait(core.QUEUE_MESSAGE_START)
-                    queuedata.rulequeue.put_nowait(queuedata.devicename)
-                    queuedata.rulequeue.put_nowait(queuedata.valuenames["valueN3"])
-                    queuedata.rulequeue.put_nowait(queuedata.valuenames["valueV3"])
-                
-                break
-
-            # case SENSOR_TYPE_SWITCH
-            if queuedata.stype == core.SENSOR_TYPE_SWITCH:
-                # put valuename and value in value queue
-                queuedata.valuequeue.put_nowait(queuedata.valuenames["valueV1"])
-
-                if queuedata.queue:
-                    # put valuedata and name in protocol queue
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueV1"])
-                    queuedata.queue.put_nowait(queuedata.valuenames["valueN1"])
-
-                if advanced["scripts"] == "on": 
-                    # put valuename and value in script queue
-                    queuedata.scriptqueue.put_nowait(queuedata.valuenames["valueV1"])
-
-                if advanced["rules"] == "on": 
-                    # put valuename and value in rule queue
-                    queuedata.rulequeue.put_nowait(queuedata.valuenames["valueV1"])
-
-                break
-
-            # case SENSOR_TYPE_DIMMER
-            if queuedata.stype == core.SENSOR_TYPE_DIMMER:
-                break
-
-            # case SENSOR_TYPE_WIND
-            if queuedata.stype == core.SENSOR_TYPE_WIND:
-                break
-
-            # else UNKNOWN
-            self._log.error("Utils: Senddata unknown sensor type!")
-            break
+            if queuedata.queue.full():
+                self._log.warning("Utils: Senddata protocol queue full!")
+            else:
+                # Additional parameters for use by Openhab MQTT protocol (for all sensor types) (AJ)
+                # new message per reading: queued readings are never overwritten
+                message = core.devicemessage(queuedata.stype, queuedata.queue_sid, queuedata.valuenames['unitname'], queuedata.valuenames['devicename'])
+                for nkey, vkey in keys:
+                    message[vkey] = queuedata.valuenames[vkey]
+                    message[nkey] = queuedata.valuenames[nkey]
+                queuedata.queue.put_nowait(message)
+
+        # Value, script and rule queues, one message per value
+        queues = [(queuedata.valuequeue, "value")]
+        if advanced["scripts"] == "on": queues.append((queuedata.scriptqueue, "script"))
+        if advanced["rules"] == "on": queues.append((queuedata.rulequeue, "rule"))
+
+        for nkey, vkey in keys:
+            message = core.valuemessage(queuedata.devicename, queuedata.valuenames[nkey], queuedata.valuenames[vkey])
+            for queue, qname in queues:
+                # full queue, no deal
+                if queue.full():
+                    self._log.warning("Utils: Senddata "+qname+" queue full!")
+                else:
+                    queue.put_nowait(message)
+
+    def get_lastvalues(self, devicename=None):
+        # all last readings, or one device's (None if never read)
+        if devicename is None: return self._lastvalues
+        return self._lastvalues.get(devicename)
+
+    def subscribe_events(self, size=16):
+        # new live event client, fed by plugin_senddata
+        client = eventbuffer(size)
+        self._eventclients.append(client)
+        return client
+
+    def unsubscribe_events(self, client):
+        if client in self._eventclients: self._eventclients.remove(client)
+
+    def protocol_readqueue(self, queue, coalesce=True):
+        # drain all queued device readings
+        readings = []
+        values   = {}
+        while not queue.empty():
+            devicedata = queue.get_nowait()
+            # coalesce: latest reading per device value wins, switch events are never dropped
+            if coalesce and devicedata['stype'] != core.SENSOR_TYPE_SWITCH:
+                key = (devicedata['devicename'], devicedata['valueN1'])
+                if key in values:
+                    readings[values[key]] = devicedata
+                    continue
+                values[key] = len(readings)
+            readings.append(devicedata)
+        return readings
 
     def plugin_initdata(self, data, plugin, device, queue, scriptqueue, rulequeue, valuequeue):
         data.pullup             = plugin['pullup'] # 0=false, 1=true